@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+
+"""
+A load generator for the height prediction server.
+
+    python benchmarks/load_prediction.py                     # starts a server
+    python benchmarks/load_prediction.py --url http://127.0.0.1:8001/
+    python benchmarks/load_prediction.py --concurrency 1 16 64 --batch 1 10
+
+Each of --concurrency threads posts synthetic People records (see
+data_analysis/local_swapi.py) to /predict, --batch records per request, as
+fast as it gets answers, for --duration seconds. For every combination the
+p50, p90 and p99 request latency and the throughput in requests and records
+per second are printed.
+
+Without --url, a server is started in this process around the saved model
+(assets/json/height_model.json, see "star_wars.py train").
+"""
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.normpath(os.path.join(BENCH_DIR, '..'))
+# so the benchmark also runs from a checkout that hasn't been pip installed
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import numpy as np
+from data_analysis import local_swapi
+from data_analysis import prediction
+
+
+def post(url, records):
+    req = urllib.request.Request(url, data=json.dumps(records).encode(),
+                                 headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req) as r:
+        return json.loads(r.read())
+
+def run_load(url, people, concurrency, batch, duration):
+    """ Output:
+            dict - 'latency' (numpy array of seconds, one per request),
+            'errors' and 'seconds'
+    """
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0]*concurrency
+    stop = time.perf_counter() + duration
+
+    def worker(w):
+        i = w*batch
+        while time.perf_counter() < stop:
+            records = [people[(i + j) % len(people)] for j in range(batch)]
+            i += concurrency*batch
+            t0 = time.perf_counter()
+            try:
+                post(url, records)
+            except OSError:
+                errors[w] += 1
+                continue
+            latencies[w].append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(w,))
+               for w in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {'latency': np.array([l for ls in latencies for l in ls]),
+            'errors': sum(errors), 'seconds': time.perf_counter() - t0}
+
+def report(concurrency, batch, result):
+    lat = result['latency']*1000
+    n = len(lat)
+    p50, p90, p99 = np.percentile(lat, [50, 90, 99]) if n else [np.nan]*3
+    print('{:>6} {:>6} {:>9.2f} {:>9.2f} {:>9.2f} {:>10.0f} {:>10.0f} '
+          '{:>7}'.format(concurrency, batch, p50, p90, p99,
+                         n/result['seconds'], n*batch/result['seconds'],
+                         result['errors']))
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the height '
+                                                 'prediction server.')
+    parser.add_argument('--url', default=None,
+                        help='a running server (defaults to starting one)')
+    parser.add_argument('--model', default=None,
+                        help='the saved model for the started server')
+    parser.add_argument('--concurrency', type=int, nargs='+',
+                        default=[1, 8, 32])
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--people', type=int, default=10000,
+                        help='the number of distinct synthetic records')
+    args = parser.parse_args()
+    server = None
+    if args.url is None:
+        server, args.url = prediction.serve(args.model)
+    url = args.url.rstrip('/') + '/predict'
+    people = list(local_swapi.SyntheticPeople(args.people))
+    print('{:>6} {:>6} {:>9} {:>9} {:>9} {:>10} {:>10} {:>7}'.format(
+        'conc', 'batch', 'p50 ms', 'p90 ms', 'p99 ms', 'req/s', 'rec/s',
+        'errors'))
+    for c in args.concurrency:
+        for b in args.batch:
+            report(c, b, run_load(url, people, c, b, args.duration))
+    if server:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
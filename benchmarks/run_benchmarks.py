@@ -0,0 +1,303 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+"""
+Benchmarks for ingestion, cleanup, masking and rendering.
+
+    python benchmarks/run_benchmarks.py                  # all, default sizes
+    python benchmarks/run_benchmarks.py --sizes 87 10000 --only cleanup
+    python benchmarks/run_benchmarks.py --compare results/a.json results/b.json
+
+Each benchmark is run at every requested dataset size (rows), and the best of
+--repeat runs is kept. Results are written to benchmarks/results/ as JSON,
+named after the current commit, so runs from different commits can be
+compared with --compare.
+
+Network benchmarks go to a local server (see data_analysis/local_swapi.py),
+never to the real API, and the response cache is turned off so every page is
+fetched.
+"""
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.normpath(os.path.join(BENCH_DIR, '..'))
+os.environ['SWAPI_CACHE'] = '0'
+# so the benchmarks also run from a checkout that hasn't been pip installed
+sys.path.insert(0, os.path.join(ROOT_DIR, 'src'))
+
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from data_analysis import df_utilities, web_utilities, async_crawler
+from data_analysis import crawl_job
+from data_analysis import iterators
+from data_analysis import aggregates
+from data_analysis import cooccurrence
+from data_analysis.masks import MaskEngine
+from data_analysis import local_swapi
+from fancy_graphing import star_graph
+from fancy_graphing.star_wars_grapher import StarGraph
+
+DEFAULT_SIZES = [87, 10000, 1000000]
+# anything that goes over (local) http is capped, 1M people is 100k pages
+MAX_NETWORK_ROWS = 10000
+# per-row python loops in matplotlib make 1M row renders take minutes
+MAX_RENDER_ROWS = 100000
+
+SPECIES = ['Human', 'Droid', 'Gungan', "Twi'lek"]
+
+_data = dict()
+
+def raw_people(n):
+    if ('raw', n) not in _data:
+        _data[('raw', n)] = list(local_swapi.SyntheticPeople(n))
+    return _data[('raw', n)]
+
+def raw_frame(n):
+    if ('frame', n) not in _data:
+        builder = df_utilities.PeopleFrameBuilder()
+        _data[('frame', n)] = builder.add(raw_people(n)).build()
+    return _data[('frame', n)]
+
+def raw_membership(n):
+    # built straight from the records, so even 1M people never go through
+    # the wide bool frame
+    if ('membership', n) not in _data:
+        builder = df_utilities.PeopleFrameBuilder().add(raw_people(n))
+        _data[('membership', n)] = (builder.build_membership(),
+                                    builder.records['gender'])
+    return _data[('membership', n)]
+
+def clean_frame(n):
+    if ('clean', n) not in _data:
+        _data[('clean', n)] = df_utilities.cleanup(raw_frame(n).copy())
+    return _data[('clean', n)]
+
+
+def serve_people(n):
+    server, root = local_swapi.serve(raw_people(n))
+    return server, root + 'people/'
+
+def bench_build_dataframe(n):
+    # what build_dataframe() does by default: a checkpointed CrawlJob, one
+    # request at a time (with no delay, as the other benchmarks run)
+    server, url = serve_people(n)
+    checkpoints = tempfile.TemporaryDirectory()
+    def run():
+        job = crawl_job.CrawlJob(url, path=checkpoints.name)
+        job.run(rate=10**6, burst=1, max_in_flight=1)
+        # builds the frame and clears the checkpoints for the next run
+        return job.build_dataframe()
+    try:
+        yield run
+    finally:
+        checkpoints.cleanup()
+        server.shutdown()
+
+def bench_build_dataframe_iter_pages(n):
+    # build_dataframe() continuing from a page, which goes through
+    # iterators.iter_pages() without checkpoints
+    server, url = serve_people(n)
+    delay = web_utilities.REQUEST_DELAY
+    web_utilities.REQUEST_DELAY = 0
+    try:
+        yield lambda: df_utilities.build_dataframe({'next': url})
+    finally:
+        web_utilities.REQUEST_DELAY = delay
+        server.shutdown()
+
+def bench_build_dataframe_async(n):
+    server, url = serve_people(n)
+    try:
+        yield lambda: async_crawler.build_dataframe_async(
+            url, checkpoint=False, rate=10**6, burst=64, max_in_flight=16)
+    finally:
+        server.shutdown()
+
+def bench_iter_people_first(n):
+    # time to the first record, which shouldn't grow with n
+    server, url = serve_people(n)
+    def run():
+        people = iterators.iter_people(url=url, rate=10**6, burst=64)
+        next(people)
+        people.close()
+    try:
+        yield run
+    finally:
+        server.shutdown()
+
+def bench_add_to_df(n):
+    people = raw_people(n)
+    yield lambda: df_utilities.add_to_df(df_utilities.get_initial_df(),
+                                         people)
+
+def bench_cleanup(n):
+    df = raw_frame(n)
+    df_utilities.cleanup(df.iloc[:1].copy())    # load the url dictionaries
+    yield lambda: df_utilities.cleanup(df.copy())
+
+def bench_format_birth_year(n):
+    s = raw_frame(n)['birth_year']
+    yield lambda: df_utilities.format_birth_year(s)
+
+def bench_intersect_not_nan_mask(n):
+    df = clean_frame(n)
+    yield lambda: [star_graph.intersect_not_nan_mask(df, 'species', 'height',
+                                                     v) for v in SPECIES]
+
+def bench_mask_engine(n):
+    df = clean_frame(n)
+    yield lambda: list(MaskEngine(df).masks('species', 'height', SPECIES))
+
+def bench_aggregate_cube(n):
+    df = clean_frame(n)
+    yield lambda: aggregates.AggregateCube.build(df, version='bench')
+
+def bench_cube_query(n):
+    cube = aggregates.AggregateCube.build(clean_frame(n), version='bench')
+    def run():
+        cube.histogram('species', 'height', SPECIES)
+        for v in SPECIES:
+            cube.normal_fit('species', 'height', v)
+    yield run
+
+def bench_crosstab(n):
+    store, gender = raw_membership(n)
+    yield lambda: cooccurrence.sparse_crosstab(gender, store, 'films')
+
+def bench_coappearance_build(n):
+    store, gender = raw_membership(n)
+    yield lambda: cooccurrence.CoAppearanceGraph(store)
+
+def bench_coappearance_query(n):
+    graph = cooccurrence.CoAppearanceGraph(raw_membership(n)[0])
+    def run():
+        for row in range(10):
+            graph.neighbors(row, k=10)
+        graph.top_pairs(k=100)
+    yield run
+
+def bench_plot_df_hist(n):
+    df = clean_frame(n)
+    def run():
+        fig, ax = star_graph.plot_df_hist(df, 'species', SPECIES)
+        plt.close(fig)
+    yield run
+
+def bench_stargraph_plot(n):
+    sg = StarGraph(df=clean_frame(n))
+    def run():
+        fig, ax = sg.plot('species', SPECIES, graph_type='single')
+        plt.close(fig)
+    yield run
+
+# name -> (setup generator, largest size it is run at)
+BENCHMARKS = {
+    'build_dataframe': (bench_build_dataframe, MAX_NETWORK_ROWS),
+    'build_dataframe_iter_pages': (bench_build_dataframe_iter_pages,
+                                   MAX_NETWORK_ROWS),
+    'build_dataframe_async': (bench_build_dataframe_async, MAX_NETWORK_ROWS),
+    'iter_people_first': (bench_iter_people_first, MAX_NETWORK_ROWS),
+    'add_to_df': (bench_add_to_df, None),
+    'cleanup': (bench_cleanup, None),
+    'format_birth_year': (bench_format_birth_year, None),
+    'intersect_not_nan_mask': (bench_intersect_not_nan_mask, None),
+    'mask_engine': (bench_mask_engine, None),
+    'aggregate_cube': (bench_aggregate_cube, None),
+    'cube_query': (bench_cube_query, None),
+    'crosstab': (bench_crosstab, None),
+    'coappearance_build': (bench_coappearance_build, None),
+    'coappearance_query': (bench_coappearance_query, None),
+    'plot_df_hist': (bench_plot_df_hist, MAX_RENDER_ROWS),
+    'stargraph_plot': (bench_stargraph_plot, MAX_RENDER_ROWS),
+}
+
+
+def time_it(setup, n, repeat):
+    """ Input:
+            setup: generator function - yields the function to time, and
+                cleans up after itself when resumed
+            n: int - the dataset size
+            repeat: int - the number of timed runs
+        Output:
+            times: list of floats - seconds per run
+    """
+    gen = setup(n)
+    fn = next(gen)
+    times = []
+    try:
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            fn()
+            times.append(time.perf_counter() - t0)
+    finally:
+        gen.close()
+    return times
+
+def run(names, sizes, repeat):
+    results = []
+    for name in names:
+        setup, max_rows = BENCHMARKS[name]
+        for n in sizes:
+            if max_rows is not None and n > max_rows:
+                continue
+            times = time_it(setup, n, repeat)
+            results.append({'name': name, 'rows': n, 'best': min(times),
+                            'mean': sum(times)/len(times), 'repeat': repeat})
+            print('{:<24}{:>10} rows {:>10.4f}s'.format(name, n, min(times)))
+    return results
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=ROOT_DIR).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def save(results, path=None):
+    commit = git_commit()
+    path = path or os.path.join(BENCH_DIR, 'results', '{}.json'.format(commit))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump({'commit': commit, 'time': time.time(),
+                   'python': platform.python_version(),
+                   'machine': platform.machine(), 'results': results},
+                  f, indent=2)
+    print('Saved {}'.format(path))
+    return path
+
+def compare(old_path, new_path):
+    """ Prints new/old best-time ratios for every (benchmark, size) the two
+    result files have in common. Ratios above 1 are slowdowns.
+    """
+    with open(old_path) as f:
+        old = {(r['name'], r['rows']): r['best'] for r in json.load(f)['results']}
+    with open(new_path) as f:
+        new = {(r['name'], r['rows']): r['best'] for r in json.load(f)['results']}
+    for k in sorted(set(old) & set(new)):
+        print('{:<24}{:>10} rows {:>10.4f}s -> {:>10.4f}s  x{:.2f}'.format(
+            k[0], k[1], old[k], new[k], new[k]/old[k]))
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmarks for ingestion, cleanup, masking and rendering.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--only', nargs='+', choices=sorted(BENCHMARKS),
+                        default=list(BENCHMARKS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+    if args.compare:
+        compare(*args.compare)
+        return
+    save(run(args.only, args.sizes, args.repeat), args.output)
+
+
+if __name__ == '__main__':
+    main()
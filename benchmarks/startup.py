@@ -0,0 +1,89 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+"""
+Cold start benchmarks: how long a fresh interpreter takes to import the
+package and to run the first command.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --repeat 10 --output startup.json
+
+Every case runs in its own python process, with SRC_DIR, GRAPH_DIR and
+ASSET_DIR unset (so it also checks that nothing needs them), and the best of
+--repeat wall clock times is kept. Cases that don't plot are expected to come
+in under TARGET seconds, and are marked if they don't.
+"""
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.normpath(os.path.join(BENCH_DIR, '..'))
+SRC_DIR = os.path.join(ROOT_DIR, 'src')
+
+TARGET = 1.0
+
+# name -> (python arguments, whether it plots)
+CASES = {
+    'python': (['-c', 'pass'], False),
+    'import data_analysis': (['-c', 'import data_analysis'], False),
+    'import metrics': (['-c', 'from data_analysis import metrics'], False),
+    'import star_wars_grapher': (
+        ['-c', 'from fancy_graphing import star_wars_grapher'], False),
+    'StarGraph()': (
+        ['-c', 'from fancy_graphing.star_wars_grapher import StarGraph; '
+               'StarGraph()'], False),
+    'star_wars --help': ([os.path.join(SRC_DIR, 'star_wars.py'), '--help'],
+                         False),
+    'import web_utilities': (['-c', 'from data_analysis import web_utilities'],
+                             False),
+    'import star_graph': (['-c', 'from fancy_graphing import star_graph'],
+                          True),
+}
+
+
+def clean_env():
+    env = {k: v for k, v in os.environ.items()
+           if k not in ('SRC_DIR', 'GRAPH_DIR', 'ASSET_DIR')}
+    env['PYTHONPATH'] = SRC_DIR
+    return env
+
+def time_case(args, repeat):
+    """ Output:
+            The best wall clock time, in seconds, of running python with args.
+    """
+    env = clean_env()
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable] + args, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        t = time.perf_counter() - t0
+        best = t if best is None else min(best, t)
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start benchmarks.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--only', nargs='+', default=None,
+                        help='the cases to run (defaults to all of them)')
+    parser.add_argument('--output', default=None,
+                        help='also write the results to this json file')
+    args = parser.parse_args()
+    results = dict()
+    for name in args.only or CASES:
+        case, plots = CASES[name]
+        t = time_case(case, args.repeat)
+        results[name] = t
+        slow = '' if plots or t < TARGET else \
+            '  over the {:g}s target'.format(TARGET)
+        print('{:<28}{:>8.3f}s{}'.format(name, t, slow))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': sys.version.split()[0], 'target': TARGET,
+                       'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
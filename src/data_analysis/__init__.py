@@ -0,0 +1,6 @@
+"""
+Fetching, cleaning and analysing the Star Wars API People data.
+
+Nothing is imported here, so importing one module (e.g. data_analysis.paths)
+doesn't drag in pandas or requests through the others.
+"""
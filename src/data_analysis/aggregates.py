@@ -0,0 +1,479 @@
+import json
+import os
+import tempfile
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from . import paths
+from . import snapshot
+from .masks import valid_mask
+from .membership import MembershipStore
+
+"""
+Precomputed group statistics for the People frame.
+
+The README questions (height by gender, homeworld or species, gender per
+film, ...) all come down to "the distribution of a measure for each value of
+a categorical column". Answering them from the frame means building masks and
+slicing rows every time. An AggregateCube works out, once per dataset
+version, for every dimension (the categorical columns, and membership of each
+film) and every measure (height, mass, birth_year):
+
+    counts          people per group, 'unknown' included
+    n, mean, std    of the measure's valid values in each group
+    quantiles       every whole percentile, from one sort of (group, value)
+    histograms      counts per bin, on bin edges shared by every group
+
+Each table has one extra row for 'all': every row with a valid (not NaN, not
+'unknown') value in the dimension, like the masks' 'any'. After that every
+query is a dictionary lookup and an array index, whatever the number of rows.
+
+    cube = get_cube(df)
+    cube.counts('species', sort=True)
+    cube.stats('gender', 'height', 'female')
+    edges, counts = cube.histogram('species', 'height', ['Human', 'Droid'])
+
+get_cube() keeps the cubes of the last MAX_CUBES dataset versions
+(snapshot.dataset_version()) in memory. Only the stored dataset's cube is
+also kept in assets/aggregates, for the next process: callers pass
+persist=True for it (StarGraph when it loaded the snapshot, batch_render and
+the stats command), so cubes of ad-hoc frames never touch the disk. Working
+the version out hashes the whole frame, so callers that already know it
+(StarGraph and batch_render read it from the snapshot's schema) pass it in.
+"""
+
+DIMENSIONS = ['gender', 'species', 'homeworld', 'eye_color', 'hair_color',
+              'skin_color']
+# membership categories that become dimensions, one group per resource
+MEMBERSHIPS = ['films']
+MEASURES = ['height', 'mass', 'birth_year']
+PERCENTILES = np.arange(101)
+ALL = 'all'
+
+# the rules astropy's hist() takes, whose edges come from
+# astropy.stats.histogram. astropy is only imported when one of these is used.
+RULES = ('freedman', 'scott', 'knuth', 'blocks')
+# the rules np.histogram_bin_edges takes
+NUMPY_RULES = ('auto', 'fd', 'doane', 'stone', 'rice', 'sturges', 'sqrt')
+
+# how many cubes get_cube() holds in memory, least recently used dropped first
+MAX_CUBES = 4
+
+_cubes = OrderedDict()
+
+
+def bin_edges(values, rule='freedman'):
+    """ Input:
+            values: numpy float array - no NaNs
+            rule: string or int - one of RULES (via astropy), one of
+                NUMPY_RULES (via np.histogram_bin_edges), or a number of bins
+        Output:
+            A numpy array of bin edges covering the values. They are evenly
+            spaced for every rule but 'blocks' (Bayesian blocks), so don't
+            assume a constant bin width.
+    """
+    if isinstance(rule, str) and rule not in RULES + NUMPY_RULES:
+        raise ValueError('unknown binning rule {!r}, expected one of {}'
+                         .format(rule, ', '.join(RULES + NUMPY_RULES)))
+    if len(values) == 0:
+        return np.array([0., 1.])
+    if rule in RULES:
+        from astropy import stats
+        try:
+            counts, edges = stats.histogram(values, bins=rule)
+            return np.asarray(edges, dtype='float64')
+        except ValueError:      # e.g. too few values for the rule
+            rule = 'auto'
+    return np.histogram_bin_edges(values, bins=rule)
+
+def bin_codes(values, edges):
+    """ Output:
+            The bin of each value, with the last edge counted in the last
+            bin (as np.histogram does). Values outside the edges get -1.
+    """
+    codes = np.searchsorted(edges, values, side='right') - 1
+    codes[values == edges[-1]] = len(edges) - 2
+    codes[(values < edges[0]) | (values > edges[-1]) | np.isnan(values)] = -1
+    return codes
+
+def is_all(val):
+    return isinstance(val, str) and val.lower()[:3] in {'any', 'all'}
+
+def summarize(codes, values, n_groups, edges):
+    """ Input:
+            codes: numpy int array - the group of each value, -1 for none
+            values: numpy float array - NaN for missing values
+            n_groups: int
+            edges: numpy array - the histogram bin edges
+        Output:
+            dict of numpy arrays, one row per group - 'n', 'mean', 'm2' (the
+            sum of squared deviations from the mean), 'quantiles' (one column
+            per PERCENTILES) and 'hist' (one column per bin)
+    """
+    ok = (codes >= 0) & ~np.isnan(values)
+    codes, values = codes[ok], values[ok]
+    n = np.bincount(codes, minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(codes, weights=values, minlength=n_groups)/n
+    dev = values - mean[codes]
+    m2 = np.bincount(codes, weights=dev*dev, minlength=n_groups)
+    # sorted by group, then value, so each group's values are a contiguous,
+    # sorted run, and every quantile is an interpolation between two of them
+    ordered = values[np.lexsort((values, codes))]
+    starts = np.cumsum(n) - n
+    pos = starts[:, None] + \
+        PERCENTILES[None, :]/100*np.maximum(n - 1, 0)[:, None]
+    quantiles = np.full(pos.shape, np.nan)
+    if len(ordered):
+        lo = np.minimum(np.floor(pos).astype('int64'), len(ordered) - 1)
+        hi = np.minimum(lo + 1, len(ordered) - 1)
+        frac = pos - lo
+        quantiles = ordered[lo]*(1 - frac) + ordered[hi]*frac
+        quantiles[n == 0] = np.nan
+    bins = bin_codes(values, edges)
+    keep = bins >= 0
+    n_bins = len(edges) - 1
+    hist = np.bincount(codes[keep]*n_bins + bins[keep],
+                       minlength=n_groups*n_bins).reshape(n_groups, n_bins)
+    return {'n': n, 'mean': mean, 'm2': m2, 'quantiles': quantiles,
+            'hist': hist}
+
+def _dimension_codes(s):
+    """ Output:
+            groups: list - the values of s, sorted where possible, 'unknown'
+                included, NaN left out
+            codes: numpy int array - each row's group, -1 for NaN
+            valid: numpy bool array - rows that count towards 'all'
+    """
+    try:
+        codes, uniques = pd.factorize(s, sort=True)
+    except TypeError:       # values that can't be compared with each other
+        codes, uniques = pd.factorize(s)
+    return pd.Index(uniques).tolist(), codes, valid_mask(s)
+
+def _membership_codes(store, category):
+    """ Output:
+            groups: list - the resources of category, in column order
+            rows, codes: numpy int arrays - one (person, group) pair per
+                membership
+            valid: numpy bool array - people in at least one of them
+    """
+    cols = store.category_positions(category)
+    sub = store.matrix[:, cols].tocoo()
+    valid = np.zeros(store.shape[0], dtype=bool)
+    valid[sub.row] = True
+    return [store.columns[j] for j in cols], sub.row, sub.col, valid
+
+
+class AggregateCube():
+    def __init__(self, version, groups, counts, tables, edges, extents,
+                 rule):
+        """ Input:
+                version: string - the dataset version the cube was built from
+                groups: dict - dimension -> list of group values
+                counts: dict - dimension -> numpy int array, the people in
+                    each group, with 'all' last
+                tables: dict - (dimension, measure) -> summarize() output,
+                    with 'all' as the last row
+                edges: dict - measure -> its histogram bin edges
+                extents: dict - measure -> numpy array of its min and max
+                rule: the binning rule the edges came from
+            Use AggregateCube.build() or get_cube() rather than this.
+        """
+        self.version = version
+        self.groups = groups
+        self._counts = counts
+        self.tables = tables
+        self.edges = edges
+        self.extents = extents
+        self.rule = rule
+        self.dimensions = list(groups)
+        self.measures = list(edges)
+        self._lookup = {d: {v: i for i, v in enumerate(g)}
+                        for d, g in groups.items()}
+
+    @classmethod
+    def build(cls, df, version=None, membership=None, dimensions=DIMENSIONS,
+              memberships=MEMBERSHIPS, measures=MEASURES, rule='freedman'):
+        """ Input:
+                df: Pandas DataFrame - the cleaned People frame
+                version: string or None - defaults to
+                    snapshot.dataset_version(df)
+                membership: MembershipStore or None - defaults to one made
+                    from df's membership columns (if it has any)
+                dimensions: list of strings - the categorical columns
+                memberships: list of strings - membership categories to use
+                    as dimensions, e.g. 'films'
+                measures: list of strings - the numeric columns
+                rule: the binning rule (see bin_edges)
+            Output:
+                An AggregateCube. Dimensions and measures that df doesn't
+                have are left out.
+        """
+        version = version or snapshot.dataset_version(df)
+        measures = [m for m in measures if m in df.columns]
+        dimensions = [d for d in dimensions if d in df.columns]
+        if membership is None and memberships and df.shape[1] > 10:
+            membership = MembershipStore.from_frame(df)
+        values = {m: snapshot.to_float(df[m]).values for m in measures}
+        edges, extents = dict(), dict()
+        for m, v in values.items():
+            v = v[~np.isnan(v)]
+            edges[m] = bin_edges(v, rule)
+            extents[m] = np.array([v.min(), v.max()] if len(v) else
+                                  [np.nan, np.nan])
+        dims = dict()
+        for d in dimensions:
+            groups, codes, valid = _dimension_codes(df[d])
+            dims[d] = (groups, None, codes, valid)
+        for c in memberships if membership is not None else []:
+            groups, rows, codes, valid = _membership_codes(membership, c)
+            dims[c] = (groups, rows, codes, valid)
+        groups, counts, tables = dict(), dict(), dict()
+        for d, (g, rows, codes, valid) in dims.items():
+            groups[d] = g
+            counts[d] = np.append(np.bincount(codes[codes >= 0],
+                                              minlength=len(g)), valid.sum())
+            all_codes = np.where(valid, 0, -1)
+            for m, v in values.items():
+                by_group = summarize(codes, v if rows is None else v[rows],
+                                     len(g), edges[m])
+                overall = summarize(all_codes, v, 1, edges[m])
+                tables[(d, m)] = {k: np.concatenate([by_group[k], overall[k]])
+                                  for k in by_group}
+        return cls(version, groups, counts, tables, edges, extents, rule)
+
+    def covers(self, dim, measure, rule=None):
+        """ Output:
+                bool - whether the cube can answer for dim and measure (and
+                histograms binned by rule, if given)
+        """
+        return (dim, measure) in self.tables and \
+            (rule is None or rule == self.rule)
+
+    def _row(self, dim, val):
+        """ Output:
+                The table row for val in dim, or None if there is none.
+        """
+        if is_all(val):
+            return len(self.groups[dim])
+        return self._lookup[dim].get(val)
+
+    def count(self, dim, val=ALL):
+        """ Output:
+                int - the number of people with val in dim
+        """
+        i = self._row(dim, val)
+        return 0 if i is None else int(self._counts[dim][i])
+
+    def counts(self, dim, sort=False):
+        """ Output:
+                values: numpy object array - the groups in dim
+                counts: numpy int array - the people in each group
+            Sorted by value (as np.unique gives them), or by count, largest
+            first, if sort is True.
+        """
+        values = np.empty(len(self.groups[dim]), dtype=object)
+        values[:] = self.groups[dim]
+        counts = self._counts[dim][:-1]
+        if sort:
+            order = np.argsort(counts, kind='stable')[::-1]
+            return values[order], counts[order]
+        return values, counts
+
+    def stats(self, dim, measure, val=ALL, ddof=1):
+        """ Output:
+                dict - 'count', 'mean', 'std' (with ddof, 1 like pandas),
+                'min', '25%', '50%', '75%' and 'max' of measure for the
+                people with val in dim. NaN where there are no values.
+        """
+        t = self.tables[(dim, measure)]
+        i = self._row(dim, val)
+        if i is None:
+            return {'count': 0, 'mean': np.nan, 'std': np.nan, 'min': np.nan,
+                    '25%': np.nan, '50%': np.nan, '75%': np.nan,
+                    'max': np.nan}
+        n = t['n'][i]
+        q = t['quantiles'][i]
+        std = np.sqrt(t['m2'][i]/(n - ddof)) if n > ddof else np.nan
+        return {'count': int(n), 'mean': t['mean'][i], 'std': std,
+                'min': q[0], '25%': q[25], '50%': q[50], '75%': q[75],
+                'max': q[100]}
+
+    def quantile(self, dim, measure, q, val=ALL):
+        """ Input:
+                q: float or list of floats - between 0 and 1
+            Output:
+                The q quantile(s) of measure for val in dim. Whole
+                percentiles are exact, others are interpolated between the
+                two nearest.
+        """
+        i = self._row(dim, val)
+        if i is None:
+            return np.full(np.shape(q), np.nan)[()]
+        return np.interp(np.asarray(q)*100, PERCENTILES,
+                         self.tables[(dim, measure)]['quantiles'][i])
+
+    def normal_fit(self, dim, measure, val=ALL):
+        """ Output:
+                mu, std: the maximum likelihood normal distribution for
+                measure in val (what scipy.stats.norm.fit gives)
+        """
+        s = self.stats(dim, measure, val, ddof=0)
+        return s['mean'], s['std']
+
+    def extent(self, measure):
+        """ Output:
+                min, max: of every valid value of measure (NaN if it has none)
+        """
+        return tuple(self.extents[measure])
+
+    def histogram(self, dim, measure, vals):
+        """ Input:
+                dim: string - the dimension to group by
+                measure: string - the measure that was binned
+                vals: list - the groups wanted
+            Output:
+                edges: the shared bin edges
+                counts: dict - val -> numpy array of counts per bin. Groups
+                    with no rows get all zeros. An 'any'/'all' value gets the
+                    counts for every valid row.
+            The same thing HistEngine.counts() gives, for the cube's rule.
+        """
+        edges = self.edges[measure]
+        hist = self.tables[(dim, measure)]['hist']
+        out = dict()
+        for v in vals:
+            i = self._row(dim, v)
+            out[v] = hist[i] if i is not None else \
+                np.zeros(len(edges) - 1, dtype='int64')
+        return edges, out
+
+    def summary(self, dim, measure, sort=True):
+        """ Output:
+                A DataFrame with a row per group in dim (and 'all' last) and
+                a column per stats() value, for dashboards and the notebook.
+        """
+        values, counts = self.counts(dim, sort)
+        rows = [self.stats(dim, measure, v) for v in values]
+        rows.append(self.stats(dim, measure, ALL))
+        out = pd.DataFrame(rows, index=list(values) + [ALL])
+        out.insert(0, 'people', list(counts) + [self.count(dim, ALL)])
+        return out
+
+    def save(self, path):
+        """ Writes the cube to path as a single .npz file. It is written to a
+        temporary file of its own first and then moved into place, so
+        processes saving the same cube at once never see each other's half
+        written files.
+        """
+        arrays = dict()
+        for d, c in self._counts.items():
+            arrays['counts|{}'.format(d)] = c
+        for (d, m), t in self.tables.items():
+            for k, a in t.items():
+                arrays['{}|{}|{}'.format(d, m, k)] = a
+        for m, e in self.edges.items():
+            arrays['edges|{}'.format(m)] = e
+            arrays['extents|{}'.format(m)] = self.extents[m]
+        meta = {'version': self.version, 'rule': self.rule,
+                'groups': self.groups}
+        arrays['meta'] = np.array(json.dumps(meta))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp',
+                                        dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            meta = json.loads(str(f['meta']))
+            counts, tables, edges, extents = dict(), dict(), dict(), dict()
+            for key in f.files:
+                parts = key.split('|')
+                if parts[0] == 'counts':
+                    counts[parts[1]] = f[key]
+                elif parts[0] == 'edges':
+                    edges[parts[1]] = f[key]
+                elif parts[0] == 'extents':
+                    extents[parts[1]] = f[key]
+                elif len(parts) == 3:
+                    tables.setdefault((parts[0], parts[1]), dict())[parts[2]] \
+                        = f[key]
+        return cls(meta['version'], meta['groups'], counts, tables, edges,
+                   extents, meta['rule'])
+
+
+def covers(dim, measure=None, rule=None):
+    """ Output:
+            bool - whether the cubes get_cube() builds can have dim (and
+            measure, and histograms binned by rule, if given), without
+            building one. A frame without those columns still won't.
+    """
+    return dim in DIMENSIONS + MEMBERSHIPS and \
+        (measure is None or measure in MEASURES) and \
+        (rule is None or rule == 'freedman')
+
+def get_cube_path(version):
+    return paths.get_asset_path('aggregates', '{}.npz'.format(version))
+
+def get_cube(df, version=None, persist=False):
+    """ Input:
+            df: Pandas DataFrame - the cleaned People frame
+            version: string or None - df's dataset version, e.g. from
+                snapshot.read_dataset_version(). Defaults to hashing df,
+                which reads every row.
+            persist: bool - True only for the stored dataset (the snapshot).
+                Its cube is then loaded from assets/aggregates, or saved
+                there once built, and the cubes saved for other versions are
+                removed.
+        Output:
+            The AggregateCube for df, built only if no cube is held for its
+            version.
+    """
+    version = version or snapshot.dataset_version(df)
+    if version in _cubes:
+        _cubes.move_to_end(version)
+        return _cubes[version]
+    cube = None
+    if persist:
+        path = get_cube_path(version)
+        try:
+            cube = AggregateCube.load(path)
+        except FileNotFoundError:
+            pass
+    if cube is None:
+        cube = AggregateCube.build(df, version)
+        if persist:
+            cube.save(path)
+            _remove_other_cubes(path)
+    _cubes[version] = cube
+    while len(_cubes) > MAX_CUBES:
+        _cubes.popitem(last=False)
+    return cube
+
+def _remove_other_cubes(path):
+    """ Removes the cubes saved for every version but the one at path (there
+    is only ever one current dataset). Another process may be doing the same.
+    """
+    folder = os.path.dirname(path)
+    for name in os.listdir(folder):
+        if name.endswith('.npz') and name != os.path.basename(path):
+            try:
+                os.remove(os.path.join(folder, name))
+            except FileNotFoundError:
+                pass
+
+def forget(version=None):
+    """ Drops the in-memory cube for version (every cube if None).
+    """
+    if version is None:
+        _cubes.clear()
+    else:
+        _cubes.pop(version, None)
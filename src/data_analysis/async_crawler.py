@@ -0,0 +1,268 @@
+import asyncio
+import functools
+import json
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from . import web_utilities
+from . import df_utilities
+from . import crawl_job
+from .resolver import get_resolver, CATEGORIES
+
+"""
+An asyncio based replacement for the recursive crawl in
+df_utilities.build_dataframe().
+
+build_dataframe() visits the People pages one after another, and get_json()
+sleeps for 1.5 seconds after every request, so a full refresh costs
+(number of pages) * (round trip + 1.5s). Here the first page is fetched on its
+own, the 'count' field is used to work out how many pages there are, and then
+every remaining page is requested at once. A token bucket takes the place of
+the fixed sleep, and a semaphore caps the number of requests in flight.
+
+The sync entry points run their coroutines with run_sync(), which also works
+from a thread that is already running an event loop, such as a Jupyter
+kernel's.
+"""
+
+
+def run_sync(coro):
+    """ Input:
+            coro: a coroutine
+        Output:
+            What coro returns. Like asyncio.run(), except that if this
+            thread is already running an event loop (asyncio.run() would
+            raise), coro is run on a worker thread with a loop of its own.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
+
+class TokenBucket():
+    def __init__(self, rate=4, burst=4):
+        """ Input:
+                rate: float - the number of tokens added to the bucket per
+                    second. This is the long run request rate.
+                burst: int - the most tokens the bucket can hold, which is the
+                    number of requests that can be made back to back.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last)*self.rate)
+        self.last = now
+
+    async def acquire(self):
+        """ Waits until a token is available, then takes it.
+        """
+        async with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens)/self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class AsyncFetcher():
+    def __init__(self, rate=4, burst=4, max_in_flight=8, session=None,
+                 revalidate=False):
+        """ Input:
+                rate: float - requests per second allowed by the token bucket
+                burst: int - requests that may be made back to back
+                max_in_flight: int - the most requests that may be waiting on
+                    the server at the same time
+                session: requests.Session or None - if None, a session with a
+                    connection pool large enough for max_in_flight is made, so
+                    the connections are kept alive and reused between pages.
+                revalidate: bool - if True, cached pages are always checked
+                    with a conditional GET rather than served as-is.
+        """
+        self.bucket = TokenBucket(rate, burst)
+        self.max_in_flight = max_in_flight
+        self.session = session or self._make_session(max_in_flight)
+        self.semaphore = None
+        self.revalidate = revalidate
+
+    @staticmethod
+    def _make_session(pool_size):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    async def fetch(self, url):
+        """ Input:
+                url: string - a valid url
+            Output:
+                A dictionary containing the data located at "url", or None if
+                the request failed.
+        """
+        if url == None:
+            return
+        # cache hits don't use up a token or a slot. The entry is looked up
+        # once, and handed to get_json() on a miss.
+        cache = web_utilities.get_cache()
+        entry = cache.get(url) if cache else None
+        if entry and not self.revalidate and \
+                (cache.offline or cache.is_fresh(entry)):
+            return json.loads(entry.body)
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_in_flight)
+        async with self.semaphore:
+            await self.bucket.acquire()
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, functools.partial(
+                web_utilities.get_json, url, self.session, 0, self.revalidate,
+                entry=entry))
+
+    def close(self):
+        self.session.close()
+
+
+def page_urls(base_url, first_page):
+    """ Input:
+            base_url: string - the url of the first page of a resource
+            first_page: dict - the json returned from base_url
+        Output:
+            A list of the urls for pages 2 through N, where N is worked out
+            from the 'count' field and the number of results on a page.
+    """
+    per_page = len(first_page['results'])
+    if per_page == 0 or not first_page.get('next'):
+        return []
+    n_pages = math.ceil(first_page['count']/per_page)
+    sep = '&' if '?' in base_url else '?'
+    return ['{}{}page={}'.format(base_url, sep, i)
+            for i in range(2, n_pages + 1)]
+
+async def crawl_pages(base_url=None, fetcher=None, **kwargs):
+    """ Input:
+            base_url: string or None - the url of the first page of a
+                resource. Defaults to the People resource.
+            fetcher: AsyncFetcher or None - built from kwargs if None
+            **kwargs: passed to AsyncFetcher (rate, burst, max_in_flight,
+                revalidate)
+        Output:
+            pages: list of dicts - every page of the resource, in page order.
+                If a page could not be fetched, the list stops before it. This
+                matches build_dataframe(), which treats a failed page as the
+                end of the pagination.
+    """
+    base_url = base_url or web_utilities.API_ROOT + 'people/'
+    own_fetcher = fetcher is None
+    fetcher = fetcher or AsyncFetcher(**kwargs)
+    try:
+        first = await fetcher.fetch(base_url)
+        if not first:
+            return []
+        urls = page_urls(base_url, first)
+        rest = await asyncio.gather(*[fetcher.fetch(u) for u in urls])
+    finally:
+        if own_fetcher:
+            fetcher.close()
+    pages = [first]
+    for page in rest:
+        if not page:
+            break
+        pages.append(page)
+    return pages
+
+def build_dataframe_async(base_url=None, checkpoint=True, **kwargs):
+    """ Input:
+            base_url: string or None - the url of the first People page
+            checkpoint: bool - if True, the crawl is run as a
+                crawl_job.CrawlJob, so pages are checkpointed to disk and a
+                rerun after a failure only fetches the missing pages
+            **kwargs: passed to AsyncFetcher (rate, burst, max_in_flight)
+        Output:
+            df: Pandas DataFrame - the same frame build_dataframe() returns,
+                built from pages fetched concurrently and collected in page
+                order. If any page couldn't be fetched, IncompleteCrawl is
+                raised instead.
+    """
+    if checkpoint:
+        job = crawl_job.CrawlJob(base_url)
+        job.run(**kwargs)
+        return job.build_dataframe()
+    base_url = base_url or web_utilities.API_ROOT + 'people/'
+    pages = run_sync(crawl_pages(base_url, **kwargs))
+    if not pages:
+        raise crawl_job.IncompleteCrawl([base_url])
+    urls = [base_url] + page_urls(base_url, pages[0])
+    if len(pages) < len(urls):
+        raise crawl_job.IncompleteCrawl(urls[len(pages):])
+    builder = df_utilities.PeopleFrameBuilder()
+    for page in pages:
+        builder.add(page['results'])
+    return builder.build()
+
+async def crawl_reference(categories=CATEGORIES, fetcher=None, **kwargs):
+    """ Input:
+            categories: list of strings - the categories to fetch
+            fetcher: AsyncFetcher or None - built from kwargs if None. Every
+                category shares it, and so shares one rate limit.
+            **kwargs: passed to AsyncFetcher (rate, burst, max_in_flight)
+        Output:
+            dicts: dict - category -> url -> name dictionary, for each
+                category whose pages were all fetched. Incomplete categories
+                are left out.
+    """
+    own_fetcher = fetcher is None
+    fetcher = fetcher or AsyncFetcher(**kwargs)
+    try:
+        crawls = await asyncio.gather(*[
+            crawl_pages(web_utilities.API_ROOT + '{}/'.format(c), fetcher)
+            for c in categories])
+    finally:
+        if own_fetcher:
+            fetcher.close()
+    dicts = dict()
+    for c, pages in zip(categories, crawls):
+        if not pages or pages[0]['count'] != \
+                sum(len(p['results']) for p in pages):
+            print('ERROR: could not fetch every {} page'.format(c))
+            continue
+        d = dict()
+        for page in pages:
+            web_utilities.add_to_val_dict(d, c, page['results'])
+        dicts[c] = d
+    return dicts
+
+def prefetch_reference(categories=CATEGORIES, force=False, **kwargs):
+    """ Input:
+            categories: list of strings - the categories to prefetch
+            force: bool - if True, categories that already have a json file
+                are fetched again
+            **kwargs: passed to AsyncFetcher (rate, burst, max_in_flight)
+        Output:
+            A list of the categories that were fetched and written.
+
+    Builds the url -> name dictionaries that url_to_val_dict() would
+    otherwise build one page at a time in the middle of cleanup(), fetching
+    every category concurrently. Each *_dict.json file is written atomically,
+    and only if all of its pages came back.
+    """
+    missing = [c for c in categories if force or
+               not os.path.exists(web_utilities.get_val_dict_path(c))]
+    if not missing:
+        return []
+    dicts = run_sync(crawl_reference(missing, **kwargs))
+    for c, d in dicts.items():
+        web_utilities.write_json_atomic(web_utilities.get_val_dict_path(c), d)
+    if dicts:
+        get_resolver().invalidate()
+    return list(dicts)
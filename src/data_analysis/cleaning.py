@@ -0,0 +1,179 @@
+import time
+import numpy as np
+import pandas as pd
+from . import metrics
+from .resolver import get_resolver
+
+"""
+A declarative cleaning pipeline for the People frame.
+
+cleanup() used to run a chain of passes that each rebuilt whole columns in
+python: an apply() for the birth years, list comprehensions for the 'unknown'
+and 'n/a' replacements (going over 'gender' twice), and three separate
+url-to-name passes. Here the cleaning is written down as a list of rules:
+
+    ('birth_year', 'star_date', None)           parse BBY/ABY dates
+    ('mass', 'replace', {'unknown': np.nan})     map values
+    ('homeworld', 'replace', URLS)               map urls to names
+    (MEMBERSHIP, 'rename', URLS)                 map the membership column
+                                                 names to names
+
+CleaningPipeline compiles the rules so that every 'replace' rule for a column
+is composed into a single dictionary, and each column is then visited once,
+with vectorized string extraction and Series.map() doing the work.
+"""
+
+# stands in for the merged url -> name dictionary, which is only built if a
+# rule actually needs it
+URLS = 'urls'
+# stands in for the film/starship/vehicle columns (everything after the 10th)
+MEMBERSHIP = 'membership'
+
+STAR_DATE = r'^\s*(?P<num>[0-9]*\.?[0-9]+)\s*(?P<era>BBY|ABY)\s*$'
+
+
+def star_dates_to_float(s):
+    """ Input:
+            s: Series - dates ending in BBY or ABY, or 'unknown'
+        Output:
+            A float64 Series. BBY dates are negative, ABY dates are positive,
+            and anything else is NaN.
+    """
+    if s.dtype == 'float64':    # already converted
+        return s
+    parts = s.astype(str).str.extract(STAR_DATE)
+    num = parts['num'].astype('float64')
+    return num.where(parts['era'] == 'ABY', -num)
+
+def compose(first, second):
+    """ Input:
+            first: dict - applied first
+            second: dict - applied to the result of first
+        Output:
+            A single dict with the same effect as applying first and then
+            second.
+    """
+    d = {k: second.get(v, v) if isinstance(v, str) else v
+         for k, v in first.items()}
+    for k, v in second.items():
+        d.setdefault(k, v)
+    return d
+
+def map_values(s, d):
+    """ Input:
+            s: Series
+            d: dict
+        Output:
+            s, with every value that is a key in d replaced by d[value].
+            Values that aren't keys are left alone.
+    """
+    if len(d) == 0:
+        return s
+    hit = s.isin(list(d.keys()))
+    if not hit.any():
+        return s
+    return s.map(d).where(hit, s)
+
+def all_urls():
+    """ Output:
+            A dictionary mapping the url of every planet, film, species,
+            vehicle and starship to its name. This is the shared index kept
+            by the process-wide UrlResolver, so it is only built once.
+    """
+    return get_resolver().index
+
+
+class CleaningPipeline():
+    def __init__(self, rules, url_source=all_urls):
+        """ Input:
+                rules: list of (column, op, arg) tuples. op is 'star_date',
+                    'replace' or 'rename' (MEMBERSHIP only). arg is a dict or
+                    URLS for 'replace' and 'rename'.
+                url_source: function - returns the url -> name dictionary
+                    substituted for URLS. It is called at most once per run.
+        """
+        self.rules = rules
+        self.url_source = url_source
+        self.plan = self.compile(rules)
+
+    @staticmethod
+    def compile(rules):
+        """ Groups the rules by column, keeping the order columns first appear
+        in. Consecutive 'replace' rules for a column are fused into one.
+        Output:
+            plan: list of (column, [(op, arg), ...])
+        """
+        plan = dict()
+        for col, op, arg in rules:
+            steps = plan.setdefault(col, [])
+            if op in {'replace', 'rename'} and steps and steps[-1][0] == op:
+                steps[-1] = (op, steps[-1][1] + [arg])
+            else:
+                steps.append((op, [arg] if op != 'star_date' else None))
+        return list(plan.items())
+
+    def _resolve(self, args, urls):
+        if URLS in args and urls[0] is None:
+            urls[0] = self.url_source()
+        if args == [URLS]:          # no need to copy the shared index
+            return urls[0]
+        d = dict()
+        for arg in args:
+            d = compose(d, urls[0] if arg == URLS else arg)
+        return d
+
+    def run(self, df):
+        """ Input:
+                df: Pandas DataFrame - the frame built by add_to_df()
+            Output:
+                df: Pandas DataFrame - the cleaned frame
+        """
+        urls = [None]
+        for col, steps in self.plan:
+            if col == MEMBERSHIP:
+                with metrics.span('cleanup', column=MEMBERSHIP):
+                    for op, args in steps:
+                        d = self._resolve(args, urls)
+                        df.columns = list(df.columns[:10]) + \
+                            [d.get(c, c) for c in df.columns[10:]]
+                continue
+            with metrics.span('cleanup', column=col):
+                s = df[col]
+                for op, args in steps:
+                    if op == 'star_date':
+                        s = star_dates_to_float(s)
+                    else:
+                        s = map_values(s, self._resolve(args, urls))
+                df[col] = s
+        return df
+
+    def benchmark(self, df, sizes=(10**4, 10**5, 10**6), repeat=3):
+        """ Input:
+                df: Pandas DataFrame - a raw frame (as built by add_to_df())
+                    to tile up to each size
+                sizes: sequence of ints - row counts to time
+                repeat: int - runs per size; the best time is kept
+            Output:
+                results: list of dicts with 'rows', 'seconds' and
+                    'rows_per_second'. The url dictionary is loaded before
+                    timing starts, so this measures the cleaning itself.
+        """
+        urls = self.url_source()
+        source = self.url_source
+        self.url_source = lambda: urls
+        results = []
+        try:
+            for n in sizes:
+                big = df.iloc[np.arange(n) % df.shape[0]]
+                big = big.reset_index(drop=True)
+                times = []
+                for i in range(repeat):
+                    frame = big.copy()
+                    t0 = time.perf_counter()
+                    self.run(frame)
+                    times.append(time.perf_counter() - t0)
+                results.append({'rows': n, 'seconds': min(times),
+                                'rows_per_second': n/min(times)})
+        finally:
+            self.url_source = source
+        return results
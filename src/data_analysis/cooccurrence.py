@@ -0,0 +1,286 @@
+from itertools import combinations, islice, product
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from .membership import MembershipStore
+
+"""
+Cross-tabulations and a co-appearance graph over the membership data.
+
+A MembershipStore is a sparse (people x resources) incidence matrix B. Any
+"category x resource" count is then one sparse product: with G the sparse
+(people x groups) indicator of a column such as gender,
+
+    G.T @ B     is the (groups x resources) contingency table
+
+so "gender across films" or "species by starship" never loop over the wide
+bool columns, and cost O(memberships).
+
+The co-appearance graph links two people with the (weighted) number of films
+and vehicles they share: B_w @ B.T. Written out, that is dense whenever a
+resource has many members (everyone in A New Hope is linked to everyone else
+in it), so a CoAppearanceGraph never builds it. People with exactly the same
+memberships are interchangeable in the graph, so they are collapsed into one
+"signature", and the graph is worked out between signatures on demand:
+
+    neighbors(i, k)     one sparse row product over signatures, then the
+                        members of the best signatures until k are found
+    top_pairs(k)        signature pairs in blocks, best totals first,
+                        stopping as soon as no later signature can beat the
+                        k-th best pair found so far. Blocks are sized by an
+                        upper bound on the entries their products can hold,
+                        so a block of signatures that share popular
+                        resources is small
+
+adjacency() does build the explicit people x people matrix, for datasets
+small enough for it (like the real one).
+"""
+
+
+def indicator(values):
+    """ Input:
+            values: sequence - one value per person, in the store's row order.
+                NaN means no group.
+        Output:
+            matrix: scipy CSR matrix - people x groups, 1 where a person has
+                that value
+            groups: list - the value of each column, in order of appearance
+    """
+    codes, uniques = pd.factorize(values)
+    rows = np.nonzero(codes >= 0)[0]
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype='int64'),
+                                (rows, codes[rows])),
+                               shape=(len(codes), len(uniques)))
+    return matrix, pd.Index(uniques).tolist()
+
+def sparse_crosstab(values, store, category=None):
+    """ Input:
+            values: sequence or string - the row dimension. Either one value
+                per person (e.g. df['gender'].values), or a membership
+                category ('films', 'starships' or 'vehicles') of the store.
+            store: MembershipStore
+            category: string or None - the resources for the columns. None
+                uses every resource.
+        Output:
+            table: scipy CSR matrix of ints - groups x resources, the number
+                of people in both
+            groups: list - the row labels
+            resources: list - the column labels
+    """
+    cols = store.category_positions(category)
+    member = store.matrix[:, cols].astype('int64')
+    if isinstance(values, str):
+        rows = store.category_positions(values)
+        left = store.matrix[:, rows].astype('int64')
+        groups = [store.columns[j] for j in rows]
+    else:
+        left, groups = indicator(values)
+    if left.shape[0] != member.shape[0]:
+        raise ValueError('{} values for {} people'.format(left.shape[0],
+                                                         member.shape[0]))
+    table = (left.T @ member).tocsr()
+    return table, groups, [store.columns[j] for j in cols]
+
+def crosstab(values, store, category=None):
+    """ Output:
+            A DataFrame of sparse_crosstab(): a row per group, a column per
+            resource. Only the (groups x resources) table is ever dense.
+    Example:
+        crosstab(df['gender'].values, store, 'films')
+        crosstab('starships', store, 'films')
+    """
+    table, groups, resources = sparse_crosstab(values, store, category)
+    return pd.DataFrame(table.toarray(), index=groups, columns=resources)
+
+def signatures(matrix):
+    """ Input:
+            matrix: scipy CSR matrix - people x resources
+        Output:
+            codes: numpy int array - each person's signature, the position of
+                their set of resources in order of first appearance
+            first: numpy int array - a person with each signature
+    """
+    m = matrix.tocsr()
+    m.sort_indices()
+    ind, ptr = m.indices, m.indptr
+    keys = np.empty(m.shape[0], dtype=object)
+    keys[:] = [ind[a:b].tobytes() for a, b in zip(ptr[:-1], ptr[1:])]
+    codes, uniques = pd.factorize(keys)
+    # codes count up in order of first appearance
+    return codes, np.unique(codes, return_index=True)[1]
+
+
+class CoAppearanceGraph():
+    def __init__(self, store, categories=('films', 'vehicles'), weights=None,
+                 labels=None):
+        """ Input:
+                store: MembershipStore
+                categories: list of strings - the resources that link people
+                weights: dict or None - category -> the weight of sharing one
+                    of its resources. Defaults to 1 for every category.
+                    Weights can't be negative (top_pairs() relies on an edge
+                    never weighing more than either end's total).
+                labels: sequence or None - what to call each person in the
+                    output, e.g. df['name'].values. Defaults to store.index.
+        """
+        self.store = store
+        self.categories = list(categories)
+        weights = weights or dict()
+        negative = {c: v for c, v in weights.items() if v < 0}
+        if negative:
+            raise ValueError('weights must not be negative: {}'.format(
+                negative))
+        cols, w = [], []
+        for c in self.categories:
+            pos = store.category_positions(c)
+            cols += pos
+            w += [weights.get(c, 1.)]*len(pos)
+        self.columns = [store.columns[j] for j in cols]
+        self.incidence = store.matrix[:, cols].astype('float64').tocsr()
+        w = sparse.diags(np.asarray(w, dtype='float64'))
+        self.weighted = (self.incidence @ w).tocsr()
+        self.labels = np.asarray(store.index if labels is None else labels,
+                                 dtype=object)
+        self.signature, first = signatures(self.incidence)
+        self._sig = self.incidence[first]
+        self._sig_w = self.weighted[first]
+        self.sizes = np.bincount(self.signature, minlength=len(first))
+        self.totals = np.asarray(self._sig_w.sum(axis=1)).ravel()
+        # the people with each signature, as slices of one array
+        self._members = np.argsort(self.signature, kind='stable')
+        self._starts = np.cumsum(self.sizes) - self.sizes
+
+    @classmethod
+    def from_frame(cls, df, start=10, **kwargs):
+        """ Input:
+                df: Pandas DataFrame - a People frame with bool membership
+                    columns from position "start" on
+                **kwargs: passed to CoAppearanceGraph()
+        """
+        kwargs.setdefault('labels', df['name'].values)
+        return cls(MembershipStore.from_frame(df, start), **kwargs)
+
+    @property
+    def n_signatures(self):
+        return len(self.sizes)
+
+    def members(self, sig):
+        """ Output:
+                The rows of the people with signature sig.
+        """
+        a = self._starts[sig]
+        return self._members[a:a + self.sizes[sig]]
+
+    def weight(self, a, b):
+        """ Output:
+                float - the weight of the edge between rows a and b
+        """
+        return self.weighted[a].multiply(self.incidence[b]).sum()
+
+    def neighbors(self, row, k=10):
+        """ Input:
+                row: int - the position of a person in the store
+                k: int - the number of neighbors wanted
+            Output:
+                A Series of the k people with the heaviest edges to row (fewer
+                if fewer share anything with them), labelled by self.labels,
+                heaviest first.
+        """
+        s = self.signature[row]
+        scores = (self._sig_w[s] @ self._sig.T).toarray().ravel()
+        linked = np.nonzero(scores > 0)[0]
+        linked = linked[np.argsort(-scores[linked], kind='stable')]
+        rows, weights = [], []
+        for t in linked:
+            m = self.members(t)
+            m = m[m != row][:k - len(rows)]
+            rows += list(m)
+            weights += [scores[t]]*len(m)
+            if len(rows) >= k:
+                break
+        return pd.Series(weights, index=self.labels[np.asarray(rows, 'int64')],
+                         name='weight')
+
+    def top_pairs(self, k=10, max_nnz=10**6):
+        """ Input:
+                k: int - the number of pairs wanted
+                max_nnz: int - roughly the most entries worked out at once.
+                    Signatures are taken in blocks whose products can't hold
+                    more than this (a block always has at least one).
+            Output:
+                A DataFrame of the k heaviest edges in the graph, heaviest
+                first, with 'a', 'b' (labels) and 'weight' columns.
+        """
+        order = np.argsort(-self.totals, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        best_w = np.empty(0)
+        best_s = best_t = best_n = np.empty(0, dtype='int64')
+        threshold = -np.inf
+        # a signature's product row has at most one entry per signature
+        # sharing each of its resources
+        per_resource = self._sig.getnnz(axis=0)
+        cost = np.cumsum((self._sig @ per_resource)[order].astype('int64'))
+        i = 0
+        while i < len(order):
+            # no pair involving this (or any later signature) can weigh more
+            # than its total, so none can beat the k pairs already found
+            if self.totals[order[i]] <= threshold:
+                break
+            spent = cost[i - 1] if i else 0
+            j = max(i + 1, int(np.searchsorted(cost, spent + max_nnz,
+                                               side='right')))
+            sigs, i = order[i:j], j
+            w = (self._sig_w[sigs] @ self._sig.T).tocoo()
+            s, t = sigs[w.row], w.col.astype('int64')
+            # count each pair of signatures once, from the higher ranked side
+            keep = (rank[t] >= rank[s]) & (w.data >= threshold)
+            s, t, data = s[keep], t[keep], w.data[keep]
+            n = np.where(s == t, self.sizes[s]*(self.sizes[s] - 1)//2,
+                         self.sizes[s]*self.sizes[t])
+            keep = n > 0
+            best_w = np.concatenate([best_w, data[keep]])
+            best_s = np.concatenate([best_s, s[keep]])
+            best_t = np.concatenate([best_t, t[keep]])
+            best_n = np.concatenate([best_n, n[keep]])
+            top = np.lexsort((best_t, best_s, -best_w))
+            cum = np.cumsum(best_n[top])
+            top = top[:np.searchsorted(cum, k) + 1]
+            best_w, best_s = best_w[top], best_s[top]
+            best_t, best_n = best_t[top], best_n[top]
+            if len(cum) and cum[len(top) - 1] >= k:
+                threshold = best_w[-1]
+        pairs = []
+        for w, s, t in zip(best_w, best_s, best_t):
+            if s == t:
+                found = combinations(self.members(s), 2)
+            else:
+                found = product(self.members(s), self.members(t))
+            for a, b in islice(found, k - len(pairs)):
+                pairs.append((self.labels[a], self.labels[b], w))
+        return pd.DataFrame(pairs, columns=['a', 'b', 'weight'])
+
+    def max_edges(self):
+        """ Output:
+                int - an upper bound on the number of edges adjacency() would
+                hold: the sum over resources of their members squared.
+        """
+        members = np.asarray(self.incidence.sum(axis=0)).ravel()
+        return int((members.astype('int64')**2).sum())
+
+    def adjacency(self, max_edges=10**7):
+        """ Output:
+                A scipy CSR matrix - people x people, the weight of every
+                edge, with an empty diagonal. Raises a ValueError rather than
+                build it if it could hold more than max_edges entries (use
+                neighbors() or top_pairs() for those).
+        """
+        bound = self.max_edges()
+        if bound > max_edges:
+            raise ValueError('the adjacency matrix could have {} entries '
+                             '(more than max_edges={})'.format(bound,
+                                                               max_edges))
+        a = (self.weighted @ self.incidence.T).tocsr()
+        a = (a - sparse.diags(a.diagonal())).tocsr()
+        a.eliminate_zeros()
+        return a
@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+from urllib.parse import urlparse, parse_qs
+from . import web_utilities
+from . import df_utilities
+from . import async_crawler
+
+"""
+A crawl of a paginated resource that can be stopped and picked up again.
+
+get_json() already retries 429s, 5xxs and connection errors with backoff.
+A page that still fails used to end the crawl early, and the frame built
+from it was quietly missing everyone after that page. A CrawlJob instead
+writes every page to its own file in a checkpoint directory as soon as it
+arrives (so the pages on disk are the partial dataset), and remembers
+nothing else: a page is done if and only if its file exists. Running the
+job again only fetches the pages that are missing, which includes any of
+its pages that ended up in skipped_url.log, and those are taken off the log
+once they have been fetched.
+
+    job = CrawlJob()                    # the People resource
+    job.run()
+    if job.complete:
+        df = job.build_dataframe()      # and the checkpoints are cleared
+
+Once the frame has been built the checkpoints have done their job, so they
+are thrown away, and the next crawl fetches everything fresh rather than
+reusing old pages. sync_people() clears them too, since a refresh makes any
+pages left from an earlier, unfinished crawl out of date.
+
+Checkpoints live in assets/crawl/[resource]-[hash of the base url], so a
+crawl of a local server never mixes with a crawl of the real API.
+"""
+
+
+class IncompleteCrawl(RuntimeError):
+    def __init__(self, missing):
+        """ Input:
+                missing: list of strings - the urls that couldn't be fetched
+        """
+        self.missing = missing
+        super().__init__('{} page(s) could not be fetched, starting with {}. '
+                         'Run the crawl again to fetch just those.'.format(
+                             len(missing), missing[0] if missing else None))
+
+
+def get_crawl_path(base_url):
+    resource = urlparse(base_url).path.rstrip('/').split('/')[-1]
+    digest = hashlib.sha1(base_url.encode()).hexdigest()[:10]
+    return web_utilities.get_asset_path('crawl', '{}-{}'.format(resource,
+                                                                digest))
+
+def page_number(url):
+    q = parse_qs(urlparse(url).query)
+    return int(q.get('page', ['1'])[0])
+
+
+class CrawlJob():
+    def __init__(self, base_url=None, path=None):
+        """ Input:
+                base_url: string or None - the first page of the resource.
+                    Defaults to the People resource.
+                path: string or None - the checkpoint directory. Defaults to
+                    get_crawl_path(base_url).
+        """
+        self.base_url = base_url or web_utilities.API_ROOT + 'people/'
+        self.path = path or get_crawl_path(self.base_url)
+        os.makedirs(self.path, exist_ok=True)
+
+    def page_path(self, n):
+        return os.path.join(self.path, 'page-{:06d}.json'.format(n))
+
+    def read_page(self, n):
+        with open(self.page_path(n), 'r') as f:
+            return json.load(f)
+
+    def save_page(self, n, page):
+        web_utilities.write_json_atomic(self.page_path(n), page)
+
+    def done(self):
+        """ Output:
+                The set of page numbers that have been checkpointed.
+        """
+        return set(int(name[5:-5]) for name in os.listdir(self.path)
+                   if name.startswith('page-') and name.endswith('.json'))
+
+    def urls(self):
+        """ Output:
+                The url of every page, in order, or None until the first page
+                has been fetched (it carries the 'count').
+        """
+        if not os.path.exists(self.page_path(1)):
+            return None
+        first = self.read_page(1)
+        return [self.base_url] + async_crawler.page_urls(self.base_url, first)
+
+    def missing(self):
+        """ Output:
+                The urls of the pages still to be fetched.
+        """
+        urls = self.urls()
+        if urls is None:
+            return [self.base_url]
+        done = self.done()
+        return [u for u in urls if page_number(u) not in done]
+
+    @property
+    def complete(self):
+        return not self.missing()
+
+    async def _fetch(self, fetcher, url):
+        page = await fetcher.fetch(url)
+        if page:
+            self.save_page(page_number(url), page)
+            return url
+
+    async def run_async(self, fetcher=None, **kwargs):
+        """ Input:
+                fetcher: AsyncFetcher or None - built from kwargs if None
+                **kwargs: passed to AsyncFetcher (rate, burst, max_in_flight,
+                    revalidate)
+            Output:
+                bool - whether every page has now been fetched
+        """
+        own_fetcher = fetcher is None
+        fetcher = fetcher or async_crawler.AsyncFetcher(**kwargs)
+        fetched = []
+        try:
+            if self.urls() is None:
+                fetched.append(await self._fetch(fetcher, self.base_url))
+            if self.urls() is not None:
+                fetched += await asyncio.gather(*[
+                    self._fetch(fetcher, u) for u in self.missing()])
+        finally:
+            if own_fetcher:
+                fetcher.close()
+        web_utilities.remove_skipped_urls(u for u in fetched if u)
+        missing = self.missing()
+        if missing:
+            print('{} {} page(s) still missing, run the crawl again to fetch '
+                  'them'.format(len(missing), self.base_url))
+        return not missing
+
+    def run(self, **kwargs):
+        return async_crawler.run_sync(self.run_async(**kwargs))
+
+    def pages(self):
+        """ Output:
+                A generator of the checkpointed pages, in page order.
+        """
+        for url in self.urls() or []:
+            yield self.read_page(page_number(url))
+
+    def build_dataframe(self, keep=False):
+        """ Input:
+                keep: bool - if False, the checkpoints are cleared by reset()
+                    once the frame is built
+            Output:
+                df: Pandas DataFrame - the People frame built from every page.
+                    Raises IncompleteCrawl if any page is missing (and then
+                    the checkpoints are always kept).
+        """
+        missing = self.missing()
+        if missing:
+            raise IncompleteCrawl(missing)
+        builder = df_utilities.PeopleFrameBuilder()
+        for page in self.pages():
+            builder.add(page['results'])
+        df = builder.build()
+        if not keep:
+            self.reset()
+        return df
+
+    def reset(self):
+        """ Throws away every checkpointed page.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path, exist_ok=True)
+
+
+def replay_skipped(**kwargs):
+    """ Input:
+            **kwargs: passed to get_json()
+        Output:
+            The urls in skipped_url.log that still couldn't be fetched. The
+            rest are fetched (and so stored in the response cache) and taken
+            off the log.
+    """
+    fetched = []
+    failed = []
+    for url in web_utilities.read_skipped_urls():
+        if web_utilities.get_json(url, **kwargs) is None:
+            failed.append(url)
+        else:
+            fetched.append(url)
+    web_utilities.remove_skipped_urls(fetched)
+    return failed
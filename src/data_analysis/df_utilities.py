@@ -1,6 +1,13 @@
 import pandas as pd
 import numpy as np
 from . import web_utilities
+from . import cleaning
+from . import metrics
+from . import crawl_job
+from . import iterators
+from .resolver import get_resolver
+from .membership import MembershipStore
+from .cleaning import URLS, MEMBERSHIP
 
 def get_new_col_name(url):
     """ Input:
@@ -14,66 +21,113 @@ def get_new_col_name(url):
     usplit = url.split('/')
     return '{}_{}'.format(usplit[-3], usplit[-2])
 
+BASE_COLUMNS = ['name','birth_year','eye_color','gender','hair_color',
+                'height','mass','skin_color','homeworld', 'species']
+# dictionary keys that aren't being made directly into rows (lists)
+MEMBERSHIP_KEYS = ['films','starships','vehicles']
+
 def fill_in_with_false(df):
     """ Input:
             df: Pandas DataFrame
         Output:
             df: Pandas DataFrame
-        In the add_to_df() function, the lists contained in the 'films',
-        'species', 'starships', and 'vehicles' fields are expanded to columns
-        containing True (if the value was present in that person's dict), or
-        NaN. This goes through and replaces the NaNs we produced in add_to_df()
-        with False
+        When frames with different membership columns are concatenated, the
+        columns missing from one of them are filled in with NaN. This replaces
+        those NaNs with False and casts the membership columns (everything
+        after the first 10) to bool.
     """
-    for c in df.columns[10:]:
-        df[c][df[c].isna()] = False
+    cols = df.columns[10:]
+    if len(cols) > 0:
+        df[cols] = df[cols].fillna(False).astype(bool)
     return df
 
+class PeopleFrameBuilder():
+    def __init__(self, columns=BASE_COLUMNS):
+        """ Input:
+                columns: list of strings - the fields of the People resource
+                    that are copied straight into the frame.
+
+        Collects People results into plain python lists, and records which
+        films, starships and vehicles each person appears in as (row, column)
+        pairs. Nothing is turned into a DataFrame until build() is called, so
+        ingesting N people costs O(N) rather than the O(N^2) of appending to a
+        DataFrame one row at a time.
+        """
+        self.columns = list(columns)
+        self.records = {c: [] for c in self.columns}
+        self.member_cols = dict()   # url -> column position, in order seen
+        self.member_rows = []
+        self.member_pos = []
+        self.n_rows = 0
+
+    def add(self, results):
+        """ Input:
+                results: list of dictionaries - the 'results' field of a page
+                    returned by the People resource.
+        """
+        for i in results:
+            for c in self.columns:
+                # the 'species' field is a list, but it contains either 1 or 0
+                # values in all cases. No hybrids in Star Wars I guess.
+                # using 'unknown' following this API's conventions.
+                if c == 'species':
+                    self.records[c].append(i[c][0] if len(i[c]) > 0
+                                           else 'unknown')
+                else: self.records[c].append(i[c])
+            for c in MEMBERSHIP_KEYS:
+                for j in i[c]:
+                    pos = self.member_cols.setdefault(j, len(self.member_cols))
+                    self.member_rows.append(self.n_rows)
+                    self.member_pos.append(pos)
+            self.n_rows += 1
+        return self
+
+    def build_membership(self):
+        """ Output:
+                store: MembershipStore - the film, starship and vehicle
+                    membership as a sparse matrix, without ever making the
+                    wide frame.
+        """
+        return MembershipStore.from_pairs(self.member_rows, self.member_pos,
+                                          self.n_rows, list(self.member_cols))
+
+    def build(self):
+        """ Output:
+                df: Pandas DataFrame - the base columns, followed by one bool
+                    column per film, starship and vehicle url in the order they
+                    were first seen.
+        """
+        df = pd.DataFrame(self.records, columns=self.columns)
+        member = np.zeros((self.n_rows, len(self.member_cols)), dtype=bool)
+        member[self.member_rows, self.member_pos] = True
+        member = pd.DataFrame(member, columns=list(self.member_cols))
+        return pd.concat([df, member], axis=1)
+
+@metrics.timed('add_to_df')
 def add_to_df(df, results):
     """ Input:
             df: A Pandas DataFrame
             results: list of dictionaries.
         Output:
-            df: A Pandas Dataframe with the results appended as a new row,
+            df: A Pandas Dataframe with the results appended as new rows,
                 and with columns added for new films, starships, etc. The
                 values for these new columns will be True if valid for the
                 person in that row, False otherwise.
 
-        This works by making a new dataframe for each row. The first 10 columns
-        contain the data that can be translated directly from the dictionary
-        returned from the Star Wars API. A new column is created for each item
-        in 'non_row_keys'. For example, the 'starships' field in the dictionary
-        might contain starships 1, 12, and 22. New columns called "starships_1",
-        "starships_12", and "starships_22" would be created and given the value
-        True.
-        Pandas is nice because we can append this row dataframe - which contains
-        columns that are not present in the original dataframe - and Pandas
-        simply fills in the missing values that ensue with NaNs. Because of
-        this, we don't need to know the name of all the columns in our dataframe
-        before we begin!
-        The NaNs are replaced with False by the fill_in_with_false() function.
+        The results are collected by a PeopleFrameBuilder, which makes one
+        frame for the whole batch. The first 10 columns contain the data that
+        can be translated directly from the dictionary returned from the Star
+        Wars API. A new column is created for each url in the 'films',
+        'starships' and 'vehicles' fields. For example, the 'starships' field
+        in the dictionary might contain starships 1, 12, and 22. New columns
+        called "https://swapi.co/api/starships/1/" etc. would be created and
+        given the value True.
+        The batch is concatenated onto df once, and the NaNs that ensue for
+        columns that only one side has are replaced with False by the
+        fill_in_with_false() function.
     """
-    # dictionary keys that aren't being made directly into rows (lists)
-    non_row_keys = ['films','starships','vehicles']
-    for i in results:
-        row_dict = dict()
-        # grabs the fields that can be put into our df w/o modification
-        for c in df.columns[:10]:
-            # the 'species' field is a list, but it contains either 1 or 0
-            # values in all cases. No hybrids in Star Wars I guess.
-            # using 'unknown' following this API's conventions.
-            if c == 'species':
-                row_dict[c] = i[c][0] if len(i[c]) > 0 else 'unknown'
-            else: row_dict[c] = i[c]
-        # ugly solution, but I want to get a minimum viable product.
-        # takes values from fields containing lists, makes columns for each
-        # value, and sets these to True.
-        for c in non_row_keys:
-            for j in i[c]:
-                row_dict[j] = True
-        # special case - seeing what happens
-        # row_dict['species'] = i['species']
-        df = df.append([row_dict], sort=False, ignore_index=True)
+    new = PeopleFrameBuilder(df.columns[:10]).add(results).build()
+    df = pd.concat([df, new], sort=False, ignore_index=True)
     df = fill_in_with_false(df)
     return df
 
@@ -84,9 +138,7 @@ def get_initial_df():
             A Pandas DataFrame. The column names are the keys for the first
             10 fields in the Star Wars API People resource.
     """
-    column_list = ['name','birth_year','eye_color','gender','hair_color',
-                'height','mass','skin_color','homeworld', 'species']
-    return pd.DataFrame(columns=column_list)
+    return pd.DataFrame(columns=BASE_COLUMNS)
 
 def star_date_to_float(x):
     """ Input:
@@ -115,9 +167,7 @@ def format_birth_year(s):
             ended in BBY, they will be negative. If the original string was
             'unknown', it will be replaced with NaN
     """
-    if s.dtype == 'float64':    # prevent this from raising an error if run
-        return s                # multiple times
-    return s.apply(lambda x: star_date_to_float(x))
+    return cleaning.star_dates_to_float(s)
 
 def world_url_to_name(s):
     """ Input:
@@ -127,8 +177,7 @@ def world_url_to_name(s):
             A series in which the urls have been replaced with the name of the
             planet located at that location.
     """
-    world_dict = web_utilities.url_to_val_dict('planets')
-    return s.apply(lambda x: world_dict[x] if x[:8] == 'https://' else x)
+    return pd.Series(get_resolver().resolve(s.values), index=s.index)
 
 def urls_to_names(df, col_name=None):
     """ Input:
@@ -143,23 +192,17 @@ def urls_to_names(df, col_name=None):
     located elsewhere, so I took each new url and turned it into a column -
     with a value of True or False depending on whether it was applicable to a
     given row.
-    This function first builds a dictionary in which the keys are urls, and the
-    values are names. So "https://swapi.co/api/films/1/" would correspond to the
-    value "A New Hope", etc.
-    It then goes through the new columns we added, converts the unintuitive url
-    column names to values that make sense, and updates the dataframe with them.
+    The process-wide UrlResolver keeps a dictionary in which the keys are urls,
+    and the values are names. So "https://swapi.co/api/films/1/" would
+    correspond to the value "A New Hope", etc.
+    This function either converts the unintuitive url column names of the new
+    columns we added to values that make sense, or resolves the urls in
+    col_name, and updates the dataframe with them.
     """
-    d = dict()
-    for i in ['planets','films','species','vehicles','starships']:
-        d = {**d, **web_utilities.url_to_val_dict(i)}
     if not col_name:
-        new_cols = [d[df.columns[i]] if df.columns[i][:8]=='https://' \
-                    else df.columns[i] for i in np.arange(10,df.shape[1],1)]
-        df.columns = list(df.columns[:10]) + new_cols
-        return df
+        return get_resolver().rename_columns(df)
     else:
-        df[col_name] = [d[i] if i[:8]=='https://' else i for i in df[col_name]]
-        return df
+        return get_resolver().resolve_column(df, col_name)
 
 def replace_unknown(df, cols):
     for i in cols:
@@ -172,62 +215,74 @@ def replace_na(df, cat_rep):
         df[c] = [d[j] if j in d.keys() else j for j in df[c]]
     return df
 
-def cleanup(df):
+# Pandas will interpret 'n/a' as NaN if it reads this dataframe
+# from a csv. 'n/a' is significant, however - it doesn't mean
+# that there isn't a value there.
+CLEANUP_RULES = [('birth_year', 'star_date', None),
+                 ('homeworld', 'replace', URLS),
+                 (MEMBERSHIP, 'rename', URLS),
+                 ('species', 'replace', URLS)] + \
+                [(c, 'replace', {'unknown': np.nan}) for c in
+                 ['birth_year','height','mass','skin_color']] + \
+                [('eye_color', 'replace', {'n/a':'no eyes'}),
+                 ('gender', 'replace', {'n/a':'no gender'}),
+                 ('gender', 'replace', {'none':'no gender'}),
+                 ('hair_color', 'replace', {'n/a':'no hair'})]
+
+def cleanup(df, pipeline=None):
     """ Input:
             df: Pandas DataFrame
+            pipeline: CleaningPipeline or None - defaults to one compiled
+                from CLEANUP_RULES
         Output:
             df: Pandas DataFrame
-    Runs a number of functions to clean up the dataframe. This includes
-    replacing the url in the "homeworld" field with the actual name of the
-    planet, replacing the urls in the column names with the film, species,
-    vehicle, and starship names that they're standing in for, and formatting
-    the "birth_year" column.
-
+    Cleans up the dataframe. This includes replacing the url in the
+    "homeworld" and "species" fields with the actual names, replacing the
+    urls in the column names with the film, species, vehicle, and starship
+    names that they're standing in for, formatting the "birth_year" column,
+    and replacing 'unknown' and 'n/a' values.
+    The rules are listed in CLEANUP_RULES, and are compiled by
+    cleaning.CleaningPipeline so that each column is only visited once.
     """
-    float_cols = ['birth_year','height','mass','skin_color']
-    # Pandas will interpret 'n/a' as NaN if it reads this dataframe
-    # from a csv. 'n/a' is significant, however - it doesn't mean
-    # that there isn't a value there.
-    category_replacements = [['eye_color',{'n/a':'no eyes'}],
-                            ['gender',{'n/a':'no gender'}],
-                            ['gender',{'none':'no gender'}],
-                            ['hair_color',{'n/a':'no hair'}]]
-    df['birth_year'] = format_birth_year(df['birth_year'])
-    df = urls_to_names(df, col_name='homeworld')
-    df = urls_to_names(df)
-    df = urls_to_names(df, col_name='species')
-    df = replace_unknown(df, float_cols)
-    df = replace_na(df,category_replacements)
-    return df
+    pipeline = pipeline or cleaning.CleaningPipeline(CLEANUP_RULES)
+    return pipeline.run(df)
 
 def build_dataframe(people_resource=None, df=None):
     """ Input:
-            people_resource: dict - the People resource returned by the Star
-                Wars API.
+            people_resource: dict - a People page returned by the Star Wars
+                API. If given, the crawl continues from its "next" field.
             df: Pandas DataFrame - a dataframe which initially has the keys for
                 the first 10 fields in the People dict as its columns. The
                 fields that contain lists are expanded into new columns.
         Output:
             df: Pandas DataFrame - a dataframe containing the People data from
                 the Star Wars API.
-    This function will create a Pandas DataFrame, visit the base url for the
-    Star Wars API People resources, and then call itself using the "next" field
-    in the response returned by the GET request, (which contains the url of the
-    next page). This allows us to recursively visit each People page in the
-    API, and put the data into a Pandas DataFrame.
+    This function will visit the base url for the Star Wars API People
+    resources, and then every other page, one at a time, as a
+    crawl_job.CrawlJob. Each page is checkpointed to disk as it arrives, so if
+    a page can't be fetched (even after get_json()'s retries) an
+    IncompleteCrawl is raised, and calling this function again only fetches
+    the pages that are still missing. The results from every page are
+    collected by a PeopleFrameBuilder, and the DataFrame is built once at the
+    end.
+    If people_resource is given, the pages from its "next" field on are read
+    with iterators.iter_pages() instead, without checkpoints.
     """
-    base_url = 'http://swapi.co/api/people/'
-    if not people_resource:
-        df = get_initial_df()
-        people_resource = web_utilities.get_json(base_url)
-    else:
-        people_resource = web_utilities.get_json(people_resource['next'])
     if people_resource:
-        df = add_to_df(df, people_resource['results'])
-        df = build_dataframe(people_resource, df)
-    return df
-
-
-
-
-#
+        builder = PeopleFrameBuilder()
+        if people_resource['next']:
+            delay = web_utilities.REQUEST_DELAY
+            for page in iterators.iter_pages(url=people_resource['next'],
+                                             rate=1/delay if delay else 10**6):
+                builder.add(page['results'])
+        new = builder.build()
+    else:
+        job = crawl_job.CrawlJob(web_utilities.API_ROOT + 'people/')
+        # one request at a time, at the pace get_json() would keep
+        delay = web_utilities.REQUEST_DELAY
+        job.run(rate=1/delay if delay else 10**6, burst=1, max_in_flight=1)
+        new = job.build_dataframe()
+    if df is None:
+        return new
+    df = pd.concat([df, new], sort=False, ignore_index=True)
+    return fill_in_with_false(df)
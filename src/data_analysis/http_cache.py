@@ -0,0 +1,169 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+"""
+A persistent on-disk cache for the raw responses returned by the Star Wars
+API. Responses are stored in a SQLite database keyed by url, along with the
+ETag and Last-Modified headers the server sent, so that stale entries can be
+revalidated with a conditional GET instead of being downloaded again.
+"""
+
+CacheEntry = namedtuple('CacheEntry', ['url', 'body', 'etag',
+                                       'last_modified', 'fetched_at'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size INTEGER NOT NULL
+)
+"""
+
+
+class ResponseCache():
+    def __init__(self, path, ttl=24*60*60, max_bytes=256*1024*1024,
+                 offline=False):
+        """ Input:
+                path: string - the location of the SQLite database. The
+                    directory is created if it doesn't exist.
+                ttl: float - the number of seconds an entry is considered
+                    fresh. Fresh entries are served without touching the
+                    network. None means entries never go stale.
+                max_bytes: int - once the stored bodies add up to more than
+                    this, the least recently used entries are evicted.
+                offline: bool - if True, get_json() only serves from the cache
+                    and never makes a request.
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.offline = offline
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute(SCHEMA)
+            self.conn.execute('CREATE INDEX IF NOT EXISTS accessed '
+                              'ON responses (accessed_at)')
+
+    def get(self, url):
+        """ Input:
+                url: string
+            Output:
+                A CacheEntry, or None if the url has never been stored. Marks
+                the entry as recently used.
+        """
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                'SELECT url, body, etag, last_modified, fetched_at '
+                'FROM responses WHERE url = ?', (url,)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute('UPDATE responses SET accessed_at = ? '
+                              'WHERE url = ?', (time.time(), url))
+        return CacheEntry(*row)
+
+    def is_fresh(self, entry):
+        """ Input:
+                entry: CacheEntry
+            Output:
+                True if the entry is younger than the ttl.
+        """
+        if self.ttl is None:
+            return True
+        return time.time() - entry.fetched_at < self.ttl
+
+    @staticmethod
+    def conditional_headers(entry):
+        """ Input:
+                entry: CacheEntry or None
+            Output:
+                A dict of the headers needed to revalidate entry with a
+                conditional GET. Empty if there's nothing to revalidate.
+        """
+        headers = dict()
+        if entry is None:
+            return headers
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def put(self, url, body, headers=None):
+        """ Input:
+                url: string
+                body: bytes - the raw response content
+                headers: mapping or None - the response headers. The ETag and
+                    Last-Modified values are kept for revalidation.
+        """
+        headers = headers or dict()
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?,?,?,?,?,?,?)',
+                (url, body, headers.get('ETag'), headers.get('Last-Modified'),
+                 now, now, len(body)))
+            self._evict()
+
+    def revalidated(self, url):
+        """ Input:
+                url: string - a url the server answered with 304 Not Modified.
+            Restarts the ttl for the stored entry.
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE responses SET fetched_at = ?, '
+                              'accessed_at = ? WHERE url = ?', (now, now, url))
+
+    def invalidate(self, url=None):
+        """ Input:
+                url: string or None - the entry to drop. If None, the whole
+                    cache is emptied.
+        """
+        with self.lock, self.conn:
+            if url is None:
+                self.conn.execute('DELETE FROM responses')
+            else:
+                self.conn.execute('DELETE FROM responses WHERE url = ?',
+                                  (url,))
+
+    def size(self):
+        """ Output:
+                The number of bytes of response bodies currently stored.
+        """
+        with self.lock:
+            total = self.conn.execute(
+                'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        return total
+
+    def _evict(self):
+        """ Drops the least recently used entries until the stored bodies fit
+        in max_bytes. The caller must hold the lock.
+        """
+        if self.max_bytes is None:
+            return
+        total = self.conn.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        doomed = []
+        for url, size in self.conn.execute(
+                'SELECT url, size FROM responses ORDER BY accessed_at'):
+            if total <= self.max_bytes:
+                break
+            doomed.append((url,))
+            total -= size
+        self.conn.executemany('DELETE FROM responses WHERE url = ?', doomed)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
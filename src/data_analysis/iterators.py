@@ -0,0 +1,169 @@
+import asyncio
+import threading
+from collections import deque
+from itertools import islice
+from urllib.parse import urlparse
+import pandas as pd
+from . import web_utilities
+from . import df_utilities
+from . import async_crawler
+from . import crawl_job
+from .resolver import get_resolver
+
+"""
+Lazy, page at a time access to the Star Wars API.
+
+    for person in iter_people():
+        ...
+
+    async for person in aiter_people(clean=True):
+        ...
+
+The first page is yielded as soon as it arrives, so the first record costs
+one request rather than a whole crawl. After that, up to 'prefetch' of the
+following pages are requested ahead of the consumer (they come back in page
+order). A new request is only made when the consumer takes a page, so a slow
+consumer holds the crawl back rather than piling pages up in memory.
+
+A page that can't be fetched (after get_json()'s retries) raises
+IncompleteCrawl, rather than ending the iteration early.
+
+The sync versions drive the async ones on a private event loop, run by a
+thread of its own, so they also work where the caller's thread is already
+running a loop (a Jupyter kernel). The requests themselves run on executor
+threads, so they carry on while the consumer is busy with a page.
+"""
+
+
+async def aiter_pages(category='people', prefetch=4, fetcher=None, url=None,
+                      **kwargs):
+    """ Input:
+            category: string - the resource, e.g. 'people' or 'planets'
+            prefetch: int - the most pages requested ahead of the consumer
+            fetcher: AsyncFetcher or None - built from kwargs if None
+            url: string or None - the first page. Defaults to the first page
+                of category. If it's a later page (it has a query string),
+                the 'next' links are followed from it one at a time.
+            **kwargs: passed to AsyncFetcher (rate, burst, revalidate)
+        Output:
+            An async generator of pages, in page order.
+    """
+    url = url or web_utilities.API_ROOT + '{}/'.format(category)
+    own_fetcher = fetcher is None
+    fetcher = fetcher or async_crawler.AsyncFetcher(
+        max_in_flight=max(prefetch, 1), **kwargs)
+    pending = deque()
+    try:
+        page = await fetcher.fetch(url)
+        if not page:
+            raise crawl_job.IncompleteCrawl([url])
+        yield page
+        if urlparse(url).query:
+            while page['next']:
+                url = page['next']
+                page = await fetcher.fetch(url)
+                if not page:
+                    raise crawl_job.IncompleteCrawl([url])
+                yield page
+            return
+        urls = iter(async_crawler.page_urls(url, page))
+        for u in islice(urls, max(prefetch, 1)):
+            pending.append((u, asyncio.ensure_future(fetcher.fetch(u))))
+        while pending:
+            u, task = pending.popleft()
+            page = await task
+            if not page:
+                raise crawl_job.IncompleteCrawl([u])
+            # top the window back up before handing the page over
+            for nxt in islice(urls, 1):
+                pending.append((nxt, asyncio.ensure_future(fetcher.fetch(nxt))))
+            yield page
+    finally:
+        for u, task in pending:
+            task.cancel()
+        if own_fetcher:
+            fetcher.close()
+
+def clean_people(results):
+    """ Input:
+            results: list of dicts - raw People records
+        Output:
+            The records as cleanup() would leave them: birth years as floats,
+            'unknown's as NaN, the homeworld and species as names, and the
+            'films', 'starships' and 'vehicles' lists as lists of names.
+    """
+    builder = df_utilities.PeopleFrameBuilder().add(results)
+    df = pd.DataFrame(builder.records, columns=builder.columns)
+    cleaned = df_utilities.cleanup(df).to_dict('records')
+    resolver = get_resolver()
+    for rec, raw in zip(cleaned, results):
+        for k in df_utilities.MEMBERSHIP_KEYS:
+            rec[k] = [resolver.name(u) for u in raw[k]]
+    return cleaned
+
+async def aiter_resource(category, **kwargs):
+    """ Input:
+            category: string - the resource, e.g. 'people' or 'planets'
+            **kwargs: passed to aiter_pages()
+        Output:
+            An async generator of raw records.
+    """
+    async for page in aiter_pages(category, **kwargs):
+        for rec in page['results']:
+            yield rec
+
+async def aiter_people(clean=False, **kwargs):
+    """ Input:
+            clean: bool - if True, records are cleaned (see clean_people())
+            **kwargs: passed to aiter_pages()
+        Output:
+            An async generator of People records.
+    """
+    async for page in aiter_pages('people', **kwargs):
+        results = clean_people(page['results']) if clean else page['results']
+        for rec in results:
+            yield rec
+
+async def _anext(agen):
+    return await agen.__anext__()
+
+def _sync(agen):
+    """ Turns an async generator into a generator, running it on its own
+    event loop in a background thread. Closing the generator early closes the
+    async one too, so its outstanding requests are cancelled.
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    def run(coro):
+        return asyncio.run_coroutine_threadsafe(coro, loop).result()
+    try:
+        while True:
+            try:
+                item = run(_anext(agen))
+            except StopAsyncIteration:
+                return
+            yield item
+    finally:
+        run(agen.aclose())
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+def iter_pages(category='people', **kwargs):
+    """ Output:
+            A generator of pages (see aiter_pages()).
+    """
+    return _sync(aiter_pages(category, **kwargs))
+
+def iter_resource(category, **kwargs):
+    """ Output:
+            A generator of raw records (see aiter_resource()).
+    """
+    return _sync(aiter_resource(category, **kwargs))
+
+def iter_people(clean=False, **kwargs):
+    """ Output:
+            A generator of People records (see aiter_people()).
+    """
+    return _sync(aiter_people(clean, **kwargs))
@@ -1,5 +1,7 @@
 import numpy as np
 import pandas as pd
+from . import aggregates
+from .masks import MaskEngine
 
 """
 This document contains some functions I used as a part of my exploratory
@@ -25,7 +27,14 @@ def print_header(x, w, cols):
     print(*[a+' '*5+b for i in range(cols)] , sep='    |', end='\n')
     print('-'*72)
 
-def get_unique_counts(df,x,sort=False):
+def get_unique_counts(df,x,sort=False,version=None):
+    # the aggregate cube already holds the counts for its dimensions, but
+    # finding it means knowing df's version: without one, counting the
+    # column is cheaper than hashing the whole frame
+    if version is not None and aggregates.covers(x):
+        cube = aggregates.get_cube(df, version)
+        if x in cube.dimensions:
+            return cube.counts(x, sort)
     non_na_ind = ~df[x].isna()
     if not sort:
         return np.unique(df[x][non_na_ind], return_counts=True)
@@ -60,16 +69,13 @@ These are obsolete.
 """
 
 def get_height_mask(df, g):
-    return df.apply(lambda x: True if ((x.gender == g) and \
-                    (x.height != 'unknown')) else False, axis = 1)
+    # only 'unknown' heights are left out; NaN heights are kept, as they
+    # always were
+    return pd.Series((df.gender == g).values & (df.height != 'unknown').values,
+                     index=df.index)
 
 def union_not_nan_mask(df, col1, col2, val):
     if val.lower()[:3] in {'any', 'all'}:
-        uindex = [True if not (pd.isna(df.loc[i][col1]) or pd.isna(df.loc[i][col2]))
-                  else False for i in range(df.shape[0])]
-        return uindex
+        return list(df[col1].notna().values & df[col2].notna().values)
     else:
-        return df.apply(lambda x: True if ((x[col1] == val)\
-                        and (x[col2] != 'unknown')\
-                        and not (pd.isna(x[col2])))\
-                        else False, axis = 1)
+        return MaskEngine(df).mask(col1, col2, val)
@@ -0,0 +1,352 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import pandas as pd
+from . import web_utilities
+from .relational import parse_id
+from .resolver import CATEGORIES
+
+"""
+A local stand-in for the Star Wars API.
+
+swapi.co is long gone, so this serves the same json shapes from local data:
+either the people in assets/dataframe.csv (turned back into raw People
+records) along with the url dictionaries in assets/json, or any number of
+synthetic people generated on the fly. Pages carry the usual 'count',
+'next', 'previous' and 'results' fields, and latency and 429/5xx errors can
+be injected to load test the crawler, the retries and the caches.
+
+The urls inside the records stay on https://swapi.co/api/ (so they match the
+url dictionaries), while the pagination links point at this server. To point
+the project at it:
+
+    python -m data_analysis.local_swapi --port 8000 --people 1000000
+    export SWAPI_ROOT=http://127.0.0.1:8000/api/
+"""
+
+DATA_ROOT = 'https://swapi.co/api/'
+TIMESTAMP = '2014-12-20T21:17:56.891000Z'
+
+EYE_COLORS = ['blue', 'brown', 'yellow', 'red', 'black', 'n/a', 'unknown']
+GENDERS = ['male', 'female', 'n/a', 'none', 'hermaphrodite']
+HAIR_COLORS = ['black', 'brown', 'blond', 'none', 'n/a', 'white', 'unknown']
+SKIN_COLORS = ['fair', 'light', 'dark', 'green', 'grey', 'unknown']
+# the 'n/a' values cleanup() rewrote, so they can be put back
+UNCLEAN = {'eye_color': {'no eyes': 'n/a'},
+           'gender': {'no gender': 'n/a'},
+           'hair_color': {'no hair': 'n/a'}}
+
+
+def load_reference():
+    """ Output:
+            dict - category -> {url: name}, from assets/json
+    """
+    d = dict()
+    for c in CATEGORIES:
+        with open(web_utilities.get_val_dict_path(c), 'r') as f:
+            d[c] = json.load(f)
+    return d
+
+def reference_records(reference, category):
+    """ Output:
+            The records for a reference category, with just 'name' (or
+            'title' for films) and 'url'.
+    """
+    key = 'title' if category == 'films' else 'name'
+    return [{key: name, 'url': url, 'created': TIMESTAMP, 'edited': TIMESTAMP}
+            for url, name in sorted(reference[category].items(),
+                                    key=lambda x: int(x[0].split('/')[-2]))]
+
+def _unknown(x, fmt='{:g}'):
+    if isinstance(x, str):
+        return x
+    return 'unknown' if pd.isna(x) else fmt.format(x)
+
+def asset_people(reference=None):
+    """ Output:
+            A list of raw People records rebuilt from assets/dataframe.csv.
+            Values cleanup() threw away (e.g. 'n/a' vs 'none' genders) come
+            back as 'n/a'.
+    """
+    reference = reference or load_reference()
+    url_of = {c: {name: url for url, name in reference[c].items()}
+              for c in CATEGORIES}
+    df = pd.read_csv(web_utilities.get_asset_path('dataframe.csv'),
+                     index_col=0)
+    member_cols = list(df.columns[10:])
+    member_urls = []
+    for c in member_cols:
+        for cat in ['films', 'starships', 'vehicles']:
+            if c in url_of[cat]:
+                member_urls.append((cat, url_of[cat][c]))
+                break
+        else:
+            member_urls.append((None, None))
+    people = []
+    for i, row in enumerate(df.itertuples(index=False)):
+        row = dict(zip(df.columns, row))
+        by = row['birth_year']
+        rec = {'name': row['name'],
+               'birth_year': 'unknown' if pd.isna(by) else
+                             '{:g}{}'.format(abs(by), 'BBY' if by < 0
+                                             else 'ABY'),
+               'height': _unknown(row['height']),
+               'mass': _unknown(row['mass']),
+               'skin_color': _unknown(row['skin_color'], '{}'),
+               'homeworld': url_of['planets'].get(row['homeworld'],
+                                                  row['homeworld']),
+               'species': [url_of['species'][row['species']]]
+                          if row['species'] in url_of['species'] else [],
+               'films': [], 'starships': [], 'vehicles': [],
+               'created': TIMESTAMP, 'edited': TIMESTAMP,
+               'url': '{}people/{}/'.format(DATA_ROOT, i + 1)}
+        for c, d in UNCLEAN.items():
+            rec[c] = d.get(row[c], row[c])
+        for c, (cat, url) in zip(member_cols, member_urls):
+            if cat and row[c] == True:
+                rec[cat].append(url)
+        people.append(rec)
+    return people
+
+
+class SyntheticPeople():
+    def __init__(self, n, seed=0, reference=None):
+        """ Input:
+                n: int - the number of people
+                seed: int - the same seed always gives the same people
+                reference: dict or None - as returned by load_reference()
+
+        Acts like a read-only list of n People records, each one generated
+        when it is asked for, so millions of people cost no memory.
+        """
+        self.n = n
+        self.seed = seed
+        reference = reference or load_reference()
+        self.urls = {c: sorted(reference[c]) for c in CATEGORIES}
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.n))]
+        if i < 0:
+            i += self.n
+        if not 0 <= i < self.n:
+            raise IndexError(i)
+        return self.person(i)
+
+    def by_id(self, record_id):
+        """ Output:
+                The person whose url ends in record_id (ids run from 1 to n),
+                or None.
+        """
+        if not 1 <= record_id <= self.n:
+            return None
+        return self.person(record_id - 1)
+
+    def person(self, i):
+        rng = np.random.RandomState((self.seed*1000003 + i) % 2**32)
+        def pick(c, lo, hi):
+            k = rng.randint(lo, hi + 1)
+            return [self.urls[c][j] for j in
+                    rng.choice(len(self.urls[c]), k, replace=False)]
+        def one_of(values):
+            return values[rng.randint(len(values))]
+        return {
+            'name': 'Person {}'.format(i),
+            'birth_year': 'unknown' if rng.rand() < .4
+                          else '{:.1f}BBY'.format(rng.uniform(0, 900)),
+            'eye_color': one_of(EYE_COLORS),
+            'gender': one_of(GENDERS),
+            'hair_color': one_of(HAIR_COLORS),
+            'height': 'unknown' if rng.rand() < .1
+                      else str(int(rng.normal(175, 30))),
+            'mass': 'unknown' if rng.rand() < .3
+                    else str(int(rng.normal(80, 20))),
+            'skin_color': one_of(SKIN_COLORS),
+            'homeworld': one_of(self.urls['planets']),
+            'species': pick('species', 0, 1),
+            'films': pick('films', 1, 4),
+            'starships': pick('starships', 0, 2),
+            'vehicles': pick('vehicles', 0, 2),
+            'created': TIMESTAMP,
+            'edited': TIMESTAMP,
+            'url': '{}people/{}/'.format(DATA_ROOT, i + 1)}
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def id_lookup(records):
+    """ Input:
+            records: list-like of records
+        Output:
+            A function from an id to the record whose url ends in it (None if
+            there isn't one). The real ids have gaps (the starships start 2,
+            3, 5, 9, ...), so a record's id isn't its position.
+    """
+    if hasattr(records, 'by_id'):
+        return records.by_id
+    return {parse_id(r['url']): r for r in records}.get
+
+
+def make_handler(resources, page_size=10, latency=0, jitter=0,
+                 error_rate=0, error_codes=(429, 500, 503), seed=0):
+    """ Input:
+            resources: dict - category -> list-like of records
+            page_size: int - results per page
+            latency: float - seconds added to every response
+            jitter: float - up to this many extra seconds, at random
+            error_rate: float - the fraction of requests answered with one of
+                error_codes instead of data. 429s carry a Retry-After header.
+            error_codes: sequence of ints
+            seed: int - for the latency and error injection
+        Output:
+            A BaseHTTPRequestHandler class serving:
+                /api/                       the list of categories
+                /api/[category]/?page=N     a page of records
+                /api/[category]/[id]/       a single record
+            Responses carry an ETag, and If-None-Match gets a 304.
+    """
+    rng = random.Random(seed)
+    lock = threading.Lock()
+    lookups = {c: id_lookup(records) for c, records in resources.items()}
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, obj):
+            body = json.dumps(obj).encode()
+            etag = '"{}"'.format(hashlib.sha1(body).hexdigest())
+            if self.headers.get('If-None-Match') == etag:
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_error_code(self, code):
+            self.send_response(code)
+            if code == 429:
+                self.send_header('Retry-After', '1')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def do_GET(self):
+            with lock:
+                delay = latency + rng.uniform(0, jitter)
+                fail = rng.random() < error_rate
+                code = rng.choice(list(error_codes)) if fail else None
+            if delay:
+                time.sleep(delay)
+            if code:
+                return self.send_error_code(code)
+            parsed = urlparse(self.path)
+            parts = [p for p in parsed.path.split('/') if p]
+            base = 'http://{}:{}/api/'.format(*self.server.server_address[:2])
+            if parts == ['api']:
+                return self.send_json({c: '{}{}/'.format(base, c)
+                                       for c in resources})
+            if len(parts) < 2 or parts[0] != 'api' or \
+                    parts[1] not in resources:
+                return self.send_error_code(404)
+            records = resources[parts[1]]
+            if len(parts) == 3 and parts[2].isdigit():
+                record = lookups[parts[1]](int(parts[2]))
+                if record is None:
+                    return self.send_error_code(404)
+                return self.send_json(record)
+            q = parse_qs(parsed.query)
+            try:
+                page = int(q.get('page', ['1'])[0])
+            except ValueError:
+                return self.send_error_code(404)
+            start = (page - 1)*page_size
+            if page < 1 or (start >= len(records) and page > 1):
+                return self.send_error_code(404)
+            url = '{}{}/?page={{}}'.format(base, parts[1])
+            self.send_json({
+                'count': len(records),
+                'next': url.format(page + 1)
+                        if start + page_size < len(records) else None,
+                'previous': url.format(page - 1) if page > 1 else None,
+                'results': records[start:start + page_size]})
+
+    return Handler
+
+def make_resources(people=None, reference=None):
+    """ Input:
+            people: int, list-like or None - the number of synthetic people,
+                a list of records, or None for the people in the assets
+            reference: dict or None - as returned by load_reference()
+        Output:
+            dict - category -> records, for make_handler()
+    """
+    reference = reference or load_reference()
+    if people is None:
+        people = asset_people(reference)
+    elif isinstance(people, int):
+        people = SyntheticPeople(people, reference=reference)
+    resources = {'people': people}
+    for c in CATEGORIES:
+        resources[c] = reference_records(reference, c)
+    return resources
+
+def serve(people=None, host='127.0.0.1', port=0, **kwargs):
+    """ Input:
+            people: passed to make_resources()
+            host, port: where to listen. Port 0 picks a free port.
+            **kwargs: passed to make_handler()
+        Output:
+            server: the running server, on a background thread. Call
+                server.shutdown() when done.
+            root: string - the api root, e.g. "http://127.0.0.1:8000/api/"
+    """
+    handler = make_handler(make_resources(people), **kwargs)
+    server = _Server((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://{}:{}/api/'.format(host, server.server_address[1])
+
+def main():
+    parser = argparse.ArgumentParser(description='A local Star Wars API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--people', type=int, default=None,
+                        help='serve this many synthetic people instead of '
+                             'the ones in assets/dataframe.csv')
+    parser.add_argument('--page-size', type=int, default=10)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--error-codes', type=int, nargs='+',
+                        default=[429, 500, 503])
+    args = parser.parse_args()
+    handler = make_handler(make_resources(args.people), args.page_size,
+                           args.latency, args.jitter, args.error_rate,
+                           args.error_codes)
+    server = _Server((args.host, args.port), handler)
+    print('Serving the Star Wars API on http://{}:{}/api/'.format(
+        args.host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
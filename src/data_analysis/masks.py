@@ -0,0 +1,126 @@
+import numpy as np
+import pandas as pd
+from . import metrics
+
+"""
+Vectorized boolean masks over the People frame.
+
+The plotting code keeps asking the same question: "which rows have col1 equal
+to v, and a valid (not NaN and not 'unknown') value in col2?", once for every
+v in a list of values. Asking it with df.apply(axis=1) runs a python lambda
+per row per value. A MaskEngine instead works out one validity bitmap per
+column and one group index (integer codes from pd.factorize) per categorical
+column the first time they are needed, and then answers the question for
+every value at once with a single scatter into a (values x rows) array.
+"""
+
+
+def valid_mask(s):
+    """ Input:
+            s: Series
+        Output:
+            A numpy bool array, True where s is neither NaN nor 'unknown'.
+    """
+    return (s.notna() & (s != 'unknown')).values
+
+
+class MaskEngine():
+    def __init__(self, df):
+        """ Input:
+                df: Pandas DataFrame - the frame the masks are built for. The
+                    per-column bitmaps and group indexes are cached, so call
+                    invalidate() if df is modified.
+        """
+        self.df = df
+        self._valid = dict()
+        self._groups = dict()
+
+    def invalidate(self, col=None):
+        """ Input:
+                col: string or None - the column whose cached bitmap and group
+                    index should be dropped. None drops everything.
+        """
+        if col is None:
+            self._valid.clear()
+            self._groups.clear()
+        else:
+            self._valid.pop(col, None)
+            self._groups.pop(col, None)
+
+    def valid(self, col):
+        """ Output:
+                The validity bitmap for col (see valid_mask).
+        """
+        if col not in self._valid:
+            self._valid[col] = valid_mask(self.df[col])
+        return self._valid[col]
+
+    def groups(self, col):
+        """ Output:
+                codes: numpy int array - for each row, the position of its
+                    value in the uniques of col (-1 for NaN)
+                lookup: dict - value -> code
+        """
+        if col not in self._groups:
+            codes, uniques = pd.factorize(self.df[col])
+            lookup = {v: i for i, v in enumerate(uniques)}
+            self._groups[col] = (codes, lookup)
+        return self._groups[col]
+
+    def mask(self, col1, col2, val='any'):
+        """ Input:
+                col1: first column of intersection
+                col2: second column of intersection
+                val: the value in column 1 for which we want a mask. 'any' or
+                    'all' means any valid value.
+            Output:
+                mask: boolean Series, indexed like the frame.
+        """
+        return next(self.masks(col1, col2, [val]))
+
+    @metrics.timed('masks')
+    def masks(self, col1, col2, vals):
+        """ Input:
+                col1: first column of intersection
+                col2: second column of intersection
+                vals: list - the values in column 1 for which we want masks.
+                    'any' or 'all' means any valid value.
+            Output:
+                masks: a generator of boolean Series, one per item in vals,
+                    each indexed like the frame. Row i of the mask for v is
+                    True if df[col1][i] == v and df[col2][i] is valid.
+            The rows of every wanted value are found with one scatter and one
+            sort up front. Each mask is only allocated as it is taken, so
+            asking for many values never holds (values x rows) at once.
+        """
+        both = self.valid(col1) & self.valid(col2)
+        codes, lookup = self.groups(col1)
+        # maps a group code to the slot of the first value that wants it
+        code_to_slot = np.full(len(lookup) + 1, -1)
+        slots = []
+        for i, v in enumerate(vals):
+            if isinstance(v, str) and v.lower()[:3] in {'any', 'all'}:
+                slots.append(None)
+            elif v in lookup:
+                if code_to_slot[lookup[v]] < 0:
+                    code_to_slot[lookup[v]] = i
+                slots.append(code_to_slot[lookup[v]])
+            else:
+                slots.append(-1)
+        target = code_to_slot[codes]    # codes of -1 hit the spare slot
+        rows = np.nonzero((target >= 0) & both)[0]
+        # the rows of each slot, as runs of one array
+        order = rows[np.argsort(target[rows], kind='stable')]
+        counts = np.bincount(target[rows], minlength=len(vals))
+        starts = np.cumsum(counts) - counts
+        return self._iter_masks(both, slots, order, starts, counts)
+
+    def _iter_masks(self, both, slots, order, starts, counts):
+        for j in slots:
+            if j is None:
+                m = both.copy()
+            else:
+                m = np.zeros(self.df.shape[0], dtype=bool)
+                if j >= 0:
+                    m[order[starts[j]:starts[j] + counts[j]]] = True
+            yield pd.Series(m, index=self.df.index)
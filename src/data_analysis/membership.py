@@ -0,0 +1,194 @@
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from .resolver import get_resolver
+
+"""
+A compact store for which people appear in which films, starships and
+vehicles.
+
+add_to_df() spreads this out into one bool column per resource. Here it is
+kept as a sparse (people x resources) CSR matrix, which answers "films per
+person" with row slices and row sums. For set queries such as "people in film
+A and B but not C", each resource column is also packed into a bitset (one
+bit per person) the first time it is used, so the query is a handful of
+bitwise ops over n/8 bytes.
+"""
+
+
+def url_category(url):
+    """ Input:
+            url: string - e.g. "https://swapi.co/api/films/1/"
+        Output:
+            The category in the url ("films"), or None if it isn't a url.
+    """
+    if not isinstance(url, str) or '/api/' not in url:
+        return None
+    return url.rstrip('/').split('/')[-2]
+
+
+class MembershipStore():
+    def __init__(self, matrix, columns, index=None, categories=None):
+        """ Input:
+                matrix: scipy sparse matrix - people x resources, nonzero
+                    where a person appears in a resource
+                columns: list of strings - the name (or url) of each resource
+                index: sequence or None - the frame index of each person
+                categories: list of strings or None - 'films', 'starships' or
+                    'vehicles' for each column, if known
+        """
+        self.matrix = sparse.csr_matrix(matrix, dtype=bool)
+        self.columns = list(columns)
+        self.positions = {c: i for i, c in enumerate(self.columns)}
+        n = self.matrix.shape[0]
+        self.index = pd.Index(np.arange(n) if index is None else index)
+        self.categories = list(categories) if categories is not None \
+            else [None]*len(self.columns)
+        self._csc = None
+        self._bits = dict()
+
+    @classmethod
+    def from_pairs(cls, rows, cols, n_rows, columns, index=None):
+        """ Input:
+                rows, cols: sequences of ints - one (person, resource) pair
+                    per membership
+                n_rows: int - the number of people
+                columns: list of strings - the resource urls, in column order
+        """
+        data = np.ones(len(rows), dtype=bool)
+        m = sparse.csr_matrix((data, (rows, cols)),
+                              shape=(n_rows, len(columns)))
+        return cls(m, columns, index, [url_category(c) for c in columns])
+
+    @classmethod
+    def from_frame(cls, df, start=10):
+        """ Input:
+                df: Pandas DataFrame - a People frame with bool membership
+                    columns from position "start" onwards (raw or cleaned)
+        """
+        columns = list(df.columns[start:])
+        m = sparse.csr_matrix(df[columns].values.astype(bool))
+        return cls(m, columns, df.index, cls._categories_for(columns))
+
+    @staticmethod
+    def _categories_for(columns):
+        cats = [url_category(c) for c in columns]
+        if all(c is not None for c in cats):
+            return cats
+        # resolved names: look the category up from the url that maps to it
+        by_name = dict()
+        for url, name in get_resolver().index.items():
+            by_name.setdefault(name, url_category(url))
+        return [cat or by_name.get(c) for c, cat in zip(columns, cats)]
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def nbytes(self):
+        """ Output:
+                The number of bytes held by the sparse matrix.
+        """
+        m = self.matrix
+        return m.data.nbytes + m.indices.nbytes + m.indptr.nbytes
+
+    def rename(self, mapping):
+        """ Input:
+                mapping: dict - old column name -> new column name. Columns
+                    that aren't keys keep their names.
+        """
+        self.columns = [mapping.get(c, c) for c in self.columns]
+        self.positions = {c: i for i, c in enumerate(self.columns)}
+        self._bits.clear()
+        return self
+
+    def column(self, name):
+        """ Output:
+                A numpy bool array, True for every person in resource "name".
+        """
+        if self._csc is None:
+            self._csc = self.matrix.tocsc()
+        j = self.positions[name]
+        out = np.zeros(self.shape[0], dtype=bool)
+        out[self._csc.indices[self._csc.indptr[j]:self._csc.indptr[j+1]]] = True
+        return out
+
+    def bits(self, name):
+        """ Output:
+                The packed bitset for resource "name" (see np.packbits).
+        """
+        if name not in self._bits:
+            self._bits[name] = np.packbits(self.column(name))
+        return self._bits[name]
+
+    def query(self, all_of=(), any_of=(), none_of=()):
+        """ Input:
+                all_of: resources a person must be in every one of
+                any_of: resources a person must be in at least one of
+                none_of: resources a person must not be in
+            Output:
+                A numpy bool array over people.
+        Example:
+            store.query(all_of=['A New Hope', 'Return of the Jedi'],
+                        none_of=['The Force Awakens'])
+        """
+        n_bytes = (self.shape[0] + 7) // 8
+        acc = np.full(n_bytes, 0xFF, dtype=np.uint8)
+        for c in all_of:
+            acc &= self.bits(c)
+        if any_of:
+            either = np.zeros(n_bytes, dtype=np.uint8)
+            for c in any_of:
+                either |= self.bits(c)
+            acc &= either
+        for c in none_of:
+            acc &= ~self.bits(c)
+        return np.unpackbits(acc)[:self.shape[0]].astype(bool)
+
+    def people(self, mask):
+        """ Output:
+                The frame index labels where mask is True.
+        """
+        return self.index[mask]
+
+    def resources_of(self, row, category=None):
+        """ Input:
+                row: int - the position of a person
+                category: string or None - only return resources of this
+                    category ('films', 'starships' or 'vehicles')
+            Output:
+                A list of resource names.
+        """
+        m = self.matrix
+        cols = m.indices[m.indptr[row]:m.indptr[row+1]]
+        return [self.columns[j] for j in sorted(cols)
+                if category is None or self.categories[j] == category]
+
+    def category_positions(self, category=None):
+        """ Output:
+                A list of the column positions of resources of category
+                ('films', 'starships' or 'vehicles'). None gives every column.
+        """
+        if category is None:
+            return list(range(len(self.columns)))
+        return [j for j, c in enumerate(self.categories) if c == category]
+
+    def counts(self, category=None):
+        """ Input:
+                category: string or None - e.g. 'films' for films per person
+            Output:
+                A Series, indexed like the people, with the number of
+                resources (of that category) each person appears in.
+        """
+        m = self.matrix
+        if category is not None:
+            m = m[:, self.category_positions(category)]
+        return pd.Series(np.asarray(m.sum(axis=1)).ravel(), index=self.index)
+
+    def to_frame(self):
+        """ Output:
+                The wide bool DataFrame add_to_df() would produce for these
+                columns.
+        """
+        return pd.DataFrame(self.matrix.toarray(), index=self.index,
+                            columns=self.columns)
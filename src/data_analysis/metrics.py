@@ -0,0 +1,264 @@
+import functools
+import json
+import os
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+"""
+Timing spans, counters and histograms for the fetch -> cleanup -> plot
+pipeline.
+
+    with metrics.span('cleanup', column='homeworld'):
+        ...
+
+    @metrics.timed('add_to_df')
+    def add_to_df(df, results):
+        ...
+
+    metrics.inc('http_bytes', len(body))
+
+Every span's duration goes into the 'span_seconds' histogram, labelled with
+the span's name. Everything is off unless SWAPI_METRICS=1 is set or enable()
+is called; while it's off, span() hands back one shared do-nothing context
+manager, and inc(), observe() and timed functions return after checking a
+single flag, so instrumented code runs at full speed.
+
+The collected values can be read with collect(), written as Prometheus text
+with to_prometheus(), or served at /metrics by serve(). If a json log is
+given (SWAPI_METRICS_LOG, or enable(json_log=...)), every span is also
+appended to it as a line of json as it finishes, and dump() writes the
+totals.
+"""
+
+PREFIX = 'swapi_'
+BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5,
+           10, 30, 60)
+
+_enabled = False
+_lock = threading.Lock()
+_counters = dict()      # (name, labels) -> total
+_histograms = dict()    # (name, labels) -> [bucket counts..., sum, count]
+_log = None
+
+
+def _labels(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def enabled():
+    return _enabled
+
+def enable(json_log=None):
+    """ Input:
+            json_log: string or None - a file to append a json line to for
+                every finished span
+    """
+    global _enabled, _log
+    with _lock:
+        if json_log and _log is None:
+            _log = open(json_log, 'a')
+        _enabled = True
+
+def disable():
+    global _enabled, _log
+    with _lock:
+        _enabled = False
+        if _log is not None:
+            _log.close()
+            _log = None
+
+def reset():
+    """ Forgets every value collected so far.
+    """
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+def inc(name, value=1, **labels):
+    """ Adds value to the counter name.
+    """
+    if not _enabled:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def observe(name, value, **labels):
+    """ Records value in the histogram name.
+    """
+    if not _enabled:
+        return
+    key = (name, _labels(labels))
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0]*(len(BUCKETS) + 2)
+        for i, le in enumerate(BUCKETS):
+            if value <= le:
+                h[i] += 1
+        h[-2] += value
+        h[-1] += 1
+
+
+class _NullSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span():
+    __slots__ = ('name', 'labels', 't0', 'seconds')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.seconds = None
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.seconds = time.perf_counter() - self.t0
+        observe('span_seconds', self.seconds, span=self.name, **self.labels)
+        if exc_type is not None:
+            inc('span_errors', span=self.name, **self.labels)
+        if _log is not None:
+            line = json.dumps({'time': time.time(), 'span': self.name,
+                               'seconds': self.seconds,
+                               'error': exc_type is not None,
+                               **{k: str(v) for k, v in self.labels.items()}})
+            with _lock:
+                if _log is not None:
+                    _log.write(line + '\n')
+                    _log.flush()
+        return False
+
+
+def span(name, **labels):
+    """ Output:
+            A context manager that times its block as the span name. Its
+            'seconds' attribute holds the duration once the block is done.
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(name, labels)
+
+def timed(name=None):
+    """ A decorator that times every call of a function as a span, named
+    after the function unless name is given.
+    """
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with Span(span_name, {}):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def collect():
+    """ Output:
+            dict - 'counters' and 'histograms', each a list of dicts with the
+            metric's name, labels and values
+    """
+    with _lock:
+        counters = [{'name': n, 'labels': dict(l), 'value': v}
+                    for (n, l), v in sorted(_counters.items())]
+        histograms = [{'name': n, 'labels': dict(l),
+                       'buckets': dict(zip(BUCKETS, h[:-2])),
+                       'sum': h[-2], 'count': h[-1]}
+                      for (n, l), h in sorted(_histograms.items())]
+    return {'counters': counters, 'histograms': histograms}
+
+def dump(path):
+    """ Writes collect() to path as json.
+    """
+    with open(path, 'w') as f:
+        json.dump(collect(), f, indent=2)
+
+def _format_labels(labels, extra=()):
+    items = list(labels.items()) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\')
+                                           .replace('"', '\\"'))
+                          for k, v in items) + '}'
+
+def to_prometheus():
+    """ Output:
+            string - every metric in the Prometheus text exposition format.
+            Counters get a '_total' suffix.
+    """
+    data = collect()
+    lines = []
+    typed = set()
+    for c in data['counters']:
+        name = PREFIX + c['name'] + '_total'
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE {} counter'.format(name))
+        lines.append('{}{} {}'.format(name, _format_labels(c['labels']),
+                                      c['value']))
+    for h in data['histograms']:
+        name = PREFIX + h['name']
+        if name not in typed:
+            typed.add(name)
+            lines.append('# TYPE {} histogram'.format(name))
+        for le, n in h['buckets'].items():
+            lines.append('{}_bucket{} {}'.format(
+                name, _format_labels(h['labels'], [('le', le)]), n))
+        lines.append('{}_bucket{} {}'.format(
+            name, _format_labels(h['labels'], [('le', '+Inf')]), h['count']))
+        lines.append('{}_sum{} {}'.format(name, _format_labels(h['labels']),
+                                          h['sum']))
+        lines.append('{}_count{} {}'.format(name, _format_labels(h['labels']),
+                                            h['count']))
+    return '\n'.join(lines) + '\n'
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip('/') != '/metrics':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = to_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(host='127.0.0.1', port=0):
+    """ Output:
+            server: serving /metrics on a background thread. Call
+                server.shutdown() when done.
+            url: string - e.g. "http://127.0.0.1:9100/metrics"
+    """
+    server = _Server((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://{}:{}/metrics'.format(host,
+                                                  server.server_address[1])
+
+
+if os.environ.get('SWAPI_METRICS', '0') == '1':
+    enable(os.environ.get('SWAPI_METRICS_LOG'))
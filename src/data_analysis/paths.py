@@ -0,0 +1,43 @@
+import os
+
+"""
+Where the project's files live.
+
+The assets directory is found relative to this package (it sits two levels
+up, next to src/), so nothing has to be exported or sourced before the code
+can find its json, fonts, images and datasets. If ASSET_DIR is set (as the
+conda activation script from assets/set_env_vals does), it takes precedence.
+
+The assets are not package data, so this only works from a checkout: run it
+in place, or install it with "pip install -e .". A plain "pip install ."
+copies the package somewhere without assets next to it, and then ASSET_DIR
+has to point at a checkout's assets directory.
+"""
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def get_asset_dir():
+    """ Output:
+            The absolute path of the assets directory. Raises a
+            FileNotFoundError if it doesn't exist.
+    """
+    asset_dir = os.environ.get('ASSET_DIR') or \
+        os.path.normpath(os.path.join(PACKAGE_DIR, '..', '..', 'assets'))
+    if not os.path.isdir(asset_dir):
+        raise FileNotFoundError(
+            'no assets directory at {}. The assets are not installed with '
+            'the package: use an editable install ("pip install -e .") of a '
+            'checkout, or set ASSET_DIR to a checkout\'s assets '
+            'directory.'.format(asset_dir))
+    return asset_dir
+
+def get_asset_path(*args):
+    """ Inputs:
+            *args: a list of strings corresponding to zero or more sub
+                directories within the "assets" directory and a filename.
+        Output:
+            Returns absolute path to the specified location within the assets
+            directory.
+    """
+    return os.path.join(get_asset_dir(), *args)
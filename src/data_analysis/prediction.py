@@ -0,0 +1,230 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+import numpy as np
+import pandas as pd
+from . import df_utilities
+from . import cleaning
+from .regression import LinearModel
+
+"""
+Height predictions from a fitted regression model (see regression.py).
+
+A Predictor loads the persisted coefficients and compiles the cleanup rules
+once, up front. It takes People records exactly as the Star Wars API returns
+them, cleans them with the same CleaningPipeline that cleanup() uses, builds
+the model's features and multiplies.
+
+A MicroBatcher sits in front of a Predictor for concurrent callers: requests
+are queued, and a single thread drains the queue (up to max_batch records,
+waiting at most max_wait seconds for more to arrive) and predicts everything
+it drained with one matrix multiply.
+
+serve() puts a MicroBatcher behind a small http server:
+
+    POST /predict   a record, or a list of records
+                    -> {"predictions": [height or null, ...]}
+    GET  /model     the model's features and coefficients
+
+    python -m data_analysis.prediction --port 8001
+
+benchmarks/load_prediction.py drives it and reports latency percentiles and
+throughput.
+"""
+
+
+class Predictor():
+    def __init__(self, model=None, pipeline=None):
+        """ Input:
+                model: LinearModel, string or None - a model, the path of a
+                    saved one, or None for the default path
+                pipeline: CleaningPipeline or None - defaults to one compiled
+                    from df_utilities.CLEANUP_RULES
+        """
+        if not isinstance(model, LinearModel):
+            model = LinearModel.load(model)
+        self.model = model
+        self.pipeline = pipeline or \
+            cleaning.CleaningPipeline(df_utilities.CLEANUP_RULES)
+        # builds the url -> name dictionary now, rather than on the first
+        # request
+        self.prepare([])
+
+    def prepare(self, records):
+        """ Input:
+                records: list of dicts - raw People records
+            Output:
+                The cleaned frame of their base columns (the film, starship
+                and vehicle columns aren't built, the model doesn't use them).
+        """
+        builder = df_utilities.PeopleFrameBuilder().add(records)
+        df = pd.DataFrame(builder.records, columns=builder.columns)
+        return self.pipeline.run(df)
+
+    def predict(self, records):
+        """ Input:
+                records: a raw People record, or a list of them
+            Output:
+                A numpy array of predicted heights, NaN for any record with a
+                missing feature.
+        """
+        if isinstance(records, dict):
+            records = [records]
+        return self.model.predict(self.prepare(records))
+
+
+class MicroBatcher():
+    def __init__(self, predictor, max_batch=512, max_wait=.002):
+        """ Input:
+                predictor: Predictor
+                max_batch: int - the most records predicted at once
+                max_wait: float - how long, in seconds, a batch is held open
+                    for more requests after the first one arrives
+        """
+        self.predictor = predictor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, records):
+        """ Output:
+                A Future for the predictions (see Predictor.predict).
+        """
+        if isinstance(records, dict):
+            records = [records]
+        future = Future()
+        self._queue.put((records, future))
+        return future
+
+    def predict(self, records, timeout=None):
+        return self.submit(records).result(timeout)
+
+    def _drain(self):
+        batch = [self._queue.get()]
+        size = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=max(remaining, 0)) \
+                    if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._drain()
+            records = [r for rs, f in batch for r in rs]
+            try:
+                pred = self.predictor.predict(records)
+            except Exception:
+                # one bad request shouldn't fail the others it was batched
+                # with, so fall back to predicting them one at a time
+                for rs, f in batch:
+                    try:
+                        f.set_result(self.predictor.predict(rs))
+                    except Exception as e:
+                        f.set_exception(e)
+                continue
+            start = 0
+            for rs, f in batch:
+                f.set_result(pred[start:start + len(rs)])
+                start += len(rs)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_handler(batcher):
+    """ Output:
+            A BaseHTTPRequestHandler class answering /predict and /model from
+            batcher.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, obj, code=200):
+            body = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path.rstrip('/') != '/model':
+                return self.send_json({'error': 'not found'}, 404)
+            self.send_json(batcher.predictor.model.to_dict())
+
+        def do_POST(self):
+            if self.path.rstrip('/') != '/predict':
+                return self.send_json({'error': 'not found'}, 404)
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                records = json.loads(self.rfile.read(length))
+            except ValueError:
+                return self.send_json({'error': 'invalid json'}, 400)
+            if not isinstance(records, (dict, list)):
+                return self.send_json({'error': 'expected a record or a '
+                                                'list of records'}, 400)
+            try:
+                pred = batcher.predict(records)
+            except (KeyError, TypeError, ValueError) as e:
+                return self.send_json({'error': str(e)}, 400)
+            self.send_json({'predictions': [None if np.isnan(p) else
+                                            round(float(p), 2)
+                                            for p in pred]})
+
+    return Handler
+
+def serve(model=None, host='127.0.0.1', port=0, **kwargs):
+    """ Input:
+            model: passed to Predictor()
+            host, port: where to listen. Port 0 picks a free port.
+            **kwargs: passed to MicroBatcher()
+        Output:
+            server: the running server, on a background thread. Call
+                server.shutdown() when done.
+            url: string - e.g. "http://127.0.0.1:8001/"
+    """
+    batcher = MicroBatcher(Predictor(model), **kwargs)
+    server = _Server((host, port), make_handler(batcher))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://{}:{}/'.format(host, server.server_address[1])
+
+def main():
+    parser = argparse.ArgumentParser(description='A height prediction '
+                                                 'server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--model', default=None,
+                        help='a saved model (defaults to '
+                             'assets/json/height_model.json)')
+    parser.add_argument('--max-batch', type=int, default=512)
+    parser.add_argument('--max-wait', type=float, default=.002)
+    args = parser.parse_args()
+    batcher = MicroBatcher(Predictor(args.model), args.max_batch,
+                           args.max_wait)
+    server = _Server((args.host, args.port), make_handler(batcher))
+    print('Serving height predictions on http://{}:{}/predict'.format(
+        args.host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+import itertools
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from . import web_utilities
+from .snapshot import to_float
+
+"""
+Linear regression of height on the features engineered in the notebook's
+Question 3.
+
+The design matrix is built from whole columns at once (isin/map rather than a
+list comprehension per row). Models are fitted in closed form with NumPy
+least squares or QR.
+
+Cross-validation, the bootstrap and the feature-subset search are all done on
+Gram matrices. For k folds, X'X, X'y and y'y are worked out once per fold;
+the training system for any fold and any subset of features is then just the
+total minus that fold, sliced down to the subset's rows and columns, and the
+test error is y'y - 2b'X'y + b'X'Xb over the fold. Scoring a subset never
+goes back to the rows, so thousands of subsets take seconds. Bootstrap
+resamples are drawn as row counts and weighted into Gram matrices a chunk at
+a time. Subsets and bootstrap chunks are spread over a process pool.
+"""
+
+TARGET = 'height'
+
+FEATURES = {
+    'birth_year': lambda df: to_float(df['birth_year']),
+    'mass': lambda df: to_float(df['mass']),
+    'is_female': lambda df: df['gender'].map({'female': 1., 'male': 0.}),
+    'is_bald': lambda df: df['hair_color'].isin(['none', 'no hair'])
+        .astype('float64'),
+    'unusual_skin_color': lambda df: (~df['skin_color']
+        .isin(['fair', 'light', 'dark'])).astype('float64'),
+    'is_human': lambda df: (df['species'] == 'Human').astype('float64'),
+    'eyes_brown_blue': lambda df: df['eye_color'].isin(['brown', 'blue'])
+        .astype('float64'),
+}
+
+DEFAULT_FEATURES = ['is_female', 'is_bald', 'unusual_skin_color', 'is_human',
+                    'eyes_brown_blue', 'mass']
+
+FoldStats = namedtuple('FoldStats', ['gram', 'xy', 'yy', 'n'])
+
+_shared = None
+
+
+def get_model_path():
+    return web_utilities.get_asset_path('json', 'height_model.json')
+
+def feature_matrix(df, features=DEFAULT_FEATURES):
+    """ Input:
+            df: Pandas DataFrame - the cleaned People frame
+            features: list of strings - keys of FEATURES
+        Output:
+            X: numpy float array - an intercept column of ones, then one
+                column per feature. Rows with a missing feature have NaNs.
+    """
+    X = np.empty((len(df), len(features) + 1), dtype='float64')
+    X[:, 0] = 1.
+    for i, f in enumerate(features):
+        X[:, i + 1] = np.asarray(FEATURES[f](df), dtype='float64')
+    return X
+
+def design_matrix(df, features=DEFAULT_FEATURES, target=TARGET):
+    """ Output:
+            X: numpy float array - see feature_matrix
+            y: numpy float array - the target
+        Like the notebook, rows with any missing value are dropped.
+    """
+    X = feature_matrix(df, features)
+    y = to_float(df[target]).values
+    keep = ~(np.isnan(X).any(axis=1) | np.isnan(y))
+    return X[keep], y[keep]
+
+def fit(X, y, method='lstsq'):
+    """ Input:
+            X: numpy float array - the design matrix
+            y: numpy float array - the target
+            method: string - 'lstsq' (SVD based, copes with collinear
+                columns) or 'qr'
+        Output:
+            The coefficients, intercept first.
+    """
+    if method == 'qr':
+        q, r = np.linalg.qr(X)
+        return np.linalg.solve(r, q.T @ y)
+    return np.linalg.lstsq(X, y, rcond=None)[0]
+
+def r_squared(y, y_pred):
+    return 1 - ((y - y_pred)**2).sum() / ((y - y.mean())**2).sum()
+
+
+class LinearModel():
+    def __init__(self, features, coef, target=TARGET):
+        """ Input:
+                features: list of strings - keys of FEATURES
+                coef: sequence of floats - the intercept, then one coefficient
+                    per feature
+                target: string - the column being predicted
+        """
+        self.features = list(features)
+        self.coef = np.asarray(coef, dtype='float64')
+        self.target = target
+
+    @classmethod
+    def from_frame(cls, df, features=DEFAULT_FEATURES, target=TARGET,
+                   method='lstsq'):
+        X, y = design_matrix(df, features, target)
+        return cls(features, fit(X, y, method), target)
+
+    def predict_matrix(self, X):
+        return X @ self.coef
+
+    def predict(self, df):
+        """ Output:
+                A numpy array of predictions for every row of df, NaN where a
+                feature is missing.
+        """
+        return self.predict_matrix(feature_matrix(df, self.features))
+
+    def score(self, df):
+        X, y = design_matrix(df, self.features, self.target)
+        return r_squared(y, self.predict_matrix(X))
+
+    def to_dict(self):
+        return {'target': self.target, 'features': self.features,
+                'intercept': float(self.coef[0]),
+                'coef': dict(zip(self.features, self.coef[1:].tolist()))}
+
+    @classmethod
+    def from_dict(cls, d):
+        coef = [d['intercept']] + [d['coef'][f] for f in d['features']]
+        return cls(d['features'], coef, d['target'])
+
+    def save(self, path=None):
+        web_utilities.write_json_atomic(path or get_model_path(),
+                                        self.to_dict())
+
+    @classmethod
+    def load(cls, path=None):
+        with open(path or get_model_path(), 'r') as f:
+            return cls.from_dict(json.load(f))
+
+
+def fold_stats(X, y, k=5, seed=1337):
+    """ Output:
+            FoldStats - for each of k random folds, X'X (k x p x p), X'y
+            (k x p), y'y (k) and the number of rows (k)
+    """
+    folds = np.random.RandomState(seed).permutation(len(y)) % k
+    p = X.shape[1]
+    stats = FoldStats(np.empty((k, p, p)), np.empty((k, p)), np.empty(k),
+                      np.empty(k))
+    for f in range(k):
+        Xf, yf = X[folds == f], y[folds == f]
+        stats.gram[f] = Xf.T @ Xf
+        stats.xy[f] = Xf.T @ yf
+        stats.yy[f] = yf @ yf
+        stats.n[f] = len(yf)
+    return stats
+
+def _solve(a, b):
+    """ Solves a stack of systems, falling back to the pseudo-inverse if any
+    of them is singular (e.g. a feature that is constant in some fold).
+    """
+    try:
+        return np.linalg.solve(a, b[..., None])[..., 0]
+    except np.linalg.LinAlgError:
+        return np.einsum('...ij,...j->...i', np.linalg.pinv(a), b)
+
+def cv_error(stats, cols=None):
+    """ Input:
+            stats: FoldStats
+            cols: sequence of ints or None - the columns of the design matrix
+                to use. None uses them all.
+        Output:
+            A numpy array of the mean squared test error in each fold.
+    """
+    cols = np.arange(stats.gram.shape[1]) if cols is None \
+        else np.asarray(cols)
+    gram = stats.gram[:, cols[:, None], cols]
+    xy = stats.xy[:, cols]
+    beta = _solve(gram.sum(axis=0) - gram, xy.sum(axis=0) - xy)
+    sse = stats.yy - 2*(beta*xy).sum(axis=1) + \
+        np.einsum('ki,kij,kj->k', beta, gram, beta)
+    return sse / stats.n
+
+def cross_validate(X, y, k=5, seed=1337):
+    """ Output:
+            dict - 'mse' (per fold), 'mean_mse', and 'r2' (out of fold, over
+            every row)
+    """
+    stats = fold_stats(X, y, k, seed)
+    mse = cv_error(stats)
+    sst = ((y - y.mean())**2).sum()
+    return {'mse': mse, 'mean_mse': mse.mean(),
+            'r2': 1 - (mse*stats.n).sum() / sst}
+
+def _init_worker(shared):
+    global _shared
+    _shared = shared
+
+def _pool_map(fn, chunks, shared, workers=None):
+    """ Runs fn on every chunk, in a process pool when there's more than one
+    worker. shared is handed to each worker once, as the module global
+    _shared, rather than with every chunk.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(chunks) == 1:
+        _init_worker(shared)
+        return [fn(c) for c in chunks]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(shared,)) as pool:
+        return list(pool.map(fn, chunks))
+
+def _chunk(items, n):
+    size = max(1, -(-len(items) // n))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def _bootstrap_chunk(job):
+    seed, n_boot = job
+    X, y = _shared
+    n = len(y)
+    rs = np.random.RandomState(seed)
+    counts = rs.multinomial(n, np.full(n, 1./n), size=n_boot).astype('float64')
+    gram = np.einsum('bn,ni,nj->bij', counts, X, X)
+    xy = counts @ (X*y[:, None])
+    return _solve(gram, xy)
+
+def bootstrap(X, y, n_boot=1000, seed=1337, alpha=.05, workers=None,
+              chunk_size=250):
+    """ Input:
+            X, y: the design matrix and target
+            n_boot: int - the number of resamples
+            alpha: float - 1 - the confidence level
+            workers: int or None - processes to use. None uses every core.
+            chunk_size: int - resamples per task
+        Output:
+            low, high: numpy arrays - the percentile confidence interval of
+                each coefficient
+            samples: numpy array - (n_boot x p) coefficients
+    """
+    jobs = [(seed + i, min(chunk_size, n_boot - start))
+            for i, start in enumerate(range(0, n_boot, chunk_size))]
+    samples = np.concatenate(_pool_map(_bootstrap_chunk, jobs, (X, y),
+                                       workers))
+    low, high = np.percentile(samples, [100*alpha/2, 100*(1 - alpha/2)],
+                              axis=0)
+    return low, high, samples
+
+def _subset_chunk(subsets):
+    return [cv_error(_shared, (0,) + s).mean() for s in subsets]
+
+def subset_search(X, y, names, k=5, seed=1337, min_size=1, max_size=None,
+                  top=10, workers=None):
+    """ Input:
+            X, y: the design matrix (intercept first) and target
+            names: list of strings - the feature name of each column after
+                the intercept
+            k: int - folds
+            min_size, max_size: the range of subset sizes to try. max_size
+                defaults to every feature.
+            top: int - how many subsets to return
+            workers: int or None - processes to use. None uses every core.
+        Output:
+            A list of (mean cross-validated mse, list of feature names),
+            best first. The intercept is always included.
+    """
+    p = len(names)
+    max_size = max_size or p
+    subsets = [s for r in range(min_size, max_size + 1)
+               for s in itertools.combinations(range(1, p + 1), r)]
+    workers = workers or os.cpu_count() or 1
+    stats = fold_stats(X, y, k, seed)
+    scores = np.concatenate(_pool_map(_subset_chunk,
+                                      _chunk(subsets, 4*workers), stats,
+                                      workers))
+    best = np.argsort(scores)[:top]
+    return [(scores[i], [names[j - 1] for j in subsets[i]]) for i in best]
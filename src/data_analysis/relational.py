@@ -0,0 +1,249 @@
+import asyncio
+import numpy as np
+import pandas as pd
+from . import web_utilities
+from . import async_crawler
+from . import crawl_job
+from .cleaning import star_dates_to_float
+from .snapshot import to_float
+from .resolver import CATEGORIES
+
+"""
+A normalized, in-memory model of the Star Wars API.
+
+Instead of one wide People frame with resolved names and a column for every
+related resource, there is one table per resource, each indexed by the
+integer id parsed from its url. People refer to their homeworld and species
+through integer foreign keys, and to their films, starships and vehicles
+through link tables of (person_id, resource_id) pairs. The row positions
+behind every foreign key and link are worked out once, when the store is
+built, so a join is an np.take rather than a string match.
+
+    store = RelationalStore.from_api()
+    store.aggregate('height', by='homeworld.climate')
+    store.aggregate('height', by='films.title', how='count')
+"""
+
+TABLES = ['people'] + CATEGORIES
+# (people column, table it points to)
+FOREIGN_KEYS = {'homeworld': 'planets', 'species': 'species'}
+LINKS = ['films', 'starships', 'vehicles']
+NUMERIC_PEOPLE = ['height', 'mass']
+# the scalar People fields people_table() relies on, kept even when there are
+# no people
+PEOPLE_COLUMNS = ['name', 'birth_year', 'eye_color', 'gender', 'hair_color',
+                  'height', 'mass', 'skin_color']
+
+
+def parse_id(url):
+    """ Input:
+            url: string - e.g. "https://swapi.co/api/planets/1/"
+        Output:
+            The integer id at the end of the url, or -1 if there isn't one.
+    """
+    if not isinstance(url, str):
+        return -1
+    tail = url.rstrip('/').split('/')[-1]
+    return int(tail) if tail.isdigit() else -1
+
+def records_to_table(records, columns=()):
+    """ Input:
+            records: list of dicts - the 'results' of a resource's pages
+            columns: list of strings - columns the table must have, even if
+                there are no records
+        Output:
+            A DataFrame indexed by id, with every field that isn't a list or
+            a url (and isn't 'created'/'edited'). No records give an empty
+            table with just the given columns.
+    """
+    if not records:
+        return pd.DataFrame(columns=list(columns),
+                            index=pd.Index([], dtype='int64', name='id'))
+    skip = {'url', 'created', 'edited'}
+    rows = []
+    for r in records:
+        row = {k: v for k, v in r.items() if k not in skip and
+               not isinstance(v, list) and
+               not (isinstance(v, str) and v.startswith('http'))}
+        row['id'] = parse_id(r['url'])
+        rows.append(row)
+    return pd.DataFrame(rows).set_index('id').sort_index()
+
+def people_table(records):
+    """ Input:
+            records: list of dicts - the 'results' of the People pages
+        Output:
+            The people table: the scalar fields, with birth_year, height and
+            mass as floats, 'unknown' as NaN, and homeworld_id/species_id as
+            integer foreign keys (-1 where missing).
+    """
+    df = records_to_table(records, PEOPLE_COLUMNS)
+    by_id = {parse_id(r['url']): r for r in records}
+    df['homeworld_id'] = [parse_id(by_id[i]['homeworld']) for i in df.index]
+    df['species_id'] = [parse_id(by_id[i]['species'][0])
+                        if by_id[i]['species'] else -1 for i in df.index]
+    df['birth_year'] = star_dates_to_float(df['birth_year'])
+    for c in NUMERIC_PEOPLE:
+        df[c] = to_float(df[c])
+    return df
+
+def link_table(records, field):
+    """ Input:
+            records: list of dicts - the 'results' of the People pages
+            field: string - 'films', 'starships' or 'vehicles'
+        Output:
+            A DataFrame with one (person_id, [field]_id) row per link.
+    """
+    pairs = [(parse_id(r['url']), parse_id(u)) for r in records
+             for u in r[field]]
+    return pd.DataFrame(pairs, columns=['person_id', '{}_id'.format(field)],
+                        dtype='int64')
+
+
+def check_complete(url, pages):
+    """ Input:
+            url: string - the first page of a resource
+            pages: list of dicts - the pages crawl_pages() returned for it
+        Raises an IncompleteCrawl, naming the pages that are missing, unless
+        pages holds every record of the resource.
+    """
+    urls = [url] + (async_crawler.page_urls(url, pages[0]) if pages else [])
+    if pages and len(pages) == len(urls) and \
+            pages[0]['count'] == sum(len(p['results']) for p in pages):
+        return
+    raise crawl_job.IncompleteCrawl(urls[len(pages):] or [url])
+
+
+class RelationalStore():
+    def __init__(self, tables, links):
+        """ Input:
+                tables: dict - table name -> DataFrame indexed by id
+                links: dict - link name ('films' etc.) -> DataFrame of
+                    (person_id, [link]_id) pairs
+        """
+        self.tables = tables
+        self.links = links
+        self.build_indexes()
+
+    @classmethod
+    def from_records(cls, records):
+        """ Input:
+                records: dict - table name -> list of raw API records
+        """
+        tables = {'people': people_table(records['people'])}
+        for c in CATEGORIES:
+            tables[c] = records_to_table(records[c])
+        links = {l: link_table(records['people'], l) for l in LINKS}
+        return cls(tables, links)
+
+    @classmethod
+    def from_api(cls, **kwargs):
+        """ Fetches every page of every table (through the response cache)
+        and builds the store. kwargs are passed to AsyncFetcher. Raises an
+        IncompleteCrawl if any page of any table couldn't be fetched, rather
+        than building tables that are quietly missing records.
+        """
+        async def crawl():
+            fetcher = async_crawler.AsyncFetcher(**kwargs)
+            try:
+                return await asyncio.gather(*[async_crawler.crawl_pages(
+                    web_utilities.API_ROOT + '{}/'.format(t), fetcher)
+                    for t in TABLES])
+            finally:
+                fetcher.close()
+        crawls = async_crawler.run_sync(crawl())
+        for t, pages in zip(TABLES, crawls):
+            check_complete(web_utilities.API_ROOT + '{}/'.format(t), pages)
+        records = {t: [r for page in pages for r in page['results']]
+                   for t, pages in zip(TABLES, crawls)}
+        return cls.from_records(records)
+
+    def build_indexes(self):
+        """ Works out, once, the row position in the referenced table for
+        every foreign key and every link (-1 where the target is missing).
+        """
+        people = self.tables['people']
+        self.fk_positions = dict()
+        for fk, target in FOREIGN_KEYS.items():
+            ids = people['{}_id'.format(fk)].values
+            self.fk_positions[fk] = self.tables[target].index.get_indexer(ids)
+        self.link_positions = dict()
+        for l, pairs in self.links.items():
+            person_pos = people.index.get_indexer(pairs['person_id'].values)
+            target_pos = self.tables[l].index.get_indexer(
+                pairs['{}_id'.format(l)].values)
+            self.link_positions[l] = (person_pos, target_pos)
+
+    def _take(self, table, col, positions):
+        values = self.tables[table][col].values
+        out = values.take(np.where(positions >= 0, positions, 0))
+        if (positions < 0).any():
+            out = out.astype(object)
+            out[positions < 0] = np.nan
+        return out
+
+    def column(self, path):
+        """ Input:
+                path: string - a people column ("height"), or a column of a
+                    table people point to through a foreign key
+                    ("homeworld.climate", "species.classification")
+            Output:
+                A numpy array with one value per person.
+        """
+        if '.' not in path:
+            return self.tables['people'][path].values
+        fk, col = path.split('.', 1)
+        return self._take(FOREIGN_KEYS[fk], col, self.fk_positions[fk])
+
+    def join(self, fk, columns=None):
+        """ Input:
+                fk: string - 'homeworld' or 'species'
+                columns: list of strings or None - the columns of the
+                    referenced table to bring in. None brings in all of them.
+            Output:
+                The people table with the referenced columns added, named
+                "[fk].[column]".
+        """
+        target = self.tables[FOREIGN_KEYS[fk]]
+        out = self.tables['people'].copy()
+        for c in columns or target.columns:
+            out['{}.{}'.format(fk, c)] = self._take(FOREIGN_KEYS[fk], c,
+                                                   self.fk_positions[fk])
+        return out
+
+    def aggregate(self, value, by, how='mean'):
+        """ Input:
+                value: string - a numeric people column, e.g. 'height'
+                by: string - what to group by. Either a people column or
+                    foreign key path (see column()), or a linked table column
+                    such as "films.title", in which case each person counts
+                    once for every film they're in.
+                how: string - 'mean', 'sum' or 'count'
+            Output:
+                A Series indexed by group. NaN values are left out.
+        """
+        x = self.column(value).astype('float64')
+        link, col = by.split('.', 1) if '.' in by else (None, None)
+        if link in self.link_positions:
+            person_pos, target_pos = self.link_positions[link]
+            keep = (person_pos >= 0) & (target_pos >= 0)
+            x = x[person_pos[keep]]
+            keys = self.tables[link][col].values[target_pos[keep]]
+        else:
+            keys = self.column(by)
+        codes, uniques = pd.factorize(keys)
+        ok = (codes >= 0) & ~np.isnan(x)
+        n = np.bincount(codes[ok], minlength=len(uniques))
+        if how == 'count':
+            result = n
+        else:
+            total = np.bincount(codes[ok], weights=x[ok],
+                                minlength=len(uniques))
+            if how == 'sum':
+                result = total
+            elif how == 'mean':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    result = total / n
+            else:
+                raise ValueError('unknown aggregate: {}'.format(how))
+        return pd.Series(result, index=uniques, name=value).sort_index()
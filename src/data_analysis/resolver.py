@@ -0,0 +1,157 @@
+import threading
+import numpy as np
+import pandas as pd
+from . import web_utilities
+
+"""
+A process-wide url -> name resolver.
+
+Every Star Wars API resource refers to the others by url. Resolving those
+urls used to mean calling web_utilities.url_to_val_dict() for all five
+categories (re-reading five json files) and merging the results into a new
+dict, every time a column was renamed. A UrlResolver loads each category once,
+keeps a single merged index, and gives every url a small integer id, so that
+whole columns can be resolved or encoded with one vectorized lookup.
+"""
+
+CATEGORIES = ['planets','films','species','vehicles','starships']
+
+
+class UrlResolver():
+    def __init__(self, categories=CATEGORIES, loader=None):
+        """ Input:
+                categories: list of strings - the API categories to index
+                loader: function or None - called with a category and returns
+                    its url -> name dict, or raises if it can't load all of
+                    it. Defaults to web_utilities.url_to_val_dict, which
+                    raises crawl_job.IncompleteCrawl.
+            A category that fails to load isn't kept, so it is tried again
+            on the next lookup rather than leaving its urls unresolved for
+            the rest of the process.
+        """
+        self.categories = list(categories)
+        self.loader = loader or (lambda c: web_utilities.url_to_val_dict(
+            c, v=False, strict=True))
+        self.lock = threading.Lock()
+        self._by_category = dict()
+        # (index, urls, names), replaced as a whole so readers always see
+        # one consistent set
+        self._tables = None
+
+    def invalidate(self, category=None):
+        """ Input:
+                category: string or None - the category to reload on next use.
+                    None reloads every category.
+        """
+        with self.lock:
+            if category is None:
+                self._by_category.clear()
+            else:
+                self._by_category.pop(category, None)
+            self._tables = None
+
+    def _build(self):
+        for c in self.categories:
+            if c not in self._by_category:
+                self._by_category[c] = self.loader(c)
+        index = dict()
+        for c in self.categories:
+            index.update(self._by_category[c])
+        self._tables = (index, pd.Index(list(index.keys())),
+                        np.array(list(index.values()), dtype=object))
+
+    def tables(self):
+        """ Output:
+                index: dict - the merged url -> name dict
+                urls: pd.Index - every url, in id order
+                names: numpy object array - the name for each id
+            Taken together under the lock, so they always belong to the same
+            build, even if invalidate() runs at the same time. Don't modify
+            them.
+        """
+        with self.lock:
+            if self._tables is None:
+                self._build()
+            return self._tables
+
+    @property
+    def index(self):
+        """ Output:
+                The merged url -> name dict. Don't modify it.
+        """
+        return self.tables()[0]
+
+    def name(self, url):
+        """ Input:
+                url: string
+            Output:
+                The name of the resource at url, or url itself if it isn't a
+                known url (so names that have already been resolved pass
+                through unchanged).
+        """
+        return self.index.get(url, url)
+
+    def encode(self, urls):
+        """ Input:
+                urls: sequence of strings
+            Output:
+                A numpy int array of the interned id of each url, -1 for
+                anything that isn't a known url.
+        """
+        return self.tables()[1].get_indexer(urls)
+
+    def decode(self, ids):
+        """ Input:
+                ids: sequence of ints - as returned by encode()
+            Output:
+                A numpy object array of the names for those ids.
+        """
+        return self.tables()[2][np.asarray(ids)]
+
+    def resolve(self, urls):
+        """ Input:
+                urls: sequence of strings
+            Output:
+                A numpy object array with each known url replaced by its name.
+                Anything else is left alone.
+        """
+        index, known, names = self.tables()
+        urls = np.asarray(urls, dtype=object)
+        ids = known.get_indexer(urls)
+        out = urls.copy()
+        hit = ids >= 0
+        out[hit] = names[ids[hit]]
+        return out
+
+    def resolve_column(self, df, col):
+        """ Resolves the urls in df[col] in place, and returns df.
+        """
+        df[col] = self.resolve(df[col].values)
+        return df
+
+    def rename_columns(self, df, start=10):
+        """ Input:
+                df: Pandas DataFrame
+                start: int - the first column to rename. The film, starship
+                    and vehicle columns start after the 10 base columns.
+            Output:
+                df, with the url column names replaced by names.
+        """
+        index = self.index
+        df.columns = list(df.columns[:start]) + \
+            [index.get(c, c) for c in df.columns[start:]]
+        return df
+
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+def get_resolver():
+    """ Output:
+            The UrlResolver shared by everything in this process.
+    """
+    global _resolver
+    with _resolver_lock:
+        if _resolver is None:
+            _resolver = UrlResolver()
+    return _resolver
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+"""
+A versioned binary snapshot of the cleaned People frame.
+
+dataframe.csv loses its dtypes: the booleans, the NaN-vs-'unknown' values and
+the 'n/a' replacements made by cleanup() all get re-parsed from text every
+time it is read. A snapshot is a directory holding one .npy file per column
+and a schema.json describing them:
+
+    float columns     float64, NaN for missing values
+    category columns  int32 codes into a list of categories kept in the
+                      schema, -1 for missing values
+    string columns    fixed width unicode
+    membership        one bool matrix (people x films/starships/vehicles),
+                      saved column-major so a single column is contiguous
+
+Every file is opened memory-mapped, so reading a couple of columns only
+touches the pages for those columns.
+
+The schema also records the dataset version of the frame read_snapshot()
+gives back (see dataset_version()), so anything cached from a snapshot (see
+aggregates.py) can tell whether it is still current without reading the
+data, and agrees with a cache keyed by hashing that frame.
+"""
+
+SNAPSHOT_VERSION = 1
+
+# the schema for the first 10 columns of the cleaned frame
+BASE_SCHEMA = [('name', 'string'),
+               ('birth_year', 'float'),
+               ('eye_color', 'category'),
+               ('gender', 'category'),
+               ('hair_color', 'category'),
+               ('height', 'float'),
+               ('mass', 'float'),
+               ('skin_color', 'category'),
+               ('homeworld', 'category'),
+               ('species', 'category')]
+
+MEMBERSHIP_FILE = 'membership.npy'
+
+
+def to_float(s):
+    """ Input:
+            s: Series - numbers, or strings of numbers. Thousands separators
+                ("1,358") are allowed.
+        Output:
+            A float64 Series, with NaN wherever the value wasn't a number.
+    """
+    if s.dtype.kind in 'fiu':
+        return s.astype('float64')
+    s = s.astype(str).str.replace(',', '', regex=False)
+    return pd.to_numeric(s, errors='coerce').astype('float64')
+
+def dataset_version(df):
+    """ Input:
+            df: Pandas DataFrame
+        Output:
+            string - a hash of df's columns, index and values. Any change to
+            the data gives a new version. This is the only kind of dataset
+            version: the one a snapshot records is this hash of the frame it
+            reads back as.
+    """
+    digest = hashlib.sha1(json.dumps([str(c) for c in df.columns]).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()[:16]
+
+def write_snapshot(df, path):
+    """ Input:
+            df: Pandas DataFrame - the cleaned People frame. The first 10
+                columns must match BASE_SCHEMA, the rest are membership
+                columns.
+            path: string - the snapshot directory
+        The snapshot is written to a temporary directory and then swapped in,
+        so readers never see a half written snapshot.
+    """
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    schema = {'version': SNAPSHOT_VERSION, 'n_rows': int(df.shape[0]),
+              'columns': [], 'membership': [str(c) for c in df.columns[10:]]}
+    index = np.asarray(df.index, dtype='int64')
+    np.save(os.path.join(tmp_path, 'index.npy'), index)
+    for c, kind in BASE_SCHEMA:
+        entry = {'name': c, 'kind': kind, 'file': '{}.npy'.format(c)}
+        if kind == 'float':
+            values = to_float(df[c]).values
+        elif kind == 'category':
+            cat = pd.Categorical(df[c])
+            values = cat.codes.astype('int32')
+            entry['categories'] = [str(i) for i in cat.categories]
+        else:
+            values = df[c].astype(str).values.astype('U')
+        np.save(os.path.join(tmp_path, entry['file']), values)
+        schema['columns'].append(entry)
+    member = np.asfortranarray(df[df.columns[10:]].values.astype(bool))
+    np.save(os.path.join(tmp_path, MEMBERSHIP_FILE), member)
+    with open(os.path.join(tmp_path, 'schema.json'), 'w') as f:
+        f.write(json.dumps(schema))
+    # the version of what readers will get, which isn't quite df (the
+    # categories are decoded, the floats parsed)
+    schema['dataset_version'] = dataset_version(read_snapshot(tmp_path))
+    with open(os.path.join(tmp_path, 'schema.json'), 'w') as f:
+        f.write(json.dumps(schema))
+    old_path = path + '.old'
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+def read_schema(path):
+    """ Input:
+            path: string - the snapshot directory
+        Output:
+            schema: dict - the contents of schema.json. Raises a ValueError if
+                the snapshot was written by a different SNAPSHOT_VERSION.
+    """
+    with open(os.path.join(path, 'schema.json'), 'r') as f:
+        schema = json.load(f)
+    if schema['version'] != SNAPSHOT_VERSION:
+        raise ValueError('snapshot version {} is not supported (expected {})'
+                         .format(schema['version'], SNAPSHOT_VERSION))
+    return schema
+
+def read_dataset_version(path):
+    """ Output:
+            string or None - the dataset version recorded when the snapshot
+            at path was written (None for snapshots from before versions were
+            recorded).
+    """
+    return read_schema(path).get('dataset_version')
+
+def read_snapshot(path, columns=None, as_category=False):
+    """ Input:
+            path: string - the snapshot directory
+            columns: list of strings or None - the columns to read. None reads
+                all of them, in their original order.
+            as_category: bool - if True, category columns are returned as
+                pandas Categoricals. Otherwise they are decoded to object
+                columns of strings (and NaN), like the csv gives.
+        Output:
+            df: Pandas DataFrame - only the requested columns. Files for the
+                other columns are never opened.
+    """
+    schema = read_schema(path)
+    base = {e['name']: e for e in schema['columns']}
+    member_pos = {c: i for i, c in enumerate(schema['membership'])}
+    if columns is None:
+        columns = [e['name'] for e in schema['columns']] + schema['membership']
+    index = np.load(os.path.join(path, 'index.npy'))
+    member = None
+    data = dict()
+    for c in columns:
+        if c in base:
+            e = base[c]
+            values = np.load(os.path.join(path, e['file']), mmap_mode='r')
+            if e['kind'] == 'category':
+                values = pd.Categorical.from_codes(values, e['categories'])
+                if not as_category:
+                    values = np.asarray(values, dtype=object)
+            data[c] = values
+        elif c in member_pos:
+            if member is None:
+                member = np.load(os.path.join(path, MEMBERSHIP_FILE),
+                                 mmap_mode='r')
+            data[c] = member[:, member_pos[c]]
+        else:
+            raise KeyError(c)
+    return pd.DataFrame(data, index=index, columns=columns)
+
+def benchmark_load(csv_path, snapshot_path, columns=None, repeat=5):
+    """ Input:
+            csv_path: string - dataframe.csv
+            snapshot_path: string - a snapshot of the same data
+            columns: list of strings or None - the projection to read from
+                the snapshot (the csv is always read in full)
+            repeat: int - the number of times to time each loader
+        Output:
+            results: dict - for 'csv' and 'snapshot', the best load time in
+                seconds and the peak memory allocated during the load in
+                bytes (as seen by tracemalloc, so memory-mapped pages that are
+                never copied don't count).
+    """
+    loaders = {'csv': lambda: pd.read_csv(csv_path, index_col=0),
+               'snapshot': lambda: read_snapshot(snapshot_path, columns)}
+    results = dict()
+    for k, load in loaders.items():
+        times = []
+        for i in range(repeat):
+            t0 = time.perf_counter()
+            load()
+            times.append(time.perf_counter() - t0)
+        tracemalloc.start()
+        load()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[k] = {'seconds': min(times), 'peak_bytes': peak}
+    return results
@@ -0,0 +1,143 @@
+import json
+import os
+import shutil
+import pandas as pd
+from . import web_utilities
+from . import df_utilities
+from . import snapshot
+from . import iterators
+
+"""
+An out-of-core version of the build -> cleanup -> save pipeline.
+
+build_dataframe() holds every person in memory, cleanup() rewrites whole
+columns, and to_csv() writes everything at the end. Here People pages are
+read one at a time, collected into batches of a fixed number of people, and
+each batch is built, cleaned and written as its own partition (a snapshot,
+see snapshot.py) as soon as it is full. Only one batch is ever in memory, so
+peak memory doesn't grow with the number of people.
+
+A dataset is a directory of partitions plus a _manifest.json. scan() reads it
+back one partition at a time, memory-mapped and with column projection, so
+aggregations can be run over it without loading it all.
+"""
+
+MANIFEST = '_manifest.json'
+
+
+def iter_batches(pages, batch_size=10000):
+    """ Input:
+            pages: iterable of pages
+            batch_size: int - people per batch
+        Output:
+            A generator of lists of up to batch_size records.
+    """
+    batch = []
+    for page in pages:
+        batch.extend(page['results'])
+        while len(batch) >= batch_size:
+            yield batch[:batch_size]
+            batch = batch[batch_size:]
+    if batch:
+        yield batch
+
+def write_manifest(path, manifest):
+    web_utilities.write_json_atomic(os.path.join(path, MANIFEST), manifest)
+
+def read_manifest(path):
+    with open(os.path.join(path, MANIFEST), 'r') as f:
+        return json.load(f)
+
+def stream_to_dataset(path, pages=None, batch_size=10000, overwrite=False):
+    """ Input:
+            path: string - the dataset directory
+            pages: iterable of pages or None - defaults to the People pages,
+                read lazily by iterators.iter_pages(), so the next few pages
+                are being fetched while a batch is built and written
+            batch_size: int - people per partition
+            overwrite: bool - if False, an existing dataset is an error
+        Output:
+            manifest: dict - 'partitions' (one entry per partition, with its
+                directory name, first row and row count), 'rows', and
+                'membership' (every membership column seen, in order)
+
+    The manifest is rewritten after every partition, so an interrupted run
+    leaves a readable dataset of the partitions finished so far.
+    """
+    if os.path.exists(path):
+        if not overwrite:
+            raise FileExistsError(path)
+        shutil.rmtree(path)
+    os.makedirs(path)
+    manifest = {'version': snapshot.SNAPSHOT_VERSION, 'partitions': [],
+                'rows': 0, 'membership': []}
+    seen = set()
+    pages = iterators.iter_pages('people') if pages is None else pages
+    for i, batch in enumerate(iter_batches(pages, batch_size)):
+        df = df_utilities.PeopleFrameBuilder().add(batch).build()
+        df = df_utilities.cleanup(df)
+        df.index = pd.RangeIndex(manifest['rows'], manifest['rows'] + len(df))
+        name = 'part-{:05d}'.format(i)
+        snapshot.write_snapshot(df, os.path.join(path, name))
+        for c in df.columns[10:]:
+            if c not in seen:
+                seen.add(c)
+                manifest['membership'].append(c)
+        manifest['partitions'].append({'name': name,
+                                       'start': manifest['rows'],
+                                       'rows': len(df)})
+        manifest['rows'] += len(df)
+        write_manifest(path, manifest)
+    return manifest
+
+def scan(path, columns=None):
+    """ Input:
+            path: string - the dataset directory
+            columns: list of strings or None - the columns to read. None
+                reads every base column and every membership column.
+        Output:
+            A generator of DataFrames, one per partition. Membership columns
+            that a partition never saw come back as all False.
+    """
+    manifest = read_manifest(path)
+    if columns is None:
+        columns = [c for c, kind in snapshot.BASE_SCHEMA] + \
+            manifest['membership']
+    for part in manifest['partitions']:
+        part_path = os.path.join(path, part['name'])
+        schema = snapshot.read_schema(part_path)
+        have = set(e['name'] for e in schema['columns']) | \
+            set(schema['membership'])
+        df = snapshot.read_snapshot(part_path, [c for c in columns
+                                                if c in have])
+        for c in columns:
+            if c not in have:
+                df[c] = False
+        yield df[columns]
+
+def reduce_dataset(path, fn, combine, columns=None):
+    """ Input:
+            path: string - the dataset directory
+            fn: function - applied to each partition's DataFrame
+            combine: function - folds two results of fn into one
+            columns: passed to scan()
+        Output:
+            The combined result, or None for an empty dataset.
+    Example:
+        heights = reduce_dataset(path,
+                                 lambda df: df.groupby('species').height.sum(),
+                                 lambda a, b: a.add(b, fill_value=0),
+                                 columns=['species', 'height'])
+    """
+    result = None
+    for df in scan(path, columns):
+        r = fn(df)
+        result = r if result is None else combine(result, r)
+    return result
+
+def value_counts(path, col):
+    """ Output:
+            The value counts of column col across every partition.
+    """
+    return reduce_dataset(path, lambda df: df[col].value_counts(),
+                          lambda a, b: a.add(b, fill_value=0), [col])
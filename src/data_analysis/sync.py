@@ -0,0 +1,141 @@
+import json
+import os
+import pandas as pd
+from . import web_utilities
+from . import df_utilities
+from . import async_crawler
+from . import crawl_job
+
+"""
+Incremental refresh of the stored People dataset.
+
+Rather than throwing dataframe.csv away and crawling everything again, every
+People page is revalidated with a conditional GET (so pages the server hasn't
+changed come back as a 304 with no body), and the 'edited' timestamp of each
+person is compared with the one recorded at the last sync. Only new and
+changed people are run through add_to_df()/cleanup(), and the results are
+patched into the stored frame.
+
+The sync state is kept next to the url dictionaries in assets/json, and maps
+each person's url to their 'edited' timestamp and their row in the frame.
+"""
+
+
+def get_state_path():
+    return web_utilities.get_asset_path('json', 'people_state.json')
+
+def load_state(path=None):
+    """ Input:
+            path: string or None - defaults to get_state_path()
+        Output:
+            state: dict - {'people': {url: {'edited': str, 'row': int}}}. Empty
+                if no sync has been run yet.
+    """
+    path = path or get_state_path()
+    if not os.path.exists(path):
+        return {'people': dict()}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def save_state(state, path=None):
+    path = path or get_state_path()
+    web_utilities.write_json_atomic(path, state)
+
+def diff_records(df, state, pages):
+    """ Input:
+            df: Pandas DataFrame - the stored, cleaned People frame
+            state: dict - as returned by load_state()
+            pages: list of dicts - People pages from the API
+        Output:
+            changed: list of (row, record) tuples for people already in df
+                whose 'edited' timestamp differs from the recorded one
+            added: list of records for people not in df
+            seen: set of the urls of every person in pages
+
+    People without a recorded url (i.e. the first sync of a frame that was
+    built before sync state existed) are matched to rows by name, and are
+    treated as changed so that their state gets recorded.
+    """
+    known = state['people']
+    name_to_row = {n: i for i, n in zip(df.index, df['name'])}
+    changed, added, seen = [], [], set()
+    for page in pages:
+        for rec in page['results']:
+            seen.add(rec['url'])
+            entry = known.get(rec['url'])
+            row = entry['row'] if entry else name_to_row.get(rec['name'])
+            if row is None:
+                added.append(rec)
+            elif entry is None or entry['edited'] != rec['edited']:
+                changed.append((row, rec))
+    return changed, added, seen
+
+def sync_people(df, state=None, base_url=None, **kwargs):
+    """ Input:
+            df: Pandas DataFrame - the stored, cleaned People frame. It isn't
+                modified; the patched frame is returned.
+            state: dict or None - as returned by load_state(). Loaded from
+                disk if None.
+            base_url: string or None - the url of the first People page
+            **kwargs: passed to AsyncFetcher (rate, burst, max_in_flight)
+        Output:
+            df: Pandas DataFrame - the patched frame. Changed rows keep their
+                index, new people are appended, people that no longer exist
+                are dropped, and new film/starship/vehicle columns are added
+                (False for everyone who isn't in them).
+            state: dict - the updated sync state
+            summary: dict - 'added', 'changed' and 'removed' (lists of names),
+                'new_columns', and 'pages' (the number of pages visited)
+    """
+    state = state or load_state()
+    pages = async_crawler.run_sync(async_crawler.crawl_pages(
+        base_url, revalidate=True, **kwargs))
+    # any checkpoints from an unfinished crawl are older than these pages
+    crawl_job.CrawlJob(base_url).reset()
+    changed, added, seen = diff_records(df, state, pages)
+    # only trust missing urls as removals if every page came back
+    complete = bool(pages) and pages[0]['count'] == \
+        sum(len(p['results']) for p in pages)
+    removed = [u for u in state['people'] if u not in seen] if complete else []
+
+    records = [rec for row, rec in changed] + added
+    new_cols = []
+    if records:
+        patch = df_utilities.PeopleFrameBuilder().add(records).build()
+        patch = df_utilities.cleanup(patch)
+        new_cols = [c for c in patch.columns[10:] if c not in df.columns]
+        # assign() returns a new frame, so the caller's df is left alone
+        df = df.assign(**{c: False for c in new_cols})
+        patch = patch.reindex(columns=df.columns)
+        patch = df_utilities.fill_in_with_false(patch)
+        start = df.index.max() + 1 if df.shape[0] > 0 else 0
+        patch.index = [row for row, rec in changed] + \
+            list(range(start, start + len(added)))
+        df = pd.concat([df.drop(patch.index, errors='ignore'), patch])
+        df = df.sort_index()
+        for row, rec in zip(patch.index, records):
+            state['people'][rec['url']] = {'edited': rec['edited'],
+                                           'row': int(row)}
+
+    removed_rows = [state['people'][u]['row'] for u in removed]
+    removed_names = list(df.loc[removed_rows, 'name'])
+    df = df.drop(removed_rows)
+    for u in removed:
+        del state['people'][u]
+
+    summary = {'added': [rec['name'] for rec in added],
+               'changed': [rec['name'] for row, rec in changed],
+               'removed': removed_names,
+               'new_columns': new_cols,
+               'pages': len(pages)}
+    return df, state, summary
+
+def print_summary(summary):
+    print('Synced {} pages: {} added, {} changed, {} removed, '
+          '{} new columns'.format(summary['pages'], len(summary['added']),
+                                  len(summary['changed']),
+                                  len(summary['removed']),
+                                  len(summary['new_columns'])))
+    for k in ['added', 'changed', 'removed', 'new_columns']:
+        if summary[k]:
+            print('  {}: {}'.format(k, ', '.join(summary[k])))
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import os
+import threading
+import requests
+
+"""
+Pluggable transports for web_utilities.get_json().
+
+A transport has one method, get(url, headers=None, session=None), which
+returns something that looks like a requests.Response (status_code, content
+and headers). RequestsTransport goes over the network. ReplayTransport
+serves responses recorded on disk, and can record them from another
+transport as it goes, so a crawl can be replayed on a box with no network.
+"""
+
+
+class RequestsTransport():
+    def get(self, url, headers=None, session=None):
+        """ Input:
+                url: string
+                headers: dict or None - extra request headers
+                session: requests.Session or None - used if given, so pooled
+                    connections are reused
+        """
+        return (session or requests).get(url, headers=headers)
+
+
+class RecordedResponse():
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or dict()
+
+
+class ReplayTransport():
+    def __init__(self, directory, inner=None):
+        """ Input:
+                directory: string - where responses are recorded, one json
+                    file per url
+                inner: transport or None - if given, urls that haven't been
+                    recorded are fetched with it and recorded. If None, they
+                    get a 404.
+        """
+        self.directory = directory
+        self.inner = inner
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, url):
+        name = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.directory, '{}.json'.format(name))
+
+    def get(self, url, headers=None, session=None):
+        path = self.path(url)
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                r = json.load(f)
+            return RecordedResponse(r['status'], r['body'].encode(),
+                                    r['headers'])
+        if self.inner is None:
+            return RecordedResponse(404, b'')
+        req = self.inner.get(url, session=session)
+        if req.status_code == 200:
+            keep = {k: req.headers[k] for k in ['ETag', 'Last-Modified']
+                    if k in req.headers}
+            record = {'url': url, 'status': 200, 'headers': keep,
+                      'body': req.content.decode()}
+            tmp_path = '{}.{}.tmp'.format(path, threading.get_ident())
+            with open(tmp_path, 'w') as f:
+                f.write(json.dumps(record))
+            os.replace(tmp_path, path)
+        return req
+
+
+_transport = None
+_transport_lock = threading.Lock()
+
+def get_transport():
+    """ Output:
+            The transport get_json() uses. Defaults to a RequestsTransport,
+            or, if the SWAPI_REPLAY_DIR environment variable is set, a
+            ReplayTransport over that directory (recording anything missing
+            unless SWAPI_OFFLINE=1).
+    """
+    global _transport
+    with _transport_lock:
+        if _transport is None:
+            _transport = RequestsTransport()
+            if 'SWAPI_REPLAY_DIR' in os.environ:
+                offline = os.environ.get('SWAPI_OFFLINE', '0') == '1'
+                _transport = ReplayTransport(os.environ['SWAPI_REPLAY_DIR'],
+                                             None if offline else _transport)
+    return _transport
+
+def set_transport(transport):
+    """ Input:
+            transport: the transport get_json() should use from now on. None
+                goes back to the default.
+    """
+    global _transport
+    _transport = transport
@@ -1,83 +1,318 @@
 import requests
 import json
 import os
-import pandas as pd
+import random
 import time
+import threading
+from email.utils import parsedate_to_datetime
+from . import http_cache
+from . import metrics
+from . import paths
+from .transport import get_transport
 
-def get_json(url):
+# the root every request is made against. Point SWAPI_ROOT at a local server
+# (see local_swapi.py) to run without the real API.
+API_ROOT = os.environ.get('SWAPI_ROOT', 'https://swapi.co/api/')
+# seconds to wait after each request get_json() sends over the network
+REQUEST_DELAY = 1.5
+# failed requests are retried up to MAX_RETRIES times, waiting a random time
+# of up to BACKOFF * 2**attempt seconds (capped at MAX_BACKOFF) in between,
+# or as long as a 429's Retry-After header asks
+MAX_RETRIES = 5
+BACKOFF = 1.0
+MAX_BACKOFF = 60
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+_cache = None
+_cache_off = False      # set_cache(None) was called
+_cache_lock = threading.Lock()
+# get_json()'s default for entry, meaning "look it up in the cache"
+_LOOKUP = object()
+
+def get_cache():
+    """ Input:
+            None
+        Output:
+            The ResponseCache used by get_json(), or None if caching has been
+            turned off. The cache is opened on first use. Its location is
+            taken from the CACHE_DIR environment variable if set, otherwise
+            "assets/cache". Setting SWAPI_OFFLINE=1 makes get_json() serve
+            only from the cache, and SWAPI_CACHE=0 turns the cache off.
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None and not _cache_off and \
+                os.environ.get('SWAPI_CACHE', '1') != '0':
+            _cache = _open_default_cache()
+    return _cache
+
+def _open_default_cache():
+    try:
+        filename = os.path.join(os.environ['CACHE_DIR'],'http_cache.sqlite')
+    except KeyError:
+        filename = get_asset_path('cache','http_cache.sqlite')
+    offline = os.environ.get('SWAPI_OFFLINE', '0') == '1'
+    return http_cache.ResponseCache(filename, offline=offline)
+
+def set_cache(cache):
+    """ Input:
+            cache: ResponseCache or None - the cache get_json() should use.
+                None turns caching off for the rest of the process.
+    """
+    global _cache, _cache_off
+    with _cache_lock:
+        _cache = cache
+        _cache_off = cache is None
+
+def cached_json(url):
+    """ Input:
+            url: string
+        Output:
+            The dictionary stored for "url" if the cache holds a fresh copy
+            (or any copy, in offline mode), otherwise None.
+    """
+    cache = get_cache()
+    if cache is None or url is None:
+        return
+    entry = cache.get(url)
+    if entry and (cache.offline or cache.is_fresh(entry)):
+        return json.loads(entry.body)
+
+def retry_delay(attempt, retry_after=None):
+    """ Input:
+            attempt: int - how many retries have already been made
+            retry_after: string or None - a Retry-After header, either a
+                number of seconds or an http date
+        Output:
+            The number of seconds to wait before the next retry. Without a
+            Retry-After, this is exponential backoff with full jitter.
+    """
+    if retry_after:
+        try:
+            return max(float(retry_after), 0)
+        except ValueError:
+            pass
+        try:
+            when = parsedate_to_datetime(retry_after)
+            return max(when.timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            pass
+    return random.uniform(0, min(MAX_BACKOFF, BACKOFF * 2**attempt))
+
+@metrics.timed('get_json')
+def get_json(url, session=None, delay=None, revalidate=False, retries=None,
+             entry=_LOOKUP):
     """ Input:
             url: string - a valid url.
+            session: requests.Session or None - the session to make the
+                request with, if the transport goes over the network. If
+                None, requests.get is used.
+            delay: float or None - the number of seconds to wait after a
+                request that actually went over the network. Defaults to
+                REQUEST_DELAY.
+            revalidate: bool - if True, a cached copy is always checked with
+                the server, even if it is still fresh.
+            retries: int or None - how many times a failed request (a 429, a
+                5xx or a connection error) is retried. Defaults to
+                MAX_RETRIES.
+            entry: CacheEntry or None - the cache entry for url, if the
+                caller has already looked it up (None if it wasn't cached).
+                By default it is looked up here.
         Output:
-            A dictionry containing the data located at "url".
+            A dictionry containing the data located at "url", or None if it
+            couldn't be fetched.
 
-        This function makes a GET request to "url". If the status code is 200
-        (that is to say - if the GET request is successful), the function will
-        load the json object returned by the API into one or more python
-        dictionaries and return the result. Otherwise it will print an error
-        message and write the skipped url to a log.
+        If the response cache holds a fresh copy of "url", it is returned
+        straight away, with no request and no delay. A stale copy is
+        revalidated with a conditional GET, and a 304 response reuses the
+        stored body. Otherwise this function makes a GET request to "url". If
+        the status code is 200 (that is to say - if the GET request is
+        successful), the function will store the response in the cache, load
+        the json object returned by the API into one or more python
+        dictionaries and return the result. 429s, 5xxs and connection errors
+        are retried with backoff (see retry_delay()). If the request still
+        fails, it will print an error message and write the skipped url to a
+        log.
+        Requests go through the transport returned by
+        transport.get_transport(), which can be swapped for one that replays
+        recorded responses.
+        With metrics on, each call is timed, and cache hits, status codes and
+        bytes received are counted.
     """
-    print("Visiting url: {}".format(url))
     if url == None:
         return
-    req = requests.get(url)
+    cache = get_cache()
+    if entry is _LOOKUP:
+        entry = cache.get(url) if cache else None
+    if entry and (cache.offline or (cache.is_fresh(entry) and not revalidate)):
+        metrics.inc('http_cache', result='hit')
+        return json.loads(entry.body)
+    if cache and cache.offline:
+        metrics.inc('http_cache', result='offline_miss')
+        print('ERROR: {} is not cached and offline mode is on'.format(url))
+        log_skipped_url(url)
+        return
+    metrics.inc('http_cache', result='stale' if entry else 'miss')
+    # only requests that go out are printed, not cache hits
+    print("Visiting url: {}".format(url))
+    headers = http_cache.ResponseCache.conditional_headers(entry)
+    retries = MAX_RETRIES if retries is None else retries
+    for attempt in range(retries + 1):
+        try:
+            with metrics.span('http_request'):
+                req = get_transport().get(url, headers=headers,
+                                          session=session)
+        except requests.RequestException as e:
+            print('ERROR: {}'.format(e))
+            req = None
+            metrics.inc('http_requests', status='error')
+        else:
+            metrics.inc('http_requests', status=req.status_code)
+            if req.status_code not in RETRY_STATUS:
+                break
+        if attempt == retries:
+            break
+        retry_after = req.headers.get('Retry-After') \
+            if req is not None and req.status_code == 429 else None
+        wait = retry_delay(attempt, retry_after)
+        print('Retrying {} in {:.1f}s'.format(url, wait))
+        metrics.inc('http_retries')
+        time.sleep(wait)
     # it's always courteous to add a delay when pulling from a public source
-    time.sleep(1.5)
+    time.sleep(REQUEST_DELAY if delay is None else delay)
+    if req is None:
+        log_skipped_url(url)
+        return
+    if req.status_code == 304 and entry:
+        cache.revalidated(url)
+        return json.loads(entry.body)
     if req.status_code == 200:
+        metrics.inc('http_bytes', len(req.content))
+        if cache:
+            cache.put(url, req.content, req.headers)
         return json.loads(req.content)
     else:
         print('ERROR: STATUS CODE {}'.format(req.status_code))
         log_skipped_url(url)
 
+def get_skipped_log_path():
+    try:
+        return os.path.join(os.environ['LOG_DIR'],'skipped_url.log')
+    except KeyError:
+        return get_asset_path('logs','skipped_url.log')
+
 def log_skipped_url(url):
     """ Input:
             url: string - a url that was skipped for some reason
         Output:
             appends the url to the end of "skipped_url.log"
     """
-    try:
-        filename = os.path.join(os.environ['LOG_DIR'],'skipped_url.log')
-    except KeyError:
-        filename = get_asset_path('logs','skipped_url_log')
-    with open(filename, 'a') as f:
+    path = get_skipped_log_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as f:
         f.write(url+'\n')
 
+def read_skipped_urls():
+    """ Output:
+            The urls in "skipped_url.log", without repeats, in the order they
+            were first logged.
+    """
+    try:
+        with open(get_skipped_log_path(), 'r') as f:
+            return list(dict.fromkeys(l.strip() for l in f if l.strip()))
+    except FileNotFoundError:
+        return []
+
+def remove_skipped_urls(urls):
+    """ Input:
+            urls: iterable of strings - urls that have since been fetched
+        Rewrites "skipped_url.log" without them.
+    """
+    urls = set(urls)
+    path = get_skipped_log_path()
+    if not urls or not os.path.exists(path):
+        return
+    with open(path, 'r') as f:
+        keep = [l for l in f if l.strip() and l.strip() not in urls]
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        f.writelines(keep)
+    os.replace(tmp_path, path)
+
+def write_json_atomic(path, obj):
+    """ Input:
+            path: string - where the json file should end up
+            obj: something json.dumps() can serialize
+        Writes obj to a temporary file in the same directory and then renames
+        it over "path", so an interrupted write never leaves a partial file
+        behind.
+    """
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'w') as f:
+        f.write(json.dumps(obj))
+    os.replace(tmp_path, path)
+
 def get_asset_path(*args):
     """ Inputs:
             *args: a list of strings corresponding to zero or more sub
                 directories within the "assets" directory and a filename.
         Output:
             Returns absolute path to the specified location within the assets
-            directory.
+            directory (see paths.py).
+    """
+    return paths.get_asset_path(*args)
+
+def get_val_dict_path(api_cat):
+    return get_asset_path('json','{}_dict.json'.format(api_cat))
+
+def add_to_val_dict(d, api_cat, results):
+    """ Input:
+            d: dictionary - url -> name
+            api_cat: string - the category the results belong to
+            results: list of dicts - the 'results' field of a page
+        Output:
+            d, with an entry added for every result. Films have a 'title'
+            rather than a 'name'.
     """
-    a = os.path.dirname(os.path.abspath(__file__))
-    return os.path.normpath(os.path.join(a, '..','..','assets',*args))
+    for i in results:
+        if api_cat == 'films': d[i['url']]=i['title']
+        else: d[i['url']]=i['name']
+    return d
 
-def url_to_val_dict(api_cat,v=True):
+def url_to_val_dict(api_cat,v=True,strict=False):
     """ Input:
             api_cat: string - the category we want to build dictionary for
+            strict: bool - if True, a page that can't be fetched raises
+                crawl_job.IncompleteCrawl rather than returning the partial
+                dictionary
         Output:
             d: dictionary - a dictionary with urls as keys and the names of the
                 resource located at those urls as the corresponding values.
 
             Also writes the dictionary to a json file, so that we don't need
-            to build it from the API more than once.
+            to build it from the API more than once. The file is written
+            atomically, and only once every page has been read. If a page
+            can't be fetched, the partial dictionary is returned and nothing
+            is written.
     """
-    url = 'https://swapi.co/api/{}/'.format(api_cat)
+    url = API_ROOT + '{}/'.format(api_cat)
     d = dict()
-    json_path = get_asset_path('json','{}_dict.json'.format(api_cat))
+    json_path = get_val_dict_path(api_cat)
     if not os.path.exists(json_path):
         while url != None:
             r = get_json(url)
-            for i in r['results']:
-                if api_cat == 'films': d[i['url']]=i['title']
-                else: d[i['url']]=i['name']
+            if r is None:
+                # leave the file unwritten, so the next call tries again
+                print('ERROR: could not fetch every {} page'.format(api_cat))
+                if strict:
+                    from .crawl_job import IncompleteCrawl
+                    raise IncompleteCrawl([url])
+                return d
+            d = add_to_val_dict(d, api_cat, r['results'])
             url = r['next']
-        with open(json_path, 'w') as f:
-            f.write(json.dumps(d))
+        write_json_atomic(json_path, d)
     else:
         with open(json_path, 'r') as f:
             d = json.load(f)
             if v: print('{} JSON loaded!'.format(api_cat))
     return d
-
-    #
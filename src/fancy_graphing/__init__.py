@@ -0,0 +1,6 @@
+"""
+Star Wars styled histograms of the People data.
+
+Nothing is imported here. matplotlib, scipy, astropy and PIL are only loaded
+once something is actually drawn.
+"""
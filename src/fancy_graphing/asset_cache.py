@@ -0,0 +1,100 @@
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from data_analysis import paths
+
+"""
+In-memory caches for the static assets used by every plot.
+
+Without these, every axes built its own FontProperties from the font file,
+and every figure opened starfield.png from disk and resized it with PIL.
+Fonts are cached by (file, size). Background images are decoded once, and
+the cropped and resized versions are kept in an LRU cache keyed by
+(image, figure width and height in pixels, dpi), so a batch of figures of the
+same size only resamples once. matplotlib's font manager and PIL are
+imported the first time a font or an image is asked for.
+"""
+
+STARJEDI = ('fonts', 'starjedi', 'Starjedi.ttf')
+STJELOGO = ('fonts', 'stjelogo', 'Stjldbl2.ttf')
+
+MAX_SCALED_IMAGES = 32
+
+_scaled = OrderedDict()
+_scaled_lock = threading.Lock()
+
+
+def asset_path(*args):
+    return paths.get_asset_path(*args)
+
+@lru_cache(maxsize=None)
+def get_font(parts=STARJEDI, size=None):
+    """ Input:
+            parts: tuple of strings - the path of the font file within the
+                assets directory
+            size: the font size, or None for the default
+        Output:
+            A FontProperties for the font. It's shared, so don't modify it.
+    """
+    from matplotlib import font_manager as fm
+    return fm.FontProperties(fname=asset_path(*parts), size=size)
+
+@lru_cache(maxsize=8)
+def load_image(imname):
+    """ Input:
+            imname: string - the name of an image in "assets/images"
+        Output:
+            The decoded PIL image. It's shared, so don't modify it.
+    """
+    from PIL import Image
+    img = Image.open(asset_path('images', imname))
+    img.load()
+    return img
+
+def scale_image(img, fig_size):
+    """ Input:
+            img: PIL image
+            fig_size: the figure's (width, height) in pixels
+        Output:
+            img, cropped and scaled so that it will fit the background of the
+            figure without any distortion
+    """
+    img_size = img.size
+    a = [i - j for i,j in zip(fig_size, img_size)]
+    b = [0,0]
+    small_axis = a.index(max(a))
+    crop_axis = a.index(min(a))
+    b[small_axis] = img_size[small_axis]
+    crop_size = int((img_size[small_axis]/fig_size[small_axis])*fig_size[crop_axis])
+    b[crop_axis] = crop_size
+    box = (0, 0, b[0], b[1])
+    return img.resize((int(fig_size[0]),int(fig_size[1])),box = box)
+
+def get_scaled_img(fig, imname='starfield.png'):
+    """ Input:
+            fig: matplotlib figure
+            imname: the name of the image in "assets/images"
+        Output:
+            The image cropped and scaled for the figure's size, from the
+            cache if a figure of this size has asked for it before.
+    """
+    fig_size = fig.get_size_inches()*fig.dpi
+    key = (imname, int(fig_size[0]), int(fig_size[1]), float(fig.dpi))
+    with _scaled_lock:
+        if key in _scaled:
+            _scaled.move_to_end(key)
+            return _scaled[key]
+    img = scale_image(load_image(imname), fig_size)
+    with _scaled_lock:
+        _scaled[key] = img
+        while len(_scaled) > MAX_SCALED_IMAGES:
+            _scaled.popitem(last=False)
+    return img
+
+def clear():
+    """ Empties every cache.
+    """
+    get_font.cache_clear()
+    load_image.cache_clear()
+    with _scaled_lock:
+        _scaled.clear()
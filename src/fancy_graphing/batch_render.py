@@ -0,0 +1,99 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from data_analysis import aggregates
+from data_analysis import snapshot
+from data_analysis import paths
+from .star_wars_grapher import StarGraph
+
+"""
+Renders a whole gallery of StarGraph figures in one go.
+
+A render is described by a list of plot specs, each a dict with 'x_col',
+'x_vals', 'output' (the image name) and optionally 'graph_type' and any other
+keyword argument StarGraph.plot() takes:
+
+    [{"x_col": "species", "x_vals": ["Human", "Droid"],
+      "graph_type": "cols", "output": "height_vs_species_2.jpg"}]
+
+A spec with "plot": "across" is drawn by StarGraph.plot_across() instead (a
+line per x_val across the films, like gender across films).
+
+The dataset is loaded (or built) once by the parent process and stored as a
+snapshot, and its aggregate cube is built and saved once too. Workers are
+handed the snapshot's dataset version, so they load that cube rather than
+hashing the frame and building their own. Each worker in the process pool reads that snapshot into its own
+frame when it starts (so the parent never pickles the frame to it), renders
+its figures headless with the Agg backend, and closes each figure once it is
+saved, even if saving fails.
+"""
+
+DEFAULT_SPECS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'specs', 'gallery.json')
+
+# the StarGraph method each kind of spec is drawn with
+PLOTS = {'hist': StarGraph.plot, 'across': StarGraph.plot_across}
+
+_graph = None
+
+
+def load_specs(path=DEFAULT_SPECS):
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def _init_worker(snap_path, version):
+    global _graph
+    _graph = StarGraph(df=snapshot.read_snapshot(snap_path), version=version,
+                       persist=True)
+
+def _render(spec, output_dir):
+    """ Input:
+            spec: dict - a plot spec
+            output_dir: string - where the image is written
+        Output:
+            (output path, seconds taken)
+    """
+    t0 = time.perf_counter()
+    kwargs = {k: v for k, v in spec.items() if k not in ('output', 'plot')}
+    out_path = os.path.join(output_dir, spec['output'])
+    plot = PLOTS[spec.get('plot', 'hist')]
+    try:
+        plot(_graph, save_fig=out_path, **kwargs)
+    finally:
+        # a worker draws one figure at a time, so this closes whatever it
+        # drew, including a figure that failed part way through
+        plt.close('all')
+    return out_path, time.perf_counter() - t0
+
+def render_all(specs, output_dir=None, workers=None):
+    """ Input:
+            specs: list of dicts - plot specs
+            output_dir: string or None - defaults to "assets/images"
+            workers: int or None - the size of the process pool. None uses
+                every core.
+        Output:
+            timings: list of (output path, seconds), in spec order
+    """
+    output_dir = output_dir or paths.get_asset_path('images')
+    # makes sure the snapshot exists, building the dataset if it has to
+    StarGraph(columns=['name']).df
+    snap_path = paths.get_asset_path('dataframe.snapshot')
+    df = snapshot.read_snapshot(snap_path)
+    version = snapshot.read_dataset_version(snap_path) or \
+        snapshot.dataset_version(df)
+    # built (or loaded) and saved here, so the workers only ever load it
+    aggregates.get_cube(df, version, persist=True)
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(snap_path, version)) as pool:
+        futures = [pool.submit(_render, spec, output_dir) for spec in specs]
+        timings = [f.result() for f in futures]
+    for path, seconds in timings:
+        print('{:>8.2f}s  {}'.format(seconds, path))
+    print('{:>8.2f}s  total for {} figures'.format(time.perf_counter() - t0,
+                                                   len(timings)))
+    return timings
@@ -0,0 +1,184 @@
+import weakref
+import numpy as np
+import pandas as pd
+from data_analysis import snapshot
+from data_analysis.masks import valid_mask
+# the binning is shared with the aggregate cube, so both give the same edges
+from data_analysis.aggregates import bin_edges, bin_codes
+
+"""
+Shared, cached histogram binning for the faceted height plots.
+
+astropy's hist() with bins='freedman' works out bin edges and counts from
+scratch for every group, every time a figure is drawn. A HistEngine instead
+works out one set of bin edges per (y column, rule) from all of the valid
+values, then counts every group at once: each row gets a code of
+group * n_bins + bin, and a single np.bincount gives the whole
+(groups x bins) table. Tables are memoized by dataset version and parameters,
+so re-drawing or re-styling a figure never re-bins, and add_rows() folds new
+rows into the existing tables with the existing edges.
+
+The counts are drawn with ax.hist(edges[:-1], bins=edges, weights=counts),
+which gives the same bars as binning the raw values would.
+"""
+
+
+class HistEngine():
+    def __init__(self, df, version=0):
+        """ Input:
+                df: Pandas DataFrame - the data to bin
+                version: anything hashable - identifies the state of df.
+                    Results are memoized under it, so pass a new version (or
+                    call invalidate()) if df is changed other than through
+                    add_rows().
+        """
+        self.df = df
+        self.version = version
+        self._edges = dict()
+        self._tables = dict()
+
+    def invalidate(self, version=None):
+        """ Input:
+                version: anything hashable or None - the new version of df.
+                    If None, one is derived from the current version (as
+                    add_rows() does), which works for string versions too.
+        """
+        self.version = version if version is not None \
+            else _next_version(self.version)
+        self._edges.clear()
+        self._tables.clear()
+
+    @staticmethod
+    def _values(df, y_col, x_col=None):
+        """ Output:
+                values: the valid values of y_col, as floats
+                ok: the mask of rows they came from (rows where x_col is
+                    also valid, if given)
+        """
+        ok = valid_mask(df[y_col])
+        if x_col is not None:
+            ok &= valid_mask(df[x_col])
+        y = df[y_col].values[ok]
+        return pd.to_numeric(pd.Series(y), errors='coerce').values \
+            .astype('float64'), ok
+
+    def edges(self, y_col, rule='freedman'):
+        """ Output:
+                The bin edges shared by every group for y_col under rule.
+        """
+        key = (self.version, y_col, rule)
+        if key not in self._edges:
+            values, ok = self._values(self.df, y_col)
+            self._edges[key] = bin_edges(values[~np.isnan(values)], rule)
+        return self._edges[key]
+
+    def _count(self, df, x_col, y_col, edges, groups):
+        """ Counts df into a (groups x bins) table. groups is a dict of
+        value -> row, and is extended with any new values.
+        """
+        values, ok = self._values(df, y_col, x_col)
+        keys = df[x_col].values[ok]
+        codes, uniques = pd.factorize(keys)
+        for u in uniques:
+            groups.setdefault(u, len(groups))
+        group_of = np.array([groups[u] for u in uniques], dtype='int64')
+        bins = bin_codes(values, edges)
+        keep = (codes >= 0) & (bins >= 0)
+        n_bins = len(edges) - 1
+        flat = group_of[codes[keep]]*n_bins + bins[keep]
+        return np.bincount(flat, minlength=len(groups)*n_bins) \
+            .reshape(len(groups), n_bins)
+
+    def table(self, x_col, y_col, rule='freedman'):
+        """ Output:
+                edges: the shared bin edges
+                groups: dict - x value -> row of counts
+                counts: numpy int array - (groups x bins)
+        """
+        key = (self.version, x_col, y_col, rule)
+        if key not in self._tables:
+            edges = self.edges(y_col, rule)
+            groups = dict()
+            counts = self._count(self.df, x_col, y_col, edges, groups)
+            self._tables[key] = (edges, groups, counts)
+        return self._tables[key]
+
+    def counts(self, x_col, y_col, x_vals, rule='freedman'):
+        """ Input:
+                x_col: string - the column to group by
+                y_col: string - the column to bin
+                x_vals: list - the groups wanted
+                rule: the binning rule (see bin_edges)
+            Output:
+                edges: the shared bin edges
+                counts: dict - x value -> numpy array of counts per bin. Values
+                    with no rows get all zeros. An 'any'/'all' value gets the
+                    counts for every group together.
+        """
+        edges, groups, table = self.table(x_col, y_col, rule)
+        out = dict()
+        for v in x_vals:
+            if isinstance(v, str) and v.lower()[:3] in {'any', 'all'}:
+                out[v] = table.sum(axis=0)
+            elif v in groups:
+                out[v] = table[groups[v]]
+            else:
+                out[v] = np.zeros(len(edges) - 1, dtype='int64')
+        return edges, out
+
+    def add_rows(self, new_df):
+        """ Input:
+                new_df: Pandas DataFrame - rows being added to the dataset.
+            Appends new_df to the engine's frame and adds its counts to every
+            table already built, keeping their edges (values that fall
+            outside the edges aren't counted until the next invalidate()).
+            The dataset version is bumped.
+        """
+        self.df = pd.concat([self.df, new_df])
+        self.version = _next_version(self.version)
+        tables = dict()
+        for (v, x_col, y_col, rule), (edges, groups, counts) in \
+                self._tables.items():
+            extra = self._count(new_df, x_col, y_col, edges, groups)
+            grown = np.zeros_like(extra)
+            grown[:counts.shape[0]] = counts
+            tables[(self.version, x_col, y_col, rule)] = \
+                (edges, groups, grown + extra)
+            self._edges[(self.version, y_col, rule)] = edges
+        self._tables = tables
+
+
+def _next_version(version):
+    """ Output:
+            A version that differs from version: the next int for ints, and
+            (version, 1) for anything else, such as a snapshot hash.
+    """
+    return version + 1 if isinstance(version, int) else (version, 1)
+
+
+_engines = dict()
+
+def get_engine(df, version=None):
+    """ Input:
+            df: Pandas DataFrame
+            version: string or None - the dataset version of df, if the
+                caller knows it (e.g. from the snapshot). None hashes df.
+        Output:
+            The HistEngine for df at that version, shared between calls so its
+            memoized tables are reused for as long as df is alive and
+            unchanged. A frame changed in place gets a new version, and so a
+            new engine.
+    """
+    if version is None:
+        version = snapshot.dataset_version(df)
+    key = id(df)
+    if key in _engines:
+        ref, engine = _engines[key]
+        if ref() is df and engine.version == version:
+            return engine
+    engine = HistEngine(df, version)
+    def forget(ref):
+        if _engines.get(key, (None,))[0] is ref:
+            del _engines[key]
+    _engines[key] = (weakref.ref(df, forget), engine)
+    return engine
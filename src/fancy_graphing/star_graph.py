@@ -2,11 +2,13 @@ import numpy as np
 import pandas as pd
 import matplotlib
 import matplotlib.pyplot as plt
-from matplotlib import font_manager as fm
-from PIL import Image
-from astropy.visualization import hist
 from scipy.stats import norm
 import os
+from data_analysis import aggregates
+from data_analysis import snapshot
+from data_analysis.masks import MaskEngine
+from . import asset_cache
+from . import hist_engine
 
 def axis_style(ax,title,alpha=.1):
     """ Input:
@@ -17,9 +19,7 @@ def axis_style(ax,title,alpha=.1):
         sets the alpha of the axes to a small number so the background image
         can be seen. adds a title in a cool star wars font.
     """
-    asset_dir = os.environ['ASSET_DIR']
-    fpath = os.path.join(asset_dir,'fonts','starjedi','Starjedi.ttf' )
-    prop = fm.FontProperties(fname=fpath)
+    prop = asset_cache.get_font(asset_cache.STARJEDI)
     ax.patch.set_facecolor((1, 1, 1, alpha))
     ax.patch.set_linewidth(2)
     ax.tick_params(axis='both', colors='white')
@@ -43,9 +43,7 @@ def make_it_cool(fig, col_vals, bbox, main_title, mt_size, alpha=.1):
         sets the position of the background image. adds a title to the figure
         in a cool star wars font.
     """
-    asset_dir = os.environ['ASSET_DIR']
-    fpath = os.path.join(asset_dir,'fonts','stjelogo','Stjldbl2.ttf' )
-    prop = fm.FontProperties(fname=fpath)
+    prop = asset_cache.get_font(asset_cache.STJELOGO)
     fig.get_children()[1].axis("off")
     fig.get_children()[1].set_position(bbox)
     if len(fig.get_children()) > 3:
@@ -74,19 +72,12 @@ def intersect_not_nan_mask(df, col1, col2, val='any'):
             where "species" is "Human" and height is not NaN or "unknown" by
             passing this function df=df, col1="species", col2="height",
             val="Human".
-    I tried to make this readable, but it still might be a little
-    cryptic. Using lambda functions and apply is a lot faster than
-    iterating through the items in the dataframe though (moving from pandas
-    space into python space always slows us down a lot)
+    The work is done by a MaskEngine, which compares whole columns at once
+    rather than running a python function per row. If you need masks for
+    several values of col1, build one MaskEngine and call its masks() method
+    instead, so the columns are only scanned once.
     """
-    if val.lower()[:3] in {'any', 'all'}:
-        return df.apply(lambda x: True if not (pd.isna(x[col1]) \
-                or (x[col1]=='unknown') or pd.isna(x[col2]) \
-                or (x[col2]=='unknown')) else False, axis=1)
-    else:
-        return df.apply(lambda x: True if not (pd.isna(x[col1]) \
-            or (x[col1]=='unknown') or pd.isna(x[col2]) \
-            or (x[col2]=='unknown') or (x[col1]!=val)) else False, axis=1)
+    return MaskEngine(df).mask(col1, col2, val)
 
 
 
@@ -110,37 +101,36 @@ def get_scaled_img(fig,imname='starfield.png'):
                 directory that we'd like to use as a background image
         Output:
             img: an image that has been cropped and scaled so that it will fit
-                the background of fig without any distortion
+                the background of fig without any distortion. Images are
+                decoded and scaled once per figure size, and then served from
+                asset_cache.
     """
-    fig_size = fig.get_size_inches()*fig.dpi
-    impath = os.path.join(os.environ['ASSET_DIR'],'images',imname)
-    img = Image.open(impath)
-    img_size = img.size
-    a = [i - j for i,j in zip(fig_size, img_size)]
-    b = [0,0]
-    small_axis = np.argmax(a)
-    crop_axis = np.argmin(a)
-    b[small_axis] = img_size[small_axis]
-    crop_size = int((img_size[small_axis]/fig_size[small_axis])*fig_size[crop_axis])
-    b[crop_axis] = crop_size
-    box = (0, 0, b[0], b[1])
-    img = img.resize((int(fig_size[0]),int(fig_size[1])),box = box)
-    return img
+    return asset_cache.get_scaled_img(fig, imname)
 
-def plot_in_cols(quant_list, col1_vals, graph_width, hmin, hmax,
-                 bin_val, htype, title_str):
+def draw_counts(ax, edges, counts, **kwargs):
     """ Input:
-            quant_list: list - for each item in col1_vals "i", this list
-                contains a corresponding item. This item is a list containing
-                a boolean index. If the item in col1 has a value of "i", and
-                the corresponding item in col2 exists and is not "unknown",
-                then it has a value of True, otherwise it has a value of False.
+            ax: matplotlib axes
+            edges: numpy array - bin edges from a HistEngine
+            counts: numpy array - the count in each bin
+            kwargs: passed on to ax.hist (histtype, alpha, density, label...)
+        Draws a histogram from counts that have already been binned. Weighting
+        one point per bin gives the same bars as binning the raw values.
+    """
+    return ax.hist(edges[:-1], bins=edges, weights=counts, **kwargs)
+
+def plot_in_cols(fits, col1_vals, graph_width, hmin, hmax,
+                 edges, counts, htype, title_str):
+    """ Input:
+            fits: list - for each item in col1_vals "i", the mean and
+                standard deviation of the normal distribution fitted to the
+                valid col2 values of the rows where col1 is "i".
             col1_vals: a list containing the names of the items in col1 for
                 which we want to make comparison graphs
             graph_width: int - the width of the graph in inches
             hmin: int - the smallest value contained in col2
             hmax: int - the largest value contained in col2
-            bin_val: string - the binning algorithm to be used
+            edges: numpy array - the bin edges shared by every histogram
+            counts: dict - for each item in col1_vals, its count in each bin
             htype: the type of histogram to draw
             title_str: string - a string which will be made into the title in
                 the following way:
@@ -155,15 +145,14 @@ def plot_in_cols(quant_list, col1_vals, graph_width, hmin, hmax,
     img = get_scaled_img(fig)
     ax_im = plt.imshow(img)
     plt.axis('off')
-    for v1, v2, i in zip(quant_list, col1_vals, range(clen)):
+    for (mu, std), v2, i in zip(fits, col1_vals, range(clen)):
         if len(ax_list)==0: ax = fig.add_subplot(plot_height,2,i+1, alpha=0)
         else:
             ax = fig.add_subplot(plot_height,2,i+1, alpha=0,
                                 sharex=ax_list[0],sharey=ax_list[0])
         ax_list.append(ax)
-        n, bins, patches = hist(v1, bins=bin_val, ax=ax,
-                                histtype=htype, alpha=0.7, density=True)
-        mu, std = norm.fit(v1)
+        n, bins, patches = draw_counts(ax, edges, counts[v2],
+                                       histtype=htype, alpha=0.7, density=True)
         x = np.linspace(hmin, hmax, 100)
         y = norm.pdf(x, mu, std)
         c = match_hist_color(fig)
@@ -171,20 +160,19 @@ def plot_in_cols(quant_list, col1_vals, graph_width, hmin, hmax,
         ax.set_title(title_str.format(col1_vals[i]))
     return fig, ax_list
 
-def plot_single_axis(quant_list, col1_vals, graph_width, hmin, hmax,
-                     bin_val, htype, add_legend=True):
+def plot_single_axis(fits, col1_vals, graph_width, hmin, hmax,
+                     edges, counts, htype, add_legend=True):
     """ Input:
-            quant_list: list - for each item in col1_vals "i", this list
-                contains a corresponding item. This item is a list containing
-                a boolean index. If the item in col1 has a value of "i", and
-                the corresponding item in col2 exists and is not "unknown",
-                then it has a value of True, otherwise it has a value of False.
+            fits: list - for each item in col1_vals "i", the mean and
+                standard deviation of the normal distribution fitted to the
+                valid col2 values of the rows where col1 is "i".
             col1_vals: a list containing the names of the items in col1 for
                 which we want to make comparison graphs
             graph_width: int - the width of the graph in inches
             hmin: int - the smallest value contained in col2
             hmax: int - the largest value contained in col2
-            bin_val: string - the binning algorithm to be used
+            edges: numpy array - the bin edges shared by every histogram
+            counts: dict - for each item in col1_vals, its count in each bin
             htype: the type of histogram to draw
             add_legend: should a legend be added?
 
@@ -194,11 +182,10 @@ def plot_single_axis(quant_list, col1_vals, graph_width, hmin, hmax,
     img = get_scaled_img(fig)
     ay.imshow(img)
     ax = fig.add_subplot(111)
-    print(hmin, hmax)
-    for v1, v2, i in zip(quant_list, col1_vals, range(clen)):
-        n, bins, patches = hist(v1, bins=bin_val, histtype=htype, alpha=0.7,
-                                density=True, label=col1_vals[i])
-        mu, std = norm.fit(v1)
+    for (mu, std), v2, i in zip(fits, col1_vals, range(clen)):
+        n, bins, patches = draw_counts(ax, edges, counts[v2], histtype=htype,
+                                       alpha=0.7, density=True,
+                                       label=col1_vals[i])
         x = np.linspace(hmin,hmax,100)
         y = norm.pdf(x, mu, std)
         c = match_hist_color(fig)
@@ -206,16 +193,15 @@ def plot_single_axis(quant_list, col1_vals, graph_width, hmin, hmax,
         ax = axis_style(ax,"", alpha=0)
         ax.tick_params('both',labelsize=16)
     if add_legend:
-        asset_dir = os.environ['ASSET_DIR']
-        fpath = os.path.join(asset_dir,'fonts','starjedi','Starjedi.ttf' )
-        prop = fm.FontProperties(fname=fpath,size=22)
+        prop = asset_cache.get_font(asset_cache.STARJEDI, size=22)
         plt.legend(loc='upper right',prop=prop, bbox_to_anchor=[1,.95])
     return fig, ax, patches
 
 def plot_df_hist(df, col1, col1_vals, col2='height', graph_width=10,
                     plot_type='cols', bin_val='freedman', htype='stepfilled',
                     title_str='{}', bbox = [.05,.05,.95,.95],
-                    main_title="Height Across Species",mt_size=36):
+                    main_title="Height Across Species",mt_size=36,
+                    version=None):
     """ Inputs:
             df: Pandas DataFrame - contains the data we want to graph
             col1: string - the name of the column containing the independent
@@ -233,7 +219,12 @@ def plot_df_hist(df, col1, col1_vals, col2='height', graph_width=10,
             graph_width: int - the width of the graph to be outputted, in inches
             plot_type: string - if "cols", each item in col1_vals will be given
                 a different axes, and these axes will be plotted in two row.
-            bin_val: string - the binning algorithm to be used.
+            bin_val: string - the binning algorithm to be used. Bin edges are
+                worked out once over all of col2 and shared by every
+                histogram. The counts and normal fits are read from the
+                aggregate cube for df when it covers col1, col2 and bin_val,
+                and otherwise come from the shared HistEngine for df, so
+                drawing the same data again doesn't re-bin it.
             htype: string - how should the histogram be drawn
             title_str: string - a string which will be made into the title in
                 the following way:
@@ -245,6 +236,9 @@ def plot_df_hist(df, col1, col1_vals, col2='height', graph_width=10,
                 image
             main_title: string - the title of the entire figure
             mt_size: int or string - the size of the main title text.
+            version: string or None - the dataset version of df (e.g. from
+                snapshot.read_dataset_version()). If None, df is hashed once
+                to work it out.
         Output:
             fig: matplotlib figure
             ax: matplotlib axes, or a sequence of axes
@@ -252,25 +246,38 @@ def plot_df_hist(df, col1, col1_vals, col2='height', graph_width=10,
     ax_list = []
     hmax = 0
     hmin = 500
-    quant_list = []
-    for i in range(len(col1_vals)):
-        x = col1_vals[i]
-        quant_mask = intersect_not_nan_mask(df, col1, col2, x)
-        quant_list.append(df[col2][quant_mask])
-        for j in df[quant_mask][col2]:
-            n = int(j)
-            if n > hmax: hmax = n
-            if n < hmin: hmin = n
+    fits = []
+    version = version or snapshot.dataset_version(df)
+    cube = aggregates.get_cube(df, version) \
+        if aggregates.covers(col1, col2, bin_val) else None
+    if cube is not None and cube.covers(col1, col2, bin_val):
+        for v in col1_vals:
+            s = cube.stats(col1, col2, v)
+            if s['count']:
+                hmax = max(hmax, int(s['max']))
+                hmin = min(hmin, int(s['min']))
+            fits.append(cube.normal_fit(col1, col2, v))
+        edges, counts = cube.histogram(col1, col2, col1_vals)
+    else:
+        quant_masks = MaskEngine(df).masks(col1, col2, col1_vals)
+        for quant_mask in quant_masks:
+            quant = df[col2][quant_mask]
+            fits.append(norm.fit(quant))
+            if len(quant):
+                hmax = max(hmax, int(quant.max()))
+                hmin = min(hmin, int(quant.min()))
+        edges, counts = hist_engine.get_engine(df, version).counts(
+            col1, col2, col1_vals, bin_val)
     if plot_type == 'cols':
-        fig, ax = plot_in_cols(quant_list, col1_vals, graph_width,
-                                    hmin, hmax, bin_val, htype, title_str)
+        fig, ax = plot_in_cols(fits, col1_vals, graph_width,
+                               hmin, hmax, edges, counts, htype, title_str)
         make_it_cool(fig, col1_vals, bbox, main_title, mt_size)
         return fig, ax
     elif plot_type == 'style_test':
         pass
     else:
-        fig, ax, p = plot_single_axis(quant_list, col1_vals, graph_width,
-                                   hmin, hmax, bin_val, htype)
+        fig, ax, p = plot_single_axis(fits, col1_vals, graph_width,
+                                      hmin, hmax, edges, counts, htype)
         make_it_cool(fig, col1_vals, bbox, main_title, mt_size)
         return fig, ax
     return
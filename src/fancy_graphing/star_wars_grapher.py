@@ -0,0 +1,358 @@
+import os
+from data_analysis import metrics
+from data_analysis import paths
+from . import asset_cache
+
+# pandas, matplotlib, scipy and the data_analysis modules that need pandas are
+# imported where they're first used, so importing this module (or making a
+# StarGraph) doesn't pay for them.
+
+
+class StarGraph():
+    def __init__(self, refresh=False, columns=None, df=None, version=None,
+                 persist=False):
+        """ Input:
+                refresh: bool - passed to get_df()
+                columns: list of strings or None - passed to get_df()
+                df: Pandas DataFrame or None - a cleaned frame to plot. If
+                    None, the stored dataset is loaded by get_df() the first
+                    time the df attribute is used.
+                version: string or None - the dataset version of df, if
+                    known (e.g. snapshot.read_dataset_version()). Read from
+                    the snapshot when the stored dataset is loaded, and
+                    otherwise worked out by hashing df when it's needed.
+                persist: bool - True if df is the stored dataset, whose
+                    aggregate cube is then kept in assets/aggregates (see
+                    aggregates.get_cube()). Set when the stored dataset is
+                    loaded; any other frame only gets an in-memory cube.
+        """
+        self.refresh = refresh
+        self.columns = columns
+        self._df = df
+        self.version = version
+        self.persist = persist
+        self._mask_engine = None
+        self._hist_engine = None
+        self._cube = None
+
+    @property
+    def df(self):
+        if self._df is None:
+            self._df = self.get_df(self.refresh, self.columns)
+            self.persist = self.columns is None
+            if self.columns is None and self.version is None:
+                # the snapshot knows its own version, which saves hashing df
+                from data_analysis import snapshot
+                self.version = snapshot.read_dataset_version(
+                    paths.get_asset_path('dataframe.snapshot'))
+        return self._df
+
+    @property
+    def cube(self):
+        if self._cube is None:
+            from data_analysis import aggregates
+            df = self.df
+            self._cube = aggregates.get_cube(df, self.version, self.persist)
+        return self._cube
+
+    @property
+    def mask_engine(self):
+        if self._mask_engine is None:
+            from data_analysis.masks import MaskEngine
+            self._mask_engine = MaskEngine(self.df)
+        return self._mask_engine
+
+    @property
+    def hist_engine(self):
+        if self._hist_engine is None:
+            from . import hist_engine
+            self._hist_engine = hist_engine.get_engine(self.df,
+                                                       self.version)
+        return self._hist_engine
+
+    @property
+    def starjedi(self):
+        return asset_cache.get_font(asset_cache.STARJEDI)
+
+    @property
+    def stjelog(self):
+        return asset_cache.get_font(asset_cache.STJELOGO)
+
+    def get_df(self, refresh=False, columns=None):
+        """ Input:
+                refresh: bool - if True and the data has already been stored,
+                    it is brought up to date with the API by
+                    sync.sync_people(), which only patches in new and changed
+                    people, and a summary of the changes is printed.
+                columns: list of strings or None - if given, only these
+                    columns are read from the snapshot.
+            Output:
+                df: Pandas DataFrame - a data frame containing the information
+                    stored in the Star Wars API People resources. This data
+                    is modified by the cleanup() function in df_utilities.
+                    This dataframe is stored to the computer as a typed binary
+                    snapshot (dataframe.snapshot), which is what gets read
+                    back, and is also exported as dataframe.csv.
+        """
+        import pandas as pd
+        from data_analysis import df_utilities
+        from data_analysis import sync
+        from data_analysis import async_crawler
+        from data_analysis import snapshot
+        df_path = paths.get_asset_path('dataframe.csv')
+        snap_path = paths.get_asset_path('dataframe.snapshot')
+        if os.path.exists(snap_path) and not refresh:
+            return snapshot.read_snapshot(snap_path, columns)
+        if os.path.exists(snap_path):
+            df = snapshot.read_snapshot(snap_path)
+        elif os.path.exists(df_path):
+            df = pd.read_csv(df_path, index_col = 0)
+        else:
+            # fetch the url dictionaries up front, rather than one page at a
+            # time from inside cleanup()
+            async_crawler.prefetch_reference()
+            df = async_crawler.build_dataframe_async()
+            df = df_utilities.cleanup(df)
+            refresh = False
+        if refresh:
+            df, state, summary = sync.sync_people(df)
+            sync.print_summary(summary)
+            sync.save_state(state)
+        df.to_csv(df_path)
+        snapshot.write_snapshot(df, snap_path)
+        return snapshot.read_snapshot(snap_path, columns)
+
+    def plot(self, x_col, x_vals, y_col='height', graph_width=10,
+                    graph_type='cols', bin_val='freedman', htype='stepfilled',
+                    title_str='{}', bbox=[.05,.05,.95,.95], main_title="",
+                    mt_size=36, add_norm=True, alpha=.7, save_fig=None,
+                    ax_alpha=.1, add_legend=False):
+        """ Inputs:
+                x_col: string - the name of the column containing the
+                    independent variable
+                x_vals: list of strings - the names of the values within x_col
+                    which we would like to compare
+                y_col: string - the name of the column containing the dependent
+                    variable
+                graph_width: int - the width of the graph in inches
+                graph_type: string - the type of graph. 'cols' will plot each
+                    item in x_vals on a separate suplot, with the subplots
+                    arranged in two columns. 'single' will plot all the items
+                    in x_vals on a single axes.
+                bin_val: string - the name of the bin algorithm to use
+                htype: string - the histogram type
+                title_str: string - a string which will be made into the title
+                    in the following way:
+                            title_str.format("value contained in x_vals")
+                    With the current setup, the unmodified x_val entry will be
+                    displayed.
+                bbox: sequence - this will be treated as a matplotlib boundary
+                    box for the purposes of setting the position for the
+                    background image
+                main_title: string - the title of the entire figure
+                mt_size: int or string - the size of the main title text.
+                add_norm: whether a normal distribution should be fitted to the
+                    data and plotted over each axes.
+                alpha: float - the alpha value to apply to histograms
+                save_fig: string - the name to save the figure as. Relative
+                    names are saved in the image directory.
+                ax_alpha: float - the alpha value to apply to the axes
+            Output:
+                ax: matplotlib axes
+                fig: matplotlib figure
+                Also saves a figure to the image directory if save_fig is given.
+        """
+        self.x_vals = x_vals
+        self.x_col = x_col
+        self.y_col = y_col
+        self.graph_width = graph_width
+        self.graph_type = graph_type
+        self.bin_val = bin_val
+        self.htype = htype
+        self.quant_list = []
+        self.title_str = title_str
+        self.bbox = bbox
+        self.main_title = main_title
+        self.mt_size=mt_size
+        self.add_norm = add_norm
+        self.alpha = alpha
+        self.ax_alpha=ax_alpha
+        self.add_legend=add_legend
+        from data_analysis import aggregates
+        if aggregates.covers(x_col, y_col, bin_val) and \
+                self.cube.covers(x_col, y_col, bin_val):
+            # the range, normal fits and counts were all worked out when the
+            # cube was built, so nothing here looks at the rows
+            with metrics.span('plot', phase='aggregate'):
+                self.hmin, self.hmax = self.cube.extent(y_col)
+                self.fits = [self.cube.normal_fit(x_col, y_col, v)
+                             for v in x_vals]
+                self.hist_edges, self.hist_counts = self.cube.histogram(
+                    x_col, y_col, x_vals)
+        else:
+            from scipy.stats import norm
+            self.hmax = self.df[y_col].max()
+            self.hmin = self.df[y_col].min()
+            with metrics.span('plot', phase='masks'):
+                for quant_mask in self.mask_engine.masks(x_col, y_col, x_vals):
+                    self.quant_list.append(self.df[y_col][quant_mask])
+                self.fits = [norm.fit(y) for y in self.quant_list]
+            with metrics.span('plot', phase='bin'):
+                self.hist_edges, self.hist_counts = self.hist_engine.counts(
+                    x_col, y_col, x_vals, bin_val)
+        with metrics.span('plot', phase='draw'):
+            if graph_type == 'cols':
+                self.fig, ax = self.plot_cols()
+            if graph_type == 'single':
+                self.fig, ax = self.plot_single()
+                with metrics.span('plot', phase='style'):
+                    self.fig = self.make_it_cool()
+            else:
+                pass
+        if save_fig:
+            with metrics.span('plot', phase='save'):
+                fig_path=paths.get_asset_path('images', save_fig)
+                self.fig.savefig(fig_path)
+        return self.fig, ax
+
+    def plot_across(self, x_col, x_vals, category='films', graph_width=8,
+                    proportion=False, main_title="", mt_size=28,
+                    save_fig=None, add_legend=True):
+        """ Inputs:
+                x_col: string - the name of the column to count, e.g. 'gender'
+                x_vals: list of strings - the values within x_col to draw a
+                    line for
+                category: string - the membership category along the x axis
+                    ('films', 'starships' or 'vehicles')
+                graph_width: int - the width (and height) of the graph in
+                    inches
+                proportion: bool - if True, each value is drawn as a share of
+                    the people with any of x_vals in that resource, rather
+                    than as a count
+                main_title, mt_size, save_fig, add_legend: as for plot()
+            Output:
+                fig: matplotlib figure
+                ax: matplotlib axes
+                Also saves a figure to the image directory if save_fig is given.
+        """
+        import matplotlib.pyplot as plt
+        from data_analysis.cooccurrence import crosstab
+        from data_analysis.membership import MembershipStore
+        from .star_graph import get_scaled_img
+        store = MembershipStore.from_frame(self.df)
+        table = crosstab(self.df[x_col].values, store, category)
+        table = table.reindex(x_vals, fill_value=0)
+        if proportion:
+            table = table / table.sum(axis=0).replace(0, 1)
+        self.x_vals = x_vals
+        self.main_title = main_title
+        self.mt_size = mt_size
+        self.bbox = [.05,.05,.95,.95]
+        self.fig, ay = plt.subplots(figsize=(graph_width, graph_width))
+        ay.imshow(get_scaled_img(self.fig))
+        ay.axis('off')
+        ax = self.fig.add_subplot(111)
+        x = range(table.shape[1])
+        for v in x_vals:
+            ax.plot(x, table.loc[v].values, linewidth=3, label=v)
+        ax.set_xticks(list(x))
+        ax.set_xticklabels(table.columns, rotation=45, ha='right')
+        ax = self.axis_style(ax, "", alpha=0)
+        ax.tick_params('both', labelsize=12)
+        if add_legend:
+            ax.legend(loc='upper right', prop=self.starjedi)
+        self.fig = self.make_it_cool()
+        if save_fig:
+            self.fig.savefig(paths.get_asset_path('images', save_fig))
+        return self.fig, ax
+
+    def plot_cols(self):
+        """
+        Plots histograms for x_vals in two columns
+        """
+        import matplotlib.pyplot as plt
+        from .star_graph import get_scaled_img
+        self.ax_list = []
+        xlen = len(self.x_vals)
+        self.plot_height = xlen // 2 + xlen % 2
+        self.fig = plt.figure(figsize=(self.graph_width, \
+                                        self.plot_height*(self.graph_width/2)))
+        img = get_scaled_img(self.fig)
+        ax_im = plt.imshow(img)
+        plt.axis('off')
+        for fit, c, i in zip(self.fits,self.x_vals,range(len(self.x_vals))):
+            if len(self.ax_list)==0:
+                ax = self.fig.add_subplot(self.plot_height,2, i+1, alpha=0)
+            else:
+                ax = self.fig.add_subplot(self.plot_height,2,i+1, alpha=0, \
+                                sharex=self.ax_list[0],sharey=self.ax_list[0])
+            self.ax_list.append(ax)
+            ax = self._hist(ax, c)
+            ax = self._plot_norm(fit, ax)
+        with metrics.span('plot', phase='style'):
+            self.fig = self.make_it_cool()
+        return self.fig, ax
+
+    def plot_single(self):
+        """
+        Plots histograms for x_vals on a single axes
+        """
+        import matplotlib.pyplot as plt
+        from .star_graph import get_scaled_img
+        self.fig, ay = plt.subplots(figsize=(self.graph_width,self.graph_width))
+        img = get_scaled_img(self.fig)
+        ay.imshow(img)
+        ay.axis('off')
+        ax = self.fig.add_subplot(111)
+        for fit, c, i in zip(self.fits,self.x_vals,range(len(self.x_vals))):
+            ax = self._hist(ax, c)
+            ax = self._plot_norm(fit, ax)
+            ax = self.axis_style(ax,"", alpha=0)
+            ax.tick_params('both',labelsize=16)
+        if self.add_legend:
+            plt.legend(loc='upper right',prop=self.starjedi, \
+                        bbox_to_anchor=[1,.95])
+        return self.fig, ax
+
+    def _hist(self, ax, label):
+        from .star_graph import draw_counts
+        # the counts come from the aggregate cube, or from the shared
+        # HistEngine for groupings and rules the cube doesn't cover
+        n, bins, patches = draw_counts(ax, self.hist_edges,
+                                       self.hist_counts[label],
+                                       histtype=self.htype, alpha=self.alpha,
+                                       density=True, label=label)
+        return ax
+
+    def _plot_norm(self, fit, ax):
+        import numpy as np
+        from scipy.stats import norm
+        from .star_graph import match_hist_color
+        mu, std = fit
+        x = np.linspace(self.hmin, self.hmax, 100)
+        y = norm.pdf(x, mu, std)
+        c = match_hist_color(self.fig)
+        l = ax.plot(x, y, color=c, linewidth=3, alpha=1)
+        return ax
+
+    def make_it_cool(self):
+        self.fig.get_children()[1].axis("off")
+        self.fig.get_children()[1].set_position(self.bbox)
+        if len(self.fig.get_children()) > 3:
+            for i, title in zip(self.fig.get_children()[2:], self.x_vals):
+                i = self.axis_style(i,title)
+        else:
+            pass
+        self.fig.suptitle(self.main_title,fontproperties=self.stjelog,
+                     color='#FFE81F', fontsize=self.mt_size)
+        return self.fig
+
+    def axis_style(self,ax,title,alpha=.1):
+        ax.patch.set_facecolor((1, 1, 1, alpha))
+        ax.patch.set_linewidth(2)
+        ax.tick_params(axis='both', colors='white')
+        ax.set_title(title, fontproperties=self.starjedi,
+                        color='white', size='xx-large')
+        ax.spines['left'].set_color('white')
+        ax.spines['bottom'].set_color('white')
+        return ax
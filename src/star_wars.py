@@ -1,9 +1,125 @@
-from data_analysis import df_utilities
+import argparse
+import threading
+from data_analysis import metrics
 
+# each command imports what it needs when it runs, so --help and the light
+# commands don't wait on pandas or matplotlib
 
-def main():
+
+def load_dataset():
+    """ Output:
+            df: Pandas DataFrame - the stored People frame, built (and stored)
+                first if this is a fresh checkout
+            version: string - its dataset version
+    """
+    from fancy_graphing.star_wars_grapher import StarGraph
+    graph = StarGraph()
+    return graph.df, graph.version
+
+def build(args):
+    from data_analysis import df_utilities
     df = df_utilities.build_dataframe()
 
+def train(args):
+    from data_analysis import regression
+    df, version = load_dataset()
+    names = args.features or regression.DEFAULT_FEATURES
+    X, y = regression.design_matrix(df, names)
+    cv = regression.cross_validate(X, y, args.folds)
+    print('{} rows, {}-fold cv mse {:.1f}, r2 {:.3f}'.format(
+        len(y), args.folds, cv['mean_mse'], cv['r2']))
+    model = regression.LinearModel(names, regression.fit(X, y))
+    low, high, _ = regression.bootstrap(X, y, args.bootstrap,
+                                        workers=args.workers)
+    for name, c, l, h in zip(['intercept'] + names, model.coef, low, high):
+        print('{:<20}{:>9.2f}  [{:.2f}, {:.2f}]'.format(name, c, l, h))
+    if args.search:
+        for mse, subset in regression.subset_search(
+                X, y, names, args.folds, workers=args.workers):
+            print('{:>9.1f}  {}'.format(mse, ', '.join(subset)))
+    model.save()
+
+def stats(args):
+    from data_analysis import aggregates
+    df, version = load_dataset()
+    cube = aggregates.get_cube(df, version, persist=True)
+    print(cube.summary(args.dimension, args.measure).to_string())
+
+def render(args):
+    from fancy_graphing import batch_render
+    specs = batch_render.load_specs(args.specs or batch_render.DEFAULT_SPECS)
+    batch_render.render_all(specs, args.output_dir, args.workers)
+
+def main():
+    parser = argparse.ArgumentParser(description='Star Wars API analysis.')
+    parser.add_argument('--metrics-log', default=None,
+                        help='time every stage, appending each span to this '
+                             'file as json, and write the totals to '
+                             '[file].summary.json at the end')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='time every stage, serving the metrics for '
+                             'Prometheus at http://127.0.0.1:[port]/metrics. '
+                             'Once the command is done, the final metrics '
+                             'are served until Ctrl-C')
+    commands = parser.add_subparsers(dest='command')
+    commands.add_parser('build', help='build the People dataframe')
+    p = commands.add_parser('render', help='render every figure in a list '
+                                           'of plot specs')
+    p.add_argument('specs', nargs='?', default=None,
+                   help='a json file of plot specs (defaults to the gallery '
+                        'in fancy_graphing/specs)')
+    p.add_argument('--output-dir', default=None,
+                   help='where to write the images (defaults to '
+                        'assets/images)')
+    p.add_argument('--workers', type=int, default=None,
+                   help='the number of render processes (defaults to the '
+                        'number of cores)')
+    p = commands.add_parser('train', help='fit the height regression and '
+                                          'save its coefficients')
+    p.add_argument('--features', nargs='+', default=None,
+                   help='the features to use (defaults to '
+                        'regression.DEFAULT_FEATURES)')
+    p.add_argument('--folds', type=int, default=5,
+                   help='the number of cross-validation folds')
+    p.add_argument('--bootstrap', type=int, default=1000,
+                   help='the number of bootstrap resamples')
+    p.add_argument('--search', action='store_true',
+                   help='also rank every subset of the features')
+    p.add_argument('--workers', type=int, default=None,
+                   help='the number of processes (defaults to the number '
+                        'of cores)')
+    p = commands.add_parser('stats', help='print the distribution of a '
+                                          'measure for every group of a '
+                                          'dimension')
+    p.add_argument('dimension', help='e.g. gender, species or films')
+    p.add_argument('measure', nargs='?', default='height',
+                   help='height, mass or birth_year')
+    args = parser.parse_args()
+    if args.metrics_log or args.metrics_port is not None:
+        metrics.enable(args.metrics_log)
+    server = None
+    if args.metrics_port is not None:
+        server, url = metrics.serve(port=args.metrics_port)
+    if args.command == 'render':
+        render(args)
+    elif args.command == 'train':
+        train(args)
+    elif args.command == 'stats':
+        stats(args)
+    else:
+        build(args)
+    if args.metrics_log:
+        metrics.dump(args.metrics_log + '.summary.json')
+    if server is not None:
+        # the server thread dies with the process, so keep it up until the
+        # final numbers have been scraped
+        print('Done. Serving the metrics at {} until Ctrl-C'.format(url))
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        server.shutdown()
+
 
 
 
@@ -0,0 +1,138 @@
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import pytest
+from data_analysis import aggregates
+from fancy_graphing.hist_engine import HistEngine
+
+
+def make_frame(n=500, seed=0):
+    rng = np.random.default_rng(seed)
+    height = rng.normal(170, 30, n).round()
+    height[rng.random(n) < .1] = np.nan
+    mass = rng.gamma(4, 20, n)
+    mass[rng.random(n) < .2] = np.nan
+    gender = rng.choice(['male', 'female', 'n/a', 'unknown'], n,
+                        p=[.5, .3, .1, .1]).astype(object)
+    gender[rng.random(n) < .05] = np.nan
+    species = rng.choice(['Human', 'Droid', 'Gungan', 'Wookiee'], n)
+    return pd.DataFrame({'name': ['p{}'.format(i) for i in range(n)],
+                         'height': height, 'mass': mass, 'gender': gender,
+                         'species': species})
+
+@pytest.fixture(scope='module')
+def df():
+    return make_frame()
+
+@pytest.fixture(scope='module')
+def cube(df):
+    return aggregates.AggregateCube.build(df, version='test', memberships=[],
+                                          rule='fd')
+
+def group_values(df, dim, measure, val):
+    ok = df[dim].notna() & (df[dim] != 'unknown')
+    if not aggregates.is_all(val):
+        ok &= df[dim] == val
+    v = df.loc[ok, measure].values.astype('float64')
+    return v[~np.isnan(v)]
+
+@pytest.mark.parametrize('dim,val', [('gender', 'male'),
+                                     ('gender', 'female'),
+                                     ('gender', 'n/a'),
+                                     ('gender', 'all'),
+                                     ('species', 'Gungan'),
+                                     ('species', 'all')])
+@pytest.mark.parametrize('measure', ['height', 'mass'])
+def test_percentiles_match_numpy(df, cube, dim, val, measure):
+    values = group_values(df, dim, measure, val)
+    s = cube.stats(dim, measure, val)
+    assert s['count'] == len(values)
+    np.testing.assert_allclose(
+        [s['min'], s['25%'], s['50%'], s['75%'], s['max']],
+        np.percentile(values, [0, 25, 50, 75, 100]))
+    q = [.01, .37, .9, .99]
+    np.testing.assert_allclose(cube.quantile(dim, measure, q, val),
+                               np.percentile(values, [1, 37, 90, 99]))
+    np.testing.assert_allclose(s['mean'], values.mean())
+    np.testing.assert_allclose(s['std'], values.std(ddof=1))
+
+def test_missing_group_has_no_stats(cube):
+    s = cube.stats('gender', 'height', 'hermaphrodite')
+    assert s['count'] == 0 and np.isnan(s['50%'])
+    assert np.isnan(cube.quantile('gender', 'height', .5, 'hermaphrodite'))
+
+@pytest.mark.parametrize('dim,vals', [
+    ('gender', ['male', 'female', 'n/a', 'any', 'hermaphrodite']),
+    ('species', ['Human', 'Droid', 'Gungan', 'Wookiee', 'all'])])
+@pytest.mark.parametrize('measure', ['height', 'mass'])
+def test_histogram_matches_hist_engine(df, cube, dim, vals, measure):
+    edges, counts = cube.histogram(dim, measure, vals)
+    engine_edges, engine_counts = HistEngine(df).counts(dim, measure, vals,
+                                                        'fd')
+    np.testing.assert_array_equal(edges, engine_edges)
+    for v in vals:
+        np.testing.assert_array_equal(counts[v], engine_counts[v])
+
+def test_histogram_matches_np_histogram(df, cube):
+    edges, counts = cube.histogram('species', 'height', ['Droid'])
+    expected, _ = np.histogram(group_values(df, 'species', 'height',
+                                            'Droid'), bins=edges)
+    np.testing.assert_array_equal(counts['Droid'], expected)
+
+def test_counts_match_value_counts(df, cube):
+    values, counts = cube.counts('gender', sort=True)
+    expected = df['gender'].value_counts()
+    assert dict(zip(values, counts)) == expected.to_dict()
+    assert list(counts) == sorted(counts, reverse=True)
+
+def test_save_and_load_round_trip(cube, tmp_path):
+    path = str(tmp_path / 'cube.npz')
+    cube.save(path)
+    loaded = aggregates.AggregateCube.load(path)
+    assert loaded.version == cube.version and loaded.rule == cube.rule
+    assert loaded.summary('species', 'height').equals(
+        cube.summary('species', 'height'))
+    assert [p.name for p in tmp_path.iterdir()] == ['cube.npz']
+
+def test_unknown_rule_is_rejected():
+    with pytest.raises(ValueError):
+        aggregates.bin_edges(np.arange(10.), 'no such rule')
+
+def test_covers_without_building():
+    assert aggregates.covers('species', 'height', 'freedman')
+    assert aggregates.covers('films')
+    assert not aggregates.covers('name')
+    assert not aggregates.covers('species', 'height', 'fd')
+
+@pytest.fixture
+def assets(monkeypatch, tmp_path):
+    monkeypatch.setenv('ASSET_DIR', str(tmp_path))
+    monkeypatch.setattr(aggregates, '_cubes', OrderedDict())
+    return tmp_path
+
+def test_get_cube_keeps_ad_hoc_cubes_off_the_disk(df, assets):
+    cube = aggregates.get_cube(df)
+    assert aggregates.get_cube(df) is cube
+    assert list(assets.iterdir()) == []
+
+def test_get_cube_holds_at_most_max_cubes(assets, monkeypatch):
+    monkeypatch.setattr(aggregates, 'MAX_CUBES', 2)
+    frames = [make_frame(50, seed) for seed in range(3)]
+    cubes = [aggregates.get_cube(f, 'v{}'.format(i))
+             for i, f in enumerate(frames)]
+    assert list(aggregates._cubes) == ['v1', 'v2']
+    # a hit makes a cube the most recently used one
+    assert aggregates.get_cube(frames[1], 'v1') is cubes[1]
+    aggregates.get_cube(frames[0], 'v0')
+    assert list(aggregates._cubes) == ['v1', 'v0']
+
+def test_persisted_cube_is_loaded_back(df, assets):
+    aggregates.get_cube(make_frame(50, 1), 'old', persist=True)
+    cube = aggregates.get_cube(df, 'stored', persist=True)
+    assert [p.name for p in (assets / 'aggregates').iterdir()] == \
+        ['stored.npz']
+    aggregates.forget()
+    loaded = aggregates.get_cube(df.iloc[:0], 'stored', persist=True)
+    assert loaded is not cube
+    assert loaded.summary('species', 'height').equals(
+        cube.summary('species', 'height'))
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from scipy import sparse
+from data_analysis.cooccurrence import CoAppearanceGraph, crosstab
+from data_analysis.membership import MembershipStore
+
+
+def make_store(n=60, seed=0):
+    rng = np.random.default_rng(seed)
+    categories = ['films']*6 + ['vehicles']*8 + ['starships']*4
+    # a few popular resources and many rare ones, and some people with
+    # exactly the same memberships, so signatures are shared
+    p = np.r_[[.6, .4, .3, .2, .2, .1], [.05]*8, [.1]*4]
+    m = rng.random((n, len(categories))) < p
+    m[n//2:n//2 + 8] = m[0]
+    m[-3:] = False
+    columns = ['{}-{}'.format(c, i) for i, c in enumerate(categories)]
+    return MembershipStore(sparse.csr_matrix(m), columns, np.arange(n),
+                           categories)
+
+@pytest.fixture(scope='module')
+def store():
+    return make_store()
+
+@pytest.fixture(scope='module', params=[None, {'films': 2., 'vehicles': .5}])
+def graph(request, store):
+    return CoAppearanceGraph(store, weights=request.param,
+                             labels=np.arange(store.matrix.shape[0]))
+
+def brute_force_pairs(graph):
+    a = sparse.triu(graph.adjacency(), k=1).tocoo()
+    return a.data, a.row, a.col
+
+@pytest.mark.parametrize('row', [0, 1, 5, 31, 59])
+@pytest.mark.parametrize('k', [1, 5, 100])
+def test_neighbors_match_adjacency(graph, row, k):
+    adj = graph.adjacency().toarray()
+    got = graph.neighbors(row, k)
+    expected = np.sort(adj[row][adj[row] > 0])[::-1][:k]
+    np.testing.assert_allclose(got.values, expected)
+    for other, w in got.items():
+        assert other != row
+        assert adj[row, other] == pytest.approx(w)
+
+@pytest.mark.parametrize('k', [1, 3, 10, 50])
+@pytest.mark.parametrize('max_nnz', [1, 50, 10**6])
+def test_top_pairs_match_adjacency(graph, k, max_nnz):
+    adj = graph.adjacency().toarray()
+    weights, rows, cols = brute_force_pairs(graph)
+    got = graph.top_pairs(k, max_nnz=max_nnz)
+    np.testing.assert_allclose(got['weight'].values,
+                               np.sort(weights)[::-1][:k])
+    pairs = set()
+    for a, b, w in got.itertuples(index=False):
+        assert adj[a, b] == pytest.approx(w)
+        pairs.add(frozenset((a, b)))
+    assert len(pairs) == len(got)
+
+def test_weight_matches_adjacency(graph):
+    adj = graph.adjacency()
+    for a, b in [(0, 1), (0, 30), (2, 2 + 30), (5, 59)]:
+        assert graph.weight(a, b) == pytest.approx(adj[a, b])
+
+def test_negative_weights_are_rejected(store):
+    with pytest.raises(ValueError):
+        CoAppearanceGraph(store, weights={'films': -1})
+
+def test_adjacency_refuses_large_graphs(graph):
+    with pytest.raises(ValueError):
+        graph.adjacency(max_edges=10)
+
+def test_crosstab_matches_dense_product(store):
+    rng = np.random.default_rng(1)
+    values = rng.choice(['a', 'b', 'c'], store.matrix.shape[0])
+    table = crosstab(values, store, 'films')
+    dense = store.matrix.toarray()[:, store.category_positions('films')]
+    for g in ['a', 'b', 'c']:
+        np.testing.assert_array_equal(table.loc[g].values,
+                                      dense[values == g].sum(axis=0))
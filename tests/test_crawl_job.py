@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from data_analysis import crawl_job
+from data_analysis import iterators
+from data_analysis import local_swapi
+from data_analysis import transport
+from data_analysis import web_utilities
+
+
+class FailingTransport():
+    """ Goes over the network, except for the urls in self.failing, which
+    get a 500. Remembers every url it was asked for.
+    """
+    def __init__(self, failing=()):
+        self.inner = transport.RequestsTransport()
+        self.failing = set(failing)
+        self.urls = []
+
+    def get(self, url, headers=None, session=None):
+        self.urls.append(url)
+        if url in self.failing:
+            return transport.RecordedResponse(500, b'')
+        return self.inner.get(url, headers=headers, session=session)
+
+@pytest.fixture(scope='module')
+def server():
+    server, root = local_swapi.serve(people=45, page_size=10)
+    yield root + 'people/'
+    server.shutdown()
+
+@pytest.fixture
+def failing(monkeypatch, tmp_path):
+    failing = FailingTransport()
+    monkeypatch.setattr(transport, '_transport', failing)
+    monkeypatch.setattr(web_utilities, '_cache', None)
+    monkeypatch.setattr(web_utilities, '_cache_off', True)
+    monkeypatch.setattr(web_utilities, 'MAX_RETRIES', 0)
+    monkeypatch.setenv('LOG_DIR', str(tmp_path))
+    return failing
+
+def make_job(url, tmp_path):
+    return crawl_job.CrawlJob(url, path=str(tmp_path / 'crawl'))
+
+def test_resume_after_a_failed_page(server, failing, tmp_path):
+    page_3 = server + '?page=3'
+    failing.failing.add(page_3)
+    job = make_job(server, tmp_path)
+    assert not job.run(rate=10**6)
+    assert job.missing() == [page_3]
+    assert job.done() == {1, 2, 4, 5}
+    assert web_utilities.read_skipped_urls() == [page_3]
+    with pytest.raises(crawl_job.IncompleteCrawl) as e:
+        job.build_dataframe()
+    assert e.value.missing == [page_3]
+
+    # a new job over the same checkpoints only fetches the missing page
+    failing.failing.clear()
+    failing.urls.clear()
+    job = make_job(server, tmp_path)
+    assert job.run(rate=10**6)
+    assert failing.urls == [page_3]
+    assert web_utilities.read_skipped_urls() == []
+    df = job.build_dataframe()
+    assert df.shape[0] == 45
+    assert list(df['name']) == ['Person {}'.format(i) for i in range(45)]
+    # the checkpoints are cleared once the frame is built
+    assert job.done() == set()
+
+def test_keep_checkpoints(server, failing, tmp_path):
+    job = make_job(server, tmp_path)
+    assert job.run(rate=10**6)
+    job.build_dataframe(keep=True)
+    assert job.done() == {1, 2, 3, 4, 5}
+
+def test_failed_first_page(server, failing, tmp_path):
+    failing.failing.add(server)
+    job = make_job(server, tmp_path)
+    assert not job.run(rate=10**6)
+    assert job.missing() == [server]
+
+def test_runs_inside_an_event_loop(server, failing, tmp_path):
+    # as in a Jupyter kernel, where asyncio.run() can't be called
+    async def inside():
+        job = make_job(server, tmp_path)
+        assert job.run(rate=10**6)
+        pages = list(iterators.iter_pages(url=server, rate=10**6))
+        return job.build_dataframe(), pages
+    df, pages = asyncio.run(inside())
+    assert df.shape[0] == 45
+    assert [len(p['results']) for p in pages] == [10, 10, 10, 10, 5]
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+from data_analysis import snapshot
+from fancy_graphing import hist_engine
+from fancy_graphing.hist_engine import HistEngine
+
+
+def make_frame(n=200, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'species': rng.choice(['Human', 'Droid', 'unknown'], n),
+        'height': rng.normal(170, 30, n).round()})
+
+def test_invalidate_with_a_string_version():
+    df = make_frame()
+    engine = HistEngine(df, snapshot.dataset_version(df))
+    edges, before = engine.counts('species', 'height', ['Human'], 'fd')
+    df.loc[df['species'] == 'Human', 'height'] = 170.
+    old = engine.version
+    engine.invalidate()
+    assert engine.version != old
+    edges, after = engine.counts('species', 'height', ['Human'], 'fd')
+    assert after['Human'].sum() == before['Human'].sum()
+    assert np.count_nonzero(after['Human']) == 1
+
+def test_add_rows_with_a_string_version():
+    df = make_frame()
+    engine = HistEngine(df, 'v1')
+    edges, before = engine.counts('species', 'height', ['Droid'], 'fd')
+    engine.add_rows(df[df['species'] == 'Droid'])
+    assert engine.version != 'v1'
+    edges, after = engine.counts('species', 'height', ['Droid'], 'fd')
+    np.testing.assert_array_equal(after['Droid'], 2*before['Droid'])
+
+def test_get_engine_sees_in_place_changes():
+    df = make_frame()
+    engine = hist_engine.get_engine(df)
+    assert hist_engine.get_engine(df) is engine
+    df.loc[0, 'height'] += 1
+    assert hist_engine.get_engine(df) is not engine
+    assert hist_engine.get_engine(df, 'known') is \
+        hist_engine.get_engine(df, 'known')
@@ -0,0 +1,83 @@
+import json
+import pytest
+from data_analysis import local_swapi
+from data_analysis import transport
+from data_analysis import web_utilities
+from data_analysis.http_cache import ResponseCache
+
+
+class RecordingTransport():
+    """ Goes over the network, and remembers the status of every response.
+    """
+    def __init__(self):
+        self.inner = transport.RequestsTransport()
+        self.statuses = []
+
+    def get(self, url, headers=None, session=None):
+        req = self.inner.get(url, headers=headers, session=session)
+        self.statuses.append(req.status_code)
+        return req
+
+@pytest.fixture(scope='module')
+def root():
+    server, root = local_swapi.serve(people=25)
+    yield root
+    server.shutdown()
+
+@pytest.fixture
+def recorder(monkeypatch):
+    recorder = RecordingTransport()
+    monkeypatch.setattr(transport, '_transport', recorder)
+    monkeypatch.setattr(web_utilities, 'REQUEST_DELAY', 0)
+    return recorder
+
+def use_cache(monkeypatch, tmp_path, **kwargs):
+    cache = ResponseCache(str(tmp_path / 'http_cache.sqlite'), **kwargs)
+    monkeypatch.setattr(web_utilities, '_cache', cache)
+    monkeypatch.setattr(web_utilities, '_cache_off', False)
+    return cache
+
+def test_fresh_hit_makes_no_request(root, recorder, monkeypatch, tmp_path,
+                                    capsys):
+    use_cache(monkeypatch, tmp_path, ttl=None)
+    url = root + 'people/?page=2'
+    first = web_utilities.get_json(url)
+    capsys.readouterr()
+    assert web_utilities.get_json(url) == first
+    assert recorder.statuses == [200]
+    # a cache hit isn't a visit
+    assert 'Visiting' not in capsys.readouterr().out
+
+def test_stale_entry_is_revalidated_with_304(root, recorder, monkeypatch,
+                                             tmp_path):
+    cache = use_cache(monkeypatch, tmp_path, ttl=0)
+    url = root + 'people/?page=1'
+    first = web_utilities.get_json(url)
+    body = cache.get(url).body
+    fetched_at = cache.get(url).fetched_at
+    second = web_utilities.get_json(url)
+    assert recorder.statuses == [200, 304]
+    assert second == first == json.loads(body)
+    entry = cache.get(url)
+    assert entry.body == body and entry.etag
+    assert entry.fetched_at >= fetched_at
+
+def test_revalidate_checks_fresh_entries(root, recorder, monkeypatch,
+                                         tmp_path):
+    use_cache(monkeypatch, tmp_path, ttl=None)
+    url = root + 'planets/?page=1'
+    first = web_utilities.get_json(url)
+    assert web_utilities.get_json(url, revalidate=True) == first
+    assert recorder.statuses == [200, 304]
+
+def test_offline_serves_only_from_cache(root, recorder, monkeypatch,
+                                        tmp_path):
+    monkeypatch.setenv('LOG_DIR', str(tmp_path))
+    cache = use_cache(monkeypatch, tmp_path, ttl=0)
+    url = root + 'films/?page=1'
+    first = web_utilities.get_json(url)
+    cache.offline = True
+    assert web_utilities.get_json(url) == first
+    assert web_utilities.get_json(root + 'films/?page=2') is None
+    assert recorder.statuses == [200]
+    assert web_utilities.read_skipped_urls() == [root + 'films/?page=2']
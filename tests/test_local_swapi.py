@@ -0,0 +1,67 @@
+import json
+import pytest
+import requests
+from data_analysis import local_swapi
+from data_analysis.relational import parse_id
+
+
+def make_people(n=30, skip=(17,)):
+    # like the real API, whose people skip id 17
+    people = local_swapi.SyntheticPeople(n)
+    return [people[i] for i in range(n) if i + 1 not in skip]
+
+@pytest.fixture(scope='module')
+def reference():
+    return local_swapi.load_reference()
+
+@pytest.fixture(scope='module')
+def root():
+    server, root = local_swapi.serve(people=make_people())
+    yield root
+    server.shutdown()
+
+def get(url):
+    req = requests.get(url)
+    return req.status_code, req.json() if req.status_code == 200 else None
+
+@pytest.mark.parametrize('category', ['starships', 'vehicles', 'planets',
+                                      'films'])
+def test_detail_is_looked_up_by_id(root, reference, category):
+    for url, name in reference[category].items():
+        i = parse_id(url)
+        status, record = get('{}{}/{}/'.format(root, category, i))
+        assert status == 200
+        assert parse_id(record['url']) == i
+        assert record['title' if category == 'films' else 'name'] == name
+
+def test_missing_ids_are_404(root, reference):
+    ids = set(parse_id(u) for u in reference['starships'])
+    missing = [i for i in range(1, max(ids) + 2) if i not in ids]
+    for i in missing[:5] + [max(ids) + 1]:
+        assert get('{}starships/{}/'.format(root, i))[0] == 404
+    assert get(root + 'people/17/')[0] == 404
+
+def test_people_detail_past_the_gap(root):
+    status, record = get(root + 'people/30/')
+    assert status == 200 and record['url'].endswith('/people/30/')
+
+def test_synthetic_people_by_id(reference):
+    people = local_swapi.SyntheticPeople(5, reference=reference)
+    assert people.by_id(5) == people[4]
+    assert people.by_id(0) is None and people.by_id(6) is None
+
+def test_pages_cover_every_record(root, reference):
+    names, url = [], root + 'starships/'
+    while url:
+        status, page = get(url)
+        assert status == 200
+        names += [r['name'] for r in page['results']]
+        url = page['next']
+    assert page['count'] == len(names) == len(reference['starships'])
+
+def test_etag_gets_304(root):
+    req = requests.get(root + 'films/1/')
+    again = requests.get(root + 'films/1/',
+                         headers={'If-None-Match': req.headers['ETag']})
+    assert again.status_code == 304 and again.content == b''
+    assert json.loads(req.content)['url'].endswith('/films/1/')
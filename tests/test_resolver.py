@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+from data_analysis.crawl_job import IncompleteCrawl
+from data_analysis.resolver import UrlResolver
+
+ROOT = 'https://swapi.co/api/'
+
+
+class FlakyLoader():
+    """ Fails to load 'films' the first `failures` times it is asked.
+    """
+    def __init__(self, failures=1):
+        self.failures = failures
+        self.calls = []
+
+    def __call__(self, category):
+        self.calls.append(category)
+        if category == 'films' and self.failures:
+            self.failures -= 1
+            raise IncompleteCrawl([ROOT + 'films/?page=2'])
+        return {'{}{}/{}/'.format(ROOT, category, i):
+                '{} {}'.format(category, i) for i in range(1, 4)}
+
+def test_incomplete_category_is_not_cached():
+    loader = FlakyLoader()
+    resolver = UrlResolver(['planets', 'films'], loader)
+    with pytest.raises(IncompleteCrawl):
+        resolver.name(ROOT + 'films/1/')
+    assert resolver.name(ROOT + 'films/1/') == 'films 1'
+    # planets loaded fine the first time, so only films was tried again
+    assert loader.calls == ['planets', 'films', 'films']
+
+def test_lookups_after_a_failure_resolve():
+    resolver = UrlResolver(['planets', 'films'], FlakyLoader())
+    with pytest.raises(IncompleteCrawl):
+        resolver.tables()
+    urls = [ROOT + 'planets/2/', ROOT + 'films/3/', 'Tatooine']
+    np.testing.assert_array_equal(resolver.resolve(urls),
+                                  ['planets 2', 'films 3', 'Tatooine'])
+    np.testing.assert_array_equal(resolver.decode(resolver.encode(urls[:2])),
+                                  ['planets 2', 'films 3'])